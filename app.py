@@ -13,7 +13,13 @@ import streamlit as st
 
 # Sea Watch moduulit
 import sea_watch_17 as sw
-from schedule_analyzer import analyze_schedule, format_analysis_report, get_analysis_for_llm
+from schedule_analyzer import (
+    analyze_schedule,
+    format_analysis_report,
+    format_stcw_violation_period,
+    get_analysis_for_llm,
+)
+from voyage_schedule import VoyageSchedule
 from llm_agent import create_agent
 from constraint_parser import create_parser
 
@@ -22,6 +28,8 @@ check_stcw_at_slot = getattr(sw, "check_stcw_at_slot", None)
 generate_schedule = sw.generate_schedule
 generate_schedule_with_manual_day1 = getattr(sw, "generate_schedule_with_manual_day1", None)
 build_workbook_and_report = getattr(sw, "build_workbook_and_report", None)
+day_memo_info = getattr(sw, "day_memo_info", None)
+repair_after_edit = getattr(sw, "repair_after_edit", None)
 
 WORKERS = [
     "Bosun", "Dayman EU", "Dayman PH1", "Dayman PH2",
@@ -254,32 +262,19 @@ def build_days_data(start_day: int, end_day: int, key_prefix: str):
 # TAULUKOT JA NÄYTÖT
 # ============================================================================
 
+SCHEDULE_SYMBOLS = [
+    ("sluice_slots", "SL"),
+    ("shifting_slots", "SH"),
+    ("arrival_slots", "B"),
+    ("departure_slots", "C"),
+    ("work_slots", "●"),
+]
+
+
 def create_schedule_table(all_days, day_idx, workers):
-    data = []
-    for w in workers:
-        row = {"Työntekijä": w}
-        day_data = all_days[w][day_idx]
-        work = day_data["work_slots"]
-        arr = day_data["arrival_slots"]
-        dep = day_data["departure_slots"]
-        sluice = day_data.get("sluice_slots", [False] * 48)
-        shifting = day_data.get("shifting_slots", [False] * 48)
-
-        for i, time_col in enumerate(DISPLAY_TIME_COLS):
-            if sluice[i]:
-                row[time_col] = "SL"
-            elif shifting[i]:
-                row[time_col] = "SH"
-            elif arr[i]:
-                row[time_col] = "B"
-            elif dep[i]:
-                row[time_col] = "C"
-            elif work[i]:
-                row[time_col] = "●"
-            else:
-                row[time_col] = ""
-        data.append(row)
-    return pd.DataFrame(data)
+    """all_days voi olla all_days-rakenne tai valmis VoyageSchedule."""
+    voyage = VoyageSchedule.from_all_days(all_days, workers)
+    return voyage.to_dataframe(day_idx, DISPLAY_TIME_COLS, symbols=SCHEDULE_SYMBOLS)
 
 
 def style_schedule_table(df):
@@ -315,11 +310,9 @@ def convert_manual_df_to_slots(df: pd.DataFrame):
 
 def create_editable_work_df(all_days, day_idx, visible_cols=None):
     cols = visible_cols or DISPLAY_TIME_COLS
-    data = {"Työntekijä": WORKERS}
-    for col in cols:
-        col_idx = DISPLAY_TIME_COLS.index(col)
-        data[col] = [bool(all_days[w][day_idx]["work_slots"][col_idx]) for w in WORKERS]
-    return pd.DataFrame(data)
+    voyage = VoyageSchedule.from_all_days(all_days, WORKERS)
+    columns = {col: DISPLAY_TIME_COLS.index(col) for col in cols}
+    return voyage.to_dataframe(day_idx, columns)
 
 
 def apply_edited_work_df(all_days, day_idx, edited_df, visible_cols=None):
@@ -331,9 +324,30 @@ def apply_edited_work_df(all_days, day_idx, edited_df, visible_cols=None):
         if worker not in all_days:
             continue
 
-        slots = all_days[worker][day_idx]["work_slots"]
+        slots = list(all_days[worker][day_idx]["work_slots"])
         for col in cols:
             slots[col_indexes[col]] = bool(row[col])
+        all_days[worker][day_idx]["work_slots"] = slots
+
+
+def collect_edited_cells(all_days, day_idx, edited_df, visible_cols=None):
+    """Muuttuneet solut {(worker, day, slot): työ} muokatusta taulukosta."""
+    cols = visible_cols or DISPLAY_TIME_COLS
+    col_indexes = {col: DISPLAY_TIME_COLS.index(col) for col in cols}
+    cells = {}
+
+    for _, row in edited_df.iterrows():
+        worker = row["Työntekijä"]
+        if worker not in all_days:
+            continue
+
+        slots = all_days[worker][day_idx]["work_slots"]
+        for col in cols:
+            slot = col_indexes[col]
+            value = bool(row[col])
+            if value != bool(slots[slot]):
+                cells[(worker, day_idx, slot)] = value
+    return cells
 
 
 def get_effective_rest_config():
@@ -356,6 +370,16 @@ def get_effective_rest_config():
     }
 
 
+def render_day_memo_stats(before):
+    """Näyttää montako päivää saatiin päivämuistista viimeisimmässä generoinnissa."""
+    if day_memo_info is None or before is None:
+        return
+    after = day_memo_info()
+    reused = after["hits"] - before["hits"]
+    computed = after["misses"] - before["misses"]
+    st.caption(f"Päivämuisti: {reused} päivää muistista, {computed} laskettu uudelleen.")
+
+
 def store_generated_result(wb, all_days, days_data, num_days, rest_config=None, from_post_edit=False):
     st.session_state.generated_wb = wb
     st.session_state.generated_all_days = all_days
@@ -403,11 +427,22 @@ def render_frontpage_stcw_warning():
             if "STCW" in issue:
                 stcw_items.append(f"{wa['worker']} / päivä {wa['day']}: {issue}")
 
-    if stcw_items:
+    # Rikejaksot koko matkan aikajanasta (24h ikkunan loppuhetki)
+    period_items = [
+        f"{period['worker']}: {format_stcw_violation_period(period)}"
+        for period in analysis.get("stcw_violation_periods", [])
+    ]
+
+    if stcw_items or period_items:
         st.error("⚠️ STCW-rike havaittu generoimassasi työvuorolistassa.")
+    if stcw_items:
         st.markdown("**Syy(t):**")
         for item in stcw_items:
             st.markdown(f"- {item}")
+    if period_items:
+        st.markdown("**Rikejaksot (24h ikkunan loppuhetki):**")
+        for item in period_items:
+            st.markdown(f"- {item}")
 
 
 def render_post_generation_editor():
@@ -436,11 +471,13 @@ def render_post_generation_editor():
     else:
         visible_cols = DISPLAY_TIME_COLS
 
+    voyage = VoyageSchedule.from_all_days(all_days, WORKERS)
+
     with st.form("post_generation_edit_form"):
         edited_dfs = []
         for d in range(num_days):
             st.markdown(f"**Muokattava päivä {d+1}**")
-            base_df = create_editable_work_df(all_days, d, visible_cols=visible_cols)
+            base_df = create_editable_work_df(voyage, d, visible_cols=visible_cols)
             edited_df = st.data_editor(
                 base_df,
                 hide_index=True,
@@ -454,9 +491,25 @@ def render_post_generation_editor():
         regenerate_clicked = st.form_submit_button("🔁 Generoi uudelleen (päivitä Excel)")
 
     if regenerate_clicked:
-        updated_all_days = copy.deepcopy(st.session_state.generated_all_days)
-        for d, edited_df in enumerate(edited_dfs):
-            apply_edited_work_df(updated_all_days, d, edited_df, visible_cols=visible_cols)
+        repair_summary = None
+        if repair_after_edit is not None:
+            # Muokatut solut lukitaan ja vain niiden päivät ja seuraavat korjataan
+            edits = {}
+            for d, edited_df in enumerate(edited_dfs):
+                edits.update(collect_edited_cells(all_days, d, edited_df, visible_cols=visible_cols))
+            rest_config = st.session_state.get("generated_rest_config") or get_effective_rest_config()
+            constraints = st.session_state.parser.get_constraints() if st.session_state.parser else []
+            updated_all_days, repair_summary = repair_after_edit(
+                all_days,
+                st.session_state.generated_days_data,
+                edits,
+                constraints=constraints,
+                min_longest_rest_hours=rest_config["generation_longest_rest_hours"],
+            )
+        else:
+            updated_all_days = copy.deepcopy(st.session_state.generated_all_days)
+            for d, edited_df in enumerate(edited_dfs):
+                apply_edited_work_df(updated_all_days, d, edited_df, visible_cols=visible_cols)
         wb = build_workbook_compat(updated_all_days, num_days, WORKERS)
         if wb is None:
             st.error("Excelin uudelleenrakennus epäonnistui.")
@@ -470,6 +523,12 @@ def render_post_generation_editor():
                 from_post_edit=True,
             )
             st.success("Vuorot päivitetty.")
+            if repair_summary and repair_summary["days"]:
+                days_text = ", ".join(str(d + 1) for d in repair_summary["days"])
+                st.caption(
+                    f"Korjatut päivät: {days_text} ({repair_summary['pinned']} lukittua solua, "
+                    f"{repair_summary['elapsed'] * 1000:.0f} ms)."
+                )
 
     buffer = io.BytesIO()
     st.session_state.generated_wb.save(buffer)
@@ -822,6 +881,7 @@ def main():
             if st.session_state.parser:
                 constraints = st.session_state.parser.get_constraints()
             
+            memo_before = day_memo_info() if day_memo_info else None
             with st.spinner("Generoidaan..."):
                 wb, all_days, _ = generate_schedule(
                     days_data,
@@ -834,6 +894,7 @@ def main():
                 st.success(f"✅ Työvuorot generoitu {len(constraints)} rajoitteella!")
             else:
                 st.success("✅ Työvuorot generoitu!")
+            render_day_memo_stats(memo_before)
         
         # Näytä tulokset
         if st.session_state.generated_all_days is not None:
@@ -890,6 +951,7 @@ def main():
                     days_data,
                     manual_slots,
                     min_longest_rest_hours=rest_config["generation_longest_rest_hours"],
+                    constraints=constraints,
                 )
             
             store_generated_result(wb, all_days, days_data, num_days, rest_config=rest_config)
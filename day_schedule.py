@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+DaySchedule - Yhden työntekijän päivän vuorot pakattuina kokonaislukuun
+
+all_days[worker][day] oli aiemmin dict, jossa kuusi 48 alkion bool-listaa.
+DaySchedule tallentaa kaikki kuusi listaa yhteen kokonaislukuun (kenttä k
+vie bitit 48*k .. 48*k+47, bitti = slotti), joten päivä vie murto-osan
+muistista ja kopiointi on halpaa.
+
+Vanha luku- ja kirjoitusrajapinta toimii edelleen:
+
+    day['work_slots'][16]          # True/False
+    day['work_slots'][16] = True   # kirjoittaa takaisin maskiin
+    day.get('sluice_slots', [False] * 48)
+    sum(day['work_slots']), prev['work_slots'] + day['work_slots']
+
+Avain palauttaa SlotView-listan, jonka muutokset kirjoitetaan takaisin päivään.
+"""
+
+from stcw_engine import SLOTS_PER_DAY, pack_slots, unpack_slots
+
+
+DAY_FIELDS = (
+    'work_slots',
+    'arrival_slots',
+    'departure_slots',
+    'port_op_slots',
+    'sluice_slots',
+    'shifting_slots',
+)
+
+_FIELD_INDEX = {field: i for i, field in enumerate(DAY_FIELDS)}
+_FULL_MASK = (1 << SLOTS_PER_DAY) - 1
+
+
+class SlotView(list):
+    """
+    Yhden DaySchedule-kentän purettu lista.
+
+    On tavallinen list (kaikki lukuoperaatiot toimivat sellaisenaan), mutta
+    alkion asetus kirjoittaa muutoksen myös takaisin päivän maskiin.
+    """
+
+    __slots__ = ('_day', '_index')
+
+    def __init__(self, day, index):
+        super().__init__(unpack_slots(day._packed >> (index * SLOTS_PER_DAY) & _FULL_MASK))
+        self._day = day
+        self._index = index
+
+    def __setitem__(self, slot, value):
+        super().__setitem__(slot, value)
+        if len(self) != SLOTS_PER_DAY:
+            raise ValueError("päivässä on aina 48 slottia")
+        self._day._set_bits(self._index, pack_slots(self))
+
+    def __reduce_ex__(self, protocol):
+        return list, (list(self),)
+
+    def __copy__(self):
+        return list(self)
+
+    def __deepcopy__(self, memo):
+        return list(self)
+
+
+class DaySchedule:
+    """
+    Päivän vuorot yhtenä kokonaislukuna (kentät DAY_FIELDS-järjestyksessä).
+
+    Tukee dict-tyyppistä käyttöä (day['work_slots'], get, keys, items),
+    joten se käy kaikkialle missä päivä on ennen ollut dict.
+    """
+
+    __slots__ = ('_packed',)
+
+    def __init__(self, work_slots=None, arrival_slots=None, departure_slots=None,
+                 port_op_slots=None, sluice_slots=None, shifting_slots=None):
+        self._packed = _pack_fields(
+            _to_bits(slots)
+            for slots in (work_slots, arrival_slots, departure_slots,
+                          port_op_slots, sluice_slots, shifting_slots)
+        )
+
+    @classmethod
+    def from_dict(cls, day):
+        """Luo päivän vanhasta dict-muodosta (puuttuvat kentät tyhjiä)."""
+        if isinstance(day, DaySchedule):
+            return day.copy()
+        return cls(**{field: day.get(field) for field in DAY_FIELDS})
+
+    @classmethod
+    def from_bits(cls, *bits):
+        """Luo päivän valmiista bittimaskeista (DAY_FIELDS-järjestyksessä)."""
+        day = cls.__new__(cls)
+        day._packed = _pack_fields(b & _FULL_MASK for b in bits)
+        return day
+
+    def to_dict(self):
+        """Vanha dict-muoto (kuusi bool-listaa)."""
+        return {field: unpack_slots(self.bits(field)) for field in DAY_FIELDS}
+
+    def bits(self, field='work_slots'):
+        """Kentän bittimaski suoraan (STCW-tarkistuksiin ilman purkua)."""
+        return self._packed >> (_FIELD_INDEX[field] * SLOTS_PER_DAY) & _FULL_MASK
+
+    def to_bytes(self):
+        """Kaikki kentät tavuina (little-endian, kenttä k = bitit 48*k..48*k+47)."""
+        return self._packed.to_bytes(len(DAY_FIELDS) * SLOTS_PER_DAY // 8, 'little')
+
+    def _set_bits(self, index, bits):
+        shift = index * SLOTS_PER_DAY
+        self._packed = self._packed & ~(_FULL_MASK << shift) | (bits & _FULL_MASK) << shift
+
+    def copy(self):
+        day = DaySchedule.__new__(DaySchedule)
+        day._packed = self._packed
+        return day
+
+    __copy__ = copy
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+    def __getstate__(self):
+        return (self._packed,)
+
+    def __setstate__(self, state):
+        self._packed = state[0]
+
+    # --- dict-yhteensopivuus -----------------------------------------------
+
+    def __getitem__(self, field):
+        return SlotView(self, _FIELD_INDEX[field])
+
+    def __setitem__(self, field, slots):
+        self._set_bits(_FIELD_INDEX[field], _to_bits(slots))
+
+    def __contains__(self, field):
+        return field in _FIELD_INDEX
+
+    def __iter__(self):
+        return iter(DAY_FIELDS)
+
+    def __len__(self):
+        return len(DAY_FIELDS)
+
+    def get(self, field, default=None):
+        if field in _FIELD_INDEX:
+            return self[field]
+        return default
+
+    def keys(self):
+        return list(DAY_FIELDS)
+
+    def values(self):
+        return [self[field] for field in DAY_FIELDS]
+
+    def items(self):
+        return [(field, self[field]) for field in DAY_FIELDS]
+
+    def __eq__(self, other):
+        if isinstance(other, DaySchedule):
+            return self._packed == other._packed
+        if isinstance(other, dict):
+            return self.to_dict() == {k: list(v) for k, v in other.items()}
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        hours = bin(self.bits()).count('1') / 2
+        return f"DaySchedule(work={hours}h)"
+
+
+def work_bits(day, field='work_slots'):
+    """Päivän kentän bittimaski (DaySchedule suoraan, dict pakkaamalla)."""
+    if isinstance(day, DaySchedule):
+        return day.bits(field)
+    return pack_slots(day.get(field))
+
+
+def _pack_fields(bits):
+    packed = 0
+    for i, b in enumerate(bits):
+        packed |= b << (i * SLOTS_PER_DAY)
+    return packed
+
+
+def _to_bits(slots):
+    if slots is None:
+        return 0
+    if len(slots) != SLOTS_PER_DAY:
+        raise ValueError(f"Odotettiin 48 slottia, saatiin {len(slots)}")
+    return pack_slots(slots)
@@ -0,0 +1,419 @@
+# -*- coding: utf-8 -*-
+"""
+Exact Day - Yhden päivän daymen-vuorojen tarkka ratkaisija (branch-and-bound)
+
+Päivä ratkaistaan puolen tunnin slotteina järjestyksessä 0..47: jokaisessa
+slotissa valitaan mitkä daymanit ovat töissä. Haku jaetaan soluihin
+tuntijakauman mukaan (vähiten tekevän slotit a, eniten tekevän a + d), jolloin
+tasapainokustannus on solussa vakio. Haku karsii:
+- pakolliset / kielletyt slotit (rajoitteet, tulot, shiftaukset, carry-over)
+- STCW edellisestä päivästä: ikkuna joka alkaa edellisen päivän slotista s
+  on valmis heti kun nykyisen päivän slotit 0..s-1 on valittu, joten se
+  tarkistetaan bittimaskeilla heti
+- STCW seuraavaan päivään: lepomäärän yläraja (loput slotit lepoa) ja
+  täysi tarkistus lehdessä
+- alaraja: jokaiselle daymanille erikseen laskettu paras loppukustannus
+  (yötyö, blokit, tunnit solun rajoissa) + kytkösslottien palkkiot
+  (Lagrangen relaksaatio kattavuudelle ja lähdön kahdelle tekijälle)
+- symmetrian rikkominen: identtiset daymanit (sama edellinen päivä ja
+  samat rajoitteet) käydään läpi vain leksikografisessa järjestyksessä
+
+Kustannus (pienempi parempi), painot vakioina alla:
+    kattamaton op-slotti, minimituntien vaje, tuntiero daymanien välillä,
+    tunnit yli minimin, yö-/lounastyö ja työblokkien määrä.
+
+Ratkaisu on todistetusti paras tällä kustannuksella ja blokkirajalla
+(max_blocks), jos haku ehtii loppuun aikabudjetissa ('optimal': True).
+
+Lähtöratkaisu (incumbent) pisteytetään aina samalla tavoitteella, ja sen
+rikkeet ovat sakkoja eivätkä karsi sitä: STCW-ikkunat edellisestä päivästä
+(W_STCW), oletettuun seuraavaan päivään (W_NEXT_STCW; koko päivän rikkeet
+ovat halvempia kuin yksi kattamaton slotti, koska seuraava päivä on vain
+oletus eikä todellista kattavuutta vaihdeta siihen) sekä pakollisten,
+kiellettyjen ja lähtöslottien rikkeet (W_UNCOVERED per slotti). Haku
+palauttaa vain lähtöratkaisua aidosti halvemman ratkaisun.
+Moduuli ei tunne generaattoria; sea_watch_17.build_exact_day_problem
+kokoaa syötteet.
+"""
+
+import time
+from itertools import product
+
+from stcw_engine import (
+    SLOTS_PER_DAY,
+    MIN_TOTAL_REST_SLOTS,
+    _min_longest_slots,
+    stcw_violation_mask,
+    window_longest_ok,
+    window_total_slots,
+)
+
+
+DAY_MASK = (1 << SLOTS_PER_DAY) - 1
+
+W_UNCOVERED = 1000   # kattamaton op-slotti
+W_SHORTFALL = 100    # slotti alle minimituntien
+W_BALANCE = 10       # slotti eroa eniten ja vähiten tekevän välillä
+W_PENALTY = 3        # yö- tai lounasslotti
+W_EXCESS = 2         # slotti yli minimituntien
+W_BLOCK = 5          # työblokki
+W_STCW = 2000        # rikkova 24h ikkuna todellisten päivien välillä
+# Rikkova 24h ikkuna oletettuun seuraavaan päivään: kolmen daymanin kaikki
+# 48 ikkunaa yhteensä alle yhden kattamattoman slotin
+W_NEXT_STCW = 5
+
+DEFAULT_MAX_BLOCKS = 3
+DEFAULT_TIME_BUDGET = 1.0
+
+# Kytkösslottien palkkiotasot alarajaan (paras valitaan soluittain)
+REWARD_LEVELS = (0, W_PENALTY + W_BLOCK, W_PENALTY + 2 * W_BLOCK)
+
+_INF = float('inf')
+
+
+def _blocks(bits):
+    return (bits & ~(bits << 1)).bit_count()
+
+
+def evaluate_day(workers, work, cover_bits, penalty_bits, min_slots):
+    """Ratkaisun kustannus (ks. painot). work: {worker: bitit}."""
+    covered = 0
+    cost = 0
+    hours = []
+    for w in workers:
+        bits = work[w]
+        covered |= bits
+        count = bits.bit_count()
+        hours.append(count)
+        cost += W_PENALTY * (bits & penalty_bits).bit_count()
+        cost += W_BLOCK * _blocks(bits)
+        cost += W_SHORTFALL * max(0, min_slots[w] - count)
+        cost += W_EXCESS * max(0, count - min_slots[w])
+    cost += W_UNCOVERED * (cover_bits & ~covered).bit_count()
+    if hours:
+        cost += W_BALANCE * (max(hours) - min(hours))
+    return cost
+
+
+def _count_costs(forced, forbidden, penalty_bits, reward, block_cap):
+    """
+    Yhden daymanin loppukustannukset tehtyjen slottien määrän mukaan.
+
+    Palauttaa funktion (t, working, used_blocks) -> lista, jossa alkio k on
+    pienin yötyö- ja blokkikustannus (palkkiot vähennettynä) sloteille
+    t..47 kun niistä tehdään tasan k. Tuntikattoa ei huomioida (relaksaatio).
+    """
+    memo = {}
+
+    def costs(t, working, used_blocks):
+        key = (t, working, used_blocks)
+        value = memo.get(key)
+        if value is not None:
+            return value
+        if t == SLOTS_PER_DAY:
+            value = (0,)
+        else:
+            must = forced >> t & 1
+            can_rest = not must
+            # Pakollisen blokin alku lasketaan blokkirajaan kuten muutkin
+            can_work = ((must or not forbidden >> t & 1)
+                        and (working or used_blocks < block_cap))
+            rest = costs(t + 1, 0, used_blocks) if can_rest else ()
+            value = [_INF] * (SLOTS_PER_DAY + 1 - t)
+            for k, c in enumerate(rest):
+                value[k] = c
+            if can_work:
+                step = W_PENALTY * (penalty_bits >> t & 1) - reward[t] + (0 if working else W_BLOCK)
+                for k, c in enumerate(costs(t + 1, 1, used_blocks + (not working))):
+                    if step + c < value[k + 1]:
+                        value[k + 1] = step + c
+            value = tuple(value)
+        memo[key] = value
+        return value
+
+    return costs
+
+
+def _prev_window_rest(prev_bits, cur_bits, t):
+    """Lepomaski ikkunalle joka alkaa edellisen päivän slotista t (cur 0..t-1)."""
+    work = (prev_bits >> t) | ((cur_bits & ((1 << t) - 1)) << (SLOTS_PER_DAY - t))
+    return ~work & DAY_MASK
+
+
+def solve_day_exact(workers, prev_bits, next_bits, forced, forbidden, min_slots, max_slots,
+                    cover_bits=0, demand_bits=0, demand=2, penalty_bits=0,
+                    min_longest_rest_hours=6, max_blocks=DEFAULT_MAX_BLOCKS,
+                    time_budget=DEFAULT_TIME_BUDGET, incumbent=None):
+    """
+    Ratkaisee päivän daymen-vuorot.
+
+    Args:
+        workers: Ratkaistavat daymanit
+        prev_bits: {worker: edellisen päivän työbitit}
+        next_bits: Oletetun seuraavan päivän työbitit
+        forced, forbidden: {worker: bitit} pakolliset ja kielletyt slotit
+        min_slots, max_slots: {worker: slottimäärä} minimi ja maksimi
+        cover_bits: Op-slotit joissa pitää olla vähintään yksi dayman
+        demand_bits: Slotit joissa pitää olla vähintään `demand` daymania
+            (tai kaikki joille slotti on sallittu)
+        penalty_bits: Yö- ja lounasslotit
+        max_blocks: Työblokkien enimmäismäärä per dayman
+        time_budget: Aikabudjetti sekunteina
+        incumbent: {worker: bitit} tunnettu ratkaisu ylärajaksi; haku etsii
+            vain sitä aidosti halvempia ratkaisuja
+
+    Returns:
+        Dict: work ({worker: bitit} tai None), cost, incumbent_cost (None jos
+        lähtöratkaisua ei ollut), optimal, nodes. Jos mikään ei ollut
+        lähtöratkaisua halvempi, work on lähtöratkaisu ja cost == incumbent_cost.
+    """
+    workers = list(workers)
+    n = len(workers)
+    min_longest = _min_longest_slots(min_longest_rest_hours)
+
+    forced = {w: forced.get(w, 0) & DAY_MASK for w in workers}
+    forbidden = {w: forbidden.get(w, 0) & DAY_MASK & ~forced[w] for w in workers}
+    max_slots = {w: max(max_slots[w], forced[w].bit_count()) for w in workers}
+    block_cap = {w: max(max_blocks, _blocks(forced[w])) for w in workers}
+
+    # Ikkunat jotka rikkovat vaikka päivä olisi kokonaan lepoa: ei estä ratkaisua
+    prev_unavoidable = {w: stcw_violation_mask(prev_bits.get(w, 0), 0, min_longest_rest_hours)
+                        for w in workers}
+    next_unavoidable = stcw_violation_mask(0, next_bits, min_longest_rest_hours)
+
+    def stcw_ok(w, bits):
+        if stcw_violation_mask(prev_bits.get(w, 0), bits, min_longest_rest_hours) & ~prev_unavoidable[w]:
+            return False
+        return not stcw_violation_mask(bits, next_bits, min_longest_rest_hours) & ~next_unavoidable
+
+    # Slottikohtainen vaatimus: demand tai kaikki joille slotti on sallittu
+    need = [0] * SLOTS_PER_DAY
+    for t in range(SLOTS_PER_DAY):
+        if demand_bits >> t & 1:
+            allowed = sum(1 for w in workers if not forbidden[w] >> t & 1)
+            need[t] = min(demand, allowed)
+
+    # Op-slotit joita kukaan ei voi kattaa, loppuosan määrä
+    all_forbidden = DAY_MASK
+    for w in workers:
+        all_forbidden &= forbidden[w]
+    uncoverable = cover_bits & all_forbidden
+    uncoverable_after = [(uncoverable >> t).bit_count() for t in range(SLOTS_PER_DAY + 1)]
+
+    # Seuraavan päivän lepo slotteihin 0..s-1
+    next_rest_prefix = [(~next_bits & ((1 << s) - 1)).bit_count() for s in range(SLOTS_PER_DAY + 1)]
+
+    # Symmetriset parit (i < j): identtiset syötteet
+    def signature(w):
+        return (prev_bits.get(w, 0), forced[w], forbidden[w], min_slots[w], max_slots[w])
+    sym_pairs = [
+        (i, j) for i in range(n) for j in range(i + 1, n)
+        if signature(workers[i]) == signature(workers[j])
+    ]
+
+    best = {'cost': None, 'work': None}
+    if incumbent is not None and all(w in incumbent for w in workers):
+        inc = {w: incumbent[w] & DAY_MASK for w in workers}
+        best['cost'] = evaluate_day(workers, inc, cover_bits, penalty_bits, min_slots)
+        for w in workers:
+            prev_windows = (stcw_violation_mask(prev_bits.get(w, 0), inc[w], min_longest_rest_hours)
+                            & ~prev_unavoidable[w])
+            next_windows = (stcw_violation_mask(inc[w], next_bits, min_longest_rest_hours)
+                            & ~next_unavoidable)
+            broken = (forced[w] & ~inc[w]) | (inc[w] & forbidden[w])
+            best['cost'] += (W_STCW * prev_windows.bit_count()
+                             + W_NEXT_STCW * next_windows.bit_count()
+                             + W_UNCOVERED * broken.bit_count())
+        for t in range(SLOTS_PER_DAY):
+            if need[t]:
+                best['cost'] += W_UNCOVERED * max(0, need[t] - sum(inc[w] >> t & 1 for w in workers))
+        best['work'] = inc
+    incumbent_cost = best['cost']
+
+    # Kytkösslotit: kattavuus (1) ja lähtö (need) yö-/lounasajalla. Niille
+    # annetaan palkkio: daymanin alaraja pienenee palkkiolla per tehty slotti
+    # ja alarajaan lisätään palkkio * vaatimus. Pätevä kun palkkio <= W_UNCOVERED.
+    required = [
+        max(need[t], (cover_bits & ~uncoverable) >> t & 1) if penalty_bits >> t & 1 else 0
+        for t in range(SLOTS_PER_DAY)
+    ]
+    terminal = {
+        w: [W_SHORTFALL * max(0, min_slots[w] - c) + W_EXCESS * max(0, c - min_slots[w])
+            for c in range(SLOTS_PER_DAY + 1)]
+        for w in workers
+    }
+    levels = []
+    shared = {}
+    for level in REWARD_LEVELS:
+        reward = [level if required[t] else 0 for t in range(SLOTS_PER_DAY)]
+        reward_after = [0] * (SLOTS_PER_DAY + 1)
+        for t in range(SLOTS_PER_DAY - 1, -1, -1):
+            reward_after[t] = reward_after[t + 1] + reward[t] * required[t]
+        tables = []
+        for w in workers:
+            key = (level, forced[w], forbidden[w], block_cap[w])
+            if key not in shared:
+                shared[key] = _count_costs(forced[w], forbidden[w], penalty_bits, reward, block_cap[w])
+            tables.append(shared[key])
+        levels.append((tables, reward_after))
+
+    deadline = time.perf_counter() + time_budget
+    stats = {'nodes': 0, 'timed_out': False}
+
+    # Tila per dayman: bitit, slotit, blokit, min(rn(s) - rc(s)) eteenpäin-rajaan
+    bits = [0] * n
+    count = [0] * n
+    blocks = [0] * n
+    fwd_min = [0] * n   # s = 0: rn(0) - rc(0) = 0
+    cell = {}
+
+    def worker_bound(i, t, working, done, used_blocks):
+        """Daymanin paras loppukustannus solun tuntirajoissa."""
+        costs = cell['tables'][i](t, working, used_blocks)
+        term = terminal[workers[i]]
+        lo = max(cell['low'] - done, 0)
+        hi = min(cell['high'] - done, len(costs) - 1)
+        value = _INF
+        for k in range(lo, hi + 1):
+            c = costs[k] + term[done + k]
+            if c < value:
+                value = c
+        return value
+
+    def options(i, w, t):
+        working = t > 0 and bits[i] >> (t - 1) & 1
+        # Blokkiraja koskee myös pakollisen blokin alkua: jos vapaaehtoiset
+        # blokit ovat vieneet tilan, haara on umpikuja
+        capped = not working and blocks[i] >= block_cap[w]
+        if forced[w] >> t & 1:
+            return () if capped else (1,)
+        if forbidden[w] >> t & 1:
+            return (0,)
+        if count[i] >= max_slots[w] or count[i] >= cell['high']:
+            return (0,)
+        if capped:
+            return (0,)
+        return (1, 0) if working else (0, 1)
+
+    def search(t, g, equal):
+        stats['nodes'] += 1
+        if stats['nodes'] & 255 == 0 and time.perf_counter() > deadline:
+            stats['timed_out'] = True
+        if stats['timed_out']:
+            return
+
+        if t == SLOTS_PER_DAY:
+            if min(count) != cell['low'] or max(count) != cell['high']:
+                return   # kuuluu toiseen soluun
+            work = {w: bits[i] for i, w in enumerate(workers)}
+            if not all(stcw_ok(w, work[w]) for w in workers):
+                return
+            cost = evaluate_day(workers, work, cover_bits, penalty_bits, min_slots)
+            if best['cost'] is None or cost < best['cost']:
+                best['cost'] = cost
+                best['work'] = work
+            return
+
+        # Valinnat daymaneittain: (työ, kustannuksen lisäys, daymanin alaraja)
+        penalty = penalty_bits >> t & 1
+        choices = []
+        for i, w in enumerate(workers):
+            working = 1 if t > 0 and bits[i] >> (t - 1) & 1 else 0
+            own = []
+            for v in options(i, w, t):
+                step = W_PENALTY * penalty + (0 if working else W_BLOCK) if v else 0
+                bound = worker_bound(i, t + 1, v, count[i] + v, blocks[i] + (v and not working))
+                if bound != _INF:
+                    own.append((v, step, bound))
+            if not own:
+                return
+            choices.append(own)
+
+        cover = cover_bits >> t & 1
+        base = g + cell['balance'] + cell['reward_after'][t + 1] + W_UNCOVERED * uncoverable_after[t + 1]
+        ranked = []
+        for picks in product(*choices):
+            combo = tuple(p[0] for p in picks)
+            if need[t] and sum(combo) < need[t]:
+                continue
+            if any(equal[k] and combo[i] < combo[j] for k, (i, j) in enumerate(sym_pairs)):
+                continue
+            delta = sum(p[1] for p in picks)
+            if cover and not any(combo):
+                delta += W_UNCOVERED
+            # Järjestys ja karsinta lapsen alarajalla
+            estimate = base + delta + sum(p[2] for p in picks)
+            if best['cost'] is not None and estimate >= best['cost']:
+                continue
+            ranked.append((estimate, delta, combo))
+        ranked.sort(key=lambda item: item[0])
+
+        for _, delta, combo in ranked:
+            saved = (bits[:], count[:], blocks[:], fwd_min[:])
+            ok = True
+            for i, v in enumerate(combo):
+                w = workers[i]
+                if v:
+                    if not (t > 0 and bits[i] >> (t - 1) & 1):
+                        blocks[i] += 1
+                    bits[i] |= 1 << t
+                    count[i] += 1
+                # Edellisen päivän ikkuna joka alkaa slotista t+1 on nyt valmis
+                s = t + 1
+                if s < SLOTS_PER_DAY and not prev_unavoidable[w] >> s & 1:
+                    rest = _prev_window_rest(prev_bits.get(w, 0), bits[i], s)
+                    if (window_total_slots(rest) < MIN_TOTAL_REST_SLOTS
+                            or not window_longest_ok(rest, min_longest)):
+                        ok = False
+                        break
+                # Seuraavan päivän ikkunat (alku s <= t+1): lepo enintään
+                # valittu lepo + loput ei-pakolliset slotit + seuraavan päivän lepo
+                rest_chosen = (t + 1) - (bits[i] & ((1 << (t + 1)) - 1)).bit_count()
+                if s < SLOTS_PER_DAY:
+                    fwd_min[i] = min(fwd_min[i], next_rest_prefix[s] - rest_chosen)
+                free_rest = (~forced[w] & DAY_MASK & ~((1 << (t + 1)) - 1)).bit_count()
+                if not next_unavoidable and rest_chosen + free_rest + fwd_min[i] < MIN_TOTAL_REST_SLOTS:
+                    ok = False
+                    break
+            if ok:
+                new_equal = [equal[k] and combo[i] == combo[j] for k, (i, j) in enumerate(sym_pairs)]
+                search(t + 1, g + delta, new_equal)
+            bits[:], count[:], blocks[:], fwd_min[:] = saved
+            if stats['timed_out']:
+                return
+
+    # Solut (a, a + d) alarajan mukaan järjestyksessä; jokaiselle paras palkkiotaso
+    cells = []
+    for low in range(SLOTS_PER_DAY + 1):
+        for high in range(low, SLOTS_PER_DAY + 1):
+            root = None
+            for tables, reward_after in levels:
+                cell.update(low=low, high=high, tables=tables)
+                bound = sum(worker_bound(i, 0, 0, 0, 0) for i in range(n))
+                if bound == _INF:
+                    break
+                bound += reward_after[0] + W_BALANCE * (high - low)
+                if root is None or bound > root[0]:
+                    root = (bound, tables, reward_after)
+            if root is not None:
+                cells.append((root[0] + W_UNCOVERED * uncoverable_after[0], low, high, root))
+    cells.sort(key=lambda item: item[:3])
+
+    for bound, low, high, (_, tables, reward_after) in cells:
+        if best['cost'] is not None and bound >= best['cost']:
+            break
+        cell.update(low=low, high=high, tables=tables, reward_after=reward_after,
+                    balance=W_BALANCE * (high - low))
+        for i in range(n):
+            bits[i] = count[i] = blocks[i] = fwd_min[i] = 0
+        search(0, 0, [True] * len(sym_pairs))
+        if stats['timed_out']:
+            break
+
+    return {
+        'work': best['work'],
+        'cost': best['cost'],
+        'incumbent_cost': incumbent_cost,
+        'optimal': not stats['timed_out'],
+        'nodes': stats['nodes'],
+    }
@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""
+Local Search - Aikarajattu parannusvaihe daymenien päivälle
+
+Ahneen (tai tarkan) päivän päälle ajetaan simuloitu jäähdytys, jonka siirrot
+ovat:
+- swap: yksi slotti daymanilta toiselle
+- shift: työblokin siirto slotilla aiemmaksi tai myöhemmäksi
+- split: kahden daymanin peräkkäisten blokkien rajan siirto (yövuoron jako)
+- resize: blokin pidennys tai lyhennys slotilla
+
+Tavoite on exact_day.evaluate_day (kattavuus, tunnit, tasapaino, yö-/lounastyö,
+blokit eli aukot) + STCW-rikkeet ja STCW-marginaali (tiukimman ikkunan lepo
+alle MARGIN_SLOTS). Tavoite lasketaan inkrementaalisesti: siirto laskee
+uudelleen vain muuttuneiden daymanien osuudet. Pakollisia slotteja ei poisteta,
+kiellettyihin ei lisätä ja lähtöslottien vähimmäismäärä pidetään. Siirto
+hylätään myös, jos se lisää rikkovia 24h ikkunoita tai jättää normaalin
+työajan ulkopuolisen op-slotin kattamatta: päivän tavoite arvioidaan oletettua
+seuraavaa päivää vasten, joten näitä ei vaihdeta pelkkään tavoitteen paranemiseen.
+
+Moduuli ei tunne generaattoria; syötteet ovat samat kuin solve_day_exact:lla
+(sea_watch_17.build_exact_day_problem).
+"""
+
+import math
+import random
+import time
+
+from exact_day import (
+    DAY_MASK,
+    W_BALANCE,
+    W_BLOCK,
+    W_EXCESS,
+    W_PENALTY,
+    W_SHORTFALL,
+    W_STCW,
+    W_UNCOVERED,
+    _blocks,
+)
+from stcw_engine import SLOTS_PER_DAY, stcw_violation_mask, window_total_slots
+
+
+W_MARGIN = 1         # slotti alle marginaalin tiukimmassa ikkunassa
+MARGIN_SLOTS = 24    # 12h lepoa tiukimmassa ikkunassa
+
+DEFAULT_IMPROVE_BUDGET = 0.5
+START_TEMPERATURE = 20.0
+END_TEMPERATURE = 0.5
+
+MOVES = ('swap', 'shift', 'split', 'resize')
+
+
+def _min_window_rest(prev_bits, cur_bits):
+    """Pienin laskettava lepo (slotteina) 48 ikkunasta prev+cur."""
+    rest96 = ~(prev_bits | (cur_bits << SLOTS_PER_DAY)) & ((1 << (2 * SLOTS_PER_DAY)) - 1)
+    return min(window_total_slots(rest96 >> s & DAY_MASK) for s in range(SLOTS_PER_DAY))
+
+
+def _block_ranges(bits):
+    """Blokit (start, end) bittimaskista."""
+    ranges = []
+    while bits:
+        start = (bits & -bits).bit_length() - 1
+        run = bits >> start
+        length = (~run & (run + 1)).bit_length() - 1
+        ranges.append((start, start + length))
+        bits &= ~(((1 << length) - 1) << start)
+    return ranges
+
+
+def improve_day(workers, work, prev_bits, next_bits, forced, forbidden, min_slots, max_slots,
+                cover_bits=0, demand_bits=0, demand=2, penalty_bits=0,
+                min_longest_rest_hours=6, time_budget=DEFAULT_IMPROVE_BUDGET, seed=0,
+                max_moves=None):
+    """
+    Parantaa päivän daymen-vuoroja simuloidulla jäähdytyksellä.
+
+    Args:
+        work: {worker: bitit} lähtöratkaisu
+        muut: kuten exact_day.solve_day_exact
+        time_budget: Seinäkelloaika sekunteina. Siirtojen määrä ja siten
+            tulos riippuvat koneen nopeudesta ja kuormasta.
+        seed: Satunnaislukusiemen
+        max_moves: Siirtoehdotusten määrä aikarajan sijaan; jäähdytys etenee
+            ehdotusten mukaan, joten sama siemen ja max_moves antavat aina
+            saman tuloksen (time_budget ei tällöin rajaa)
+
+    Returns:
+        Dict: work (paras), cost_before, cost_after, moves (arvioidut
+        siirrot), proposals (kaikki ehdotukset), accepted, moves_per_second
+        (arvioidut siirrot sekunnissa), elapsed
+    """
+    rng = random.Random(seed)
+    workers = list(workers)
+    forced = {w: forced.get(w, 0) & DAY_MASK for w in workers}
+    forbidden = {w: forbidden.get(w, 0) & DAY_MASK & ~forced[w] for w in workers}
+    prev_unavoidable = {w: stcw_violation_mask(prev_bits.get(w, 0), 0, min_longest_rest_hours)
+                        for w in workers}
+    next_unavoidable = stcw_violation_mask(0, next_bits, min_longest_rest_hours)
+
+    need = {}
+    for t in range(SLOTS_PER_DAY):
+        if demand_bits >> t & 1:
+            need[t] = min(demand, sum(1 for w in workers if not forbidden[w] >> t & 1))
+
+    def violations(w, bits):
+        """Rikkovat 24h ikkunat molempiin suuntiin (väistämättömiä ei lasketa)."""
+        count = (stcw_violation_mask(prev_bits.get(w, 0), bits, min_longest_rest_hours)
+                 & ~prev_unavoidable[w]).bit_count()
+        return count + (stcw_violation_mask(bits, next_bits, min_longest_rest_hours)
+                        & ~next_unavoidable).bit_count()
+
+    def outside_uncovered(current):
+        """Kattamattomat op-slotit normaalin työajan ulkopuolella."""
+        covered = 0
+        for w in workers:
+            covered |= current[w]
+        return (cover_bits & penalty_bits & ~covered).bit_count()
+
+    def own_cost(w, bits):
+        """Daymanin oma osuus tavoitteesta."""
+        count = bits.bit_count()
+        cost = (W_PENALTY * (bits & penalty_bits).bit_count() + W_BLOCK * _blocks(bits)
+                + W_SHORTFALL * max(0, min_slots[w] - count)
+                + W_EXCESS * max(0, count - min_slots[w]))
+        prev = prev_bits.get(w, 0)
+        cost += W_STCW * violations(w, bits)
+        tightest = min(_min_window_rest(prev, bits), _min_window_rest(bits, next_bits))
+        cost += W_MARGIN * max(0, MARGIN_SLOTS - tightest)
+        return cost
+
+    def shared_cost(current):
+        covered = 0
+        counts = []
+        for w in workers:
+            covered |= current[w]
+            counts.append(current[w].bit_count())
+        return W_UNCOVERED * (cover_bits & ~covered).bit_count() + W_BALANCE * (max(counts) - min(counts))
+
+    def valid(w, bits):
+        # Yli tuntikaton oleva lähtöratkaisu saa vain pienentyä
+        count = bits.bit_count()
+        return (bits & forced[w] == forced[w] and not bits & forbidden[w]
+                and (count <= max(max_slots[w], forced[w].bit_count())
+                     or count < current[w].bit_count()))
+
+    def demand_ok(current, slots):
+        for t in slots:
+            if t in need and sum(current[w] >> t & 1 for w in workers) < need[t]:
+                return False
+        return True
+
+    current = {w: work[w] & DAY_MASK for w in workers}
+    own = {w: own_cost(w, current[w]) for w in workers}
+    stcw = {w: violations(w, current[w]) for w in workers}
+    uncovered = outside_uncovered(current)
+    shared = shared_cost(current)
+    cost = sum(own.values()) + shared
+    cost_before = cost
+    best_cost = cost
+    best_work = dict(current)
+
+    def propose():
+        """Satunnainen siirto: {worker: uudet bitit} tai None."""
+        kind = rng.choice(MOVES)
+        if kind == 'swap':
+            a, b = rng.sample(workers, 2) if len(workers) > 1 else (None, None)
+            if a is None:
+                return None
+            movable = current[a] & ~forced[a] & ~current[b] & ~forbidden[b]
+            if not movable:
+                return None
+            t = rng.choice([s for s in range(SLOTS_PER_DAY) if movable >> s & 1])
+            return {a: current[a] & ~(1 << t), b: current[b] | (1 << t)}
+        w = rng.choice(workers)
+        blocks = _block_ranges(current[w])
+        if not blocks:
+            return None
+        start, end = rng.choice(blocks)
+        length = end - start
+        block = ((1 << length) - 1) << start
+        if kind == 'shift':
+            step = rng.choice((-1, 1))
+            if start + step < 0 or end + step > SLOTS_PER_DAY:
+                return None
+            moved = block << 1 if step > 0 else block >> 1
+            return {w: current[w] & ~block | moved}
+        if kind == 'resize':
+            edge = rng.choice((start - 1, end, start, end - 1))
+            if not 0 <= edge < SLOTS_PER_DAY:
+                return None
+            return {w: current[w] ^ (1 << edge)}
+        # split: blokin raja toisen daymanin blokkiin
+        others = [o for o in workers if o != w]
+        rng.shuffle(others)
+        for other in others:
+            if end < SLOTS_PER_DAY and current[other] >> end & 1:
+                # w loppuu ja other jatkaa: siirrä rajaa
+                if rng.random() < 0.5:
+                    return {w: current[w] | (1 << end), other: current[other] & ~(1 << end)}
+                return {w: current[w] & ~(1 << (end - 1)), other: current[other] | (1 << (end - 1))}
+            if start > 0 and current[other] >> (start - 1) & 1:
+                if rng.random() < 0.5:
+                    return {w: current[w] | (1 << (start - 1)), other: current[other] & ~(1 << (start - 1))}
+                return {w: current[w] & ~(1 << start), other: current[other] | (1 << start)}
+        return None
+
+    proposals = 0
+    moves = 0
+    accepted = 0
+    started = time.perf_counter()
+    deadline = started + time_budget
+    temperature = START_TEMPERATURE
+    while True:
+        if max_moves is not None:
+            if proposals >= max_moves:
+                break
+            progress = proposals / max_moves
+            temperature = START_TEMPERATURE * (END_TEMPERATURE / START_TEMPERATURE) ** progress
+        elif proposals & 63 == 0:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            progress = (now - started) / time_budget if time_budget > 0 else 1.0
+            temperature = START_TEMPERATURE * (END_TEMPERATURE / START_TEMPERATURE) ** progress
+        proposals += 1
+
+        change = propose()
+        if not change or any(not valid(w, bits) for w, bits in change.items()):
+            continue
+        changed_slots = set()
+        for w, bits in change.items():
+            diff = bits ^ current[w]
+            changed_slots.update(s for s in need if diff >> s & 1)
+        trial = dict(current)
+        trial.update(change)
+        if changed_slots and not demand_ok(trial, changed_slots):
+            continue
+        new_stcw = {w: violations(w, bits) for w, bits in change.items()}
+        if sum(new_stcw[w] - stcw[w] for w in change) > 0:
+            continue
+        new_uncovered = outside_uncovered(trial)
+        if new_uncovered > uncovered:
+            continue
+
+        moves += 1
+        new_own = {w: own_cost(w, bits) for w, bits in change.items()}
+        new_shared = shared_cost(trial)
+        new_cost = cost + sum(new_own[w] - own[w] for w in change) + new_shared - shared
+        delta = new_cost - cost
+        if delta <= 0 or rng.random() < math.exp(-delta / temperature):
+            current = trial
+            own.update(new_own)
+            stcw.update(new_stcw)
+            uncovered = new_uncovered
+            shared = new_shared
+            cost = new_cost
+            accepted += 1
+            if cost < best_cost:
+                best_cost = cost
+                best_work = dict(current)
+
+    elapsed = time.perf_counter() - started
+    return {
+        'work': best_work,
+        'cost_before': cost_before,
+        'cost_after': best_cost,
+        'moves': moves,
+        'proposals': proposals,
+        'accepted': accepted,
+        'moves_per_second': moves / elapsed if elapsed > 0 else 0.0,
+        'elapsed': elapsed,
+    }
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Parallel segments - Pitkän matkan segmenttien rinnakkainen generointi
+
+generate_schedule etenee päivä kerrallaan, koska jokainen päivä riippuu
+edellisen päivän työstä ja keskiyön yli kulkevista sloteista. Nollakohdissa
+(sea_watch_17.find_reset_points: edellinen päivä pysyy normaalissa
+työajassa, ei slussin carry-overia eikä jatkuvaa yötä) riippuvuus on
+heikko, ja matka jaetaan niissä segmentteihin, jotka generoidaan
+prosessipoolissa (multiprocessing.Pool).
+
+Segmentti alkaa yhden päivän lämmittelyllä: nollakohtaa edeltävä päivä
+generoidaan tyhjästä tilasta, ja sen jälkeinen tila on segmentin oletettu
+alkutila. Koottaessa oletettua tilaa verrataan edellisen segmentin
+todelliseen lopputilaan (initial_state / return_state). Jos ne eroavat,
+segmentti lasketaan uudelleen todellisesta tilasta, joten tulos on aina
+tavu tavulta sama kuin peräkkäisellä ajolla.
+
+Aikarajatut vaiheet (engine="exact", improve_time_budget > 0) eivät ole
+toistettavia, joten niillä matka generoidaan peräkkäin.
+
+Kutsujan initial_state aloittaa ensimmäisen segmentin, ja muiden
+segmenttien päivien indeksit lasketaan sen day_index:stä.
+"""
+
+import time
+from itertools import islice
+from multiprocessing import Pool
+
+from sea_watch_17 import (
+    WORKERS,
+    build_workbook_and_report,
+    find_reset_points,
+    generate_schedule,
+    generate_schedule_iter,
+)
+
+
+DEFAULT_MIN_SEGMENT_DAYS = 7
+
+
+def plan_segments(days_data, min_segment_days=DEFAULT_MIN_SEGMENT_DAYS):
+    """
+    Jakaa matkan nollakohdissa segmentteihin, joissa on vähintään
+    min_segment_days päivää (viimeinen segmentti voi olla lyhyempi vain jos
+    koko matka on).
+
+    Returns:
+        Lista (start, end) -pareja päivien indekseinä
+    """
+    num_days = len(days_data)
+    cuts = []
+    start = 0
+    for point in find_reset_points(days_data):
+        if point - start >= min_segment_days and num_days - point >= min_segment_days:
+            cuts.append(point)
+            start = point
+    bounds = [0] + cuts + [num_days]
+    return [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1) if bounds[i] < bounds[i + 1]]
+
+
+def run_segment(days_data, start, end, constraints, generate_kwargs, initial_state=None,
+                first_day=0):
+    """
+    Generoi segmentin days_data[start:end] (prosessipoolin työfunktio).
+
+    Ilman initial_state:a segmentti lämmitellään: päivä start-1 generoidaan
+    tyhjästä tilasta, ja sen jälkeinen tila on segmentin oletettu alkutila.
+    first_day on days_data[0]:n indeksi matkalla.
+
+    Returns:
+        (alkutila, päivät [(day_idx, days)], lopputila)
+    """
+    # Lähde jatkuu segmentin yli, jotta viimeinen päivä näkee seuraavan
+    # päivän tapahtumat (use_next_day_events); generointi lopetetaan islicellä
+    if initial_state is None and start > 0:
+        warmup = {
+            'day_index': first_day + start - 1,
+            'prev_day_info': days_data[start - 2] if start >= 2 else None,
+        }
+        stream = generate_schedule_iter(
+            islice(days_data, start - 1, None), constraints, initial_state=warmup,
+            with_state=True, **generate_kwargs
+        )
+        _, _, initial_state = next(stream)
+    else:
+        stream = generate_schedule_iter(
+            islice(days_data, start, None), constraints, initial_state=initial_state,
+            with_state=True, **generate_kwargs
+        )
+
+    days = []
+    state = initial_state
+    for day_idx, day, state in islice(stream, end - start):
+        days.append((day_idx, day))
+    return initial_state, days, state
+
+
+def generate_schedule_parallel(days_data, constraints=None, max_workers=None,
+                               min_segment_days=DEFAULT_MIN_SEGMENT_DAYS, **generate_kwargs):
+    """
+    Generoi työvuorot segmenteittäin rinnakkain; tulos on sama kuin
+    generate_schedule:lla.
+
+    Args:
+        max_workers: Prosessien määrä (None = ytimien määrä, 0 tai 1 = ajo
+            peräkkäin ilman poolia)
+        min_segment_days: Segmentin vähimmäispituus (lyhyet segmentit eivät
+            kannata prosessin käynnistystä)
+        generate_kwargs: Muut generate_schedule-parametrit
+            (min_longest_rest_hours, use_next_day_events, variant,
+            initial_state, return_state, ...)
+
+    Returns:
+        (workbook, all_days, report, summary); summary: segments ((start, end)
+        -parit), reset_points, recomputed (uudelleen lasketut segmentit),
+        parallel, elapsed.
+        return_state=True: (workbook, all_days, report, summary, state)
+    """
+    started = time.perf_counter()
+    initial_state = generate_kwargs.pop('initial_state', None)
+    return_state = generate_kwargs.pop('return_state', False)
+    # Virheelliset asetukset esiin ennen poolin käynnistystä
+    generate_schedule_iter([], constraints, initial_state=initial_state, **generate_kwargs)
+    first_day = (initial_state or {}).get('day_index', 0)
+    segments = plan_segments(days_data, min_segment_days)
+    timed = (generate_kwargs.get('engine', 'greedy') != 'greedy'
+             or generate_kwargs.get('improve_time_budget', 0) > 0)
+    summary = {
+        'segments': segments,
+        'reset_points': find_reset_points(days_data),
+        'recomputed': [],
+        'parallel': False,
+    }
+
+    if len(segments) <= 1 or timed or (max_workers is not None and max_workers <= 1):
+        wb, all_days, report, state = generate_schedule(
+            days_data, constraints, initial_state=initial_state, return_state=True,
+            **generate_kwargs
+        )
+        summary['segments'] = [(0, len(days_data))] if days_data else []
+        summary['elapsed'] = time.perf_counter() - started
+        if return_state:
+            return wb, all_days, report, summary, state
+        return wb, all_days, report, summary
+
+    summary['parallel'] = True
+    all_days = {w: [] for w in WORKERS}
+    # Poolista poistuttaessa terminate(): virhetilanteessa keskeneräiset
+    # segmentit lopetetaan
+    with Pool(max_workers) as pool:
+        pending = [
+            pool.apply_async(run_segment, (days_data, start, end, constraints, generate_kwargs),
+                             {'first_day': first_day})
+            for start, end in segments[1:]
+        ]
+        # Ensimmäinen segmentti alkaa matkan alusta, joten se ajetaan täällä
+        start, end = segments[0]
+        _, days, state = run_segment(
+            days_data, start, end, constraints, generate_kwargs, initial_state=initial_state
+        )
+        for _, day in days:
+            for worker in WORKERS:
+                all_days[worker].append(day[worker])
+
+        for index, result in enumerate(pending, 1):
+            assumed, days, final = result.get()
+            if assumed != state:
+                # Oletettu alkutila ei pitänyt: lasketaan todellisesta tilasta
+                start, end = segments[index]
+                _, days, final = run_segment(
+                    days_data, start, end, constraints, generate_kwargs, initial_state=state
+                )
+                summary['recomputed'].append(index)
+            for _, day in days:
+                for worker in WORKERS:
+                    all_days[worker].append(day[worker])
+            state = final
+
+    wb, report = build_workbook_and_report(all_days, len(days_data), WORKERS)
+    summary['elapsed'] = time.perf_counter() - started
+    if return_state:
+        return wb, all_days, report, summary, state
+    return wb, all_days, report, summary
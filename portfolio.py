@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Portfolio - Usean heuristiikkamuunnelman rinnakkainen ajo ja paras tulos
+
+generate_schedule on deterministinen: yksi tasapelien ratkaisujärjestys, yksi
+jatkuvan yön tekijäjako ja jakokohta sekä kiinteät tasapainotuksen tavoitteet.
+Portfolio ajaa N muunnelmaa (sea_watch_17.VARIANT_KEYS) prosessipoolissa,
+pisteyttää jokaisen samalla tavoitteella (sea_watch_17.score_schedule) ja
+palauttaa parhaan. Muunnelma 0 on aina oletusheuristiikka, joten tulos ei
+koskaan ole oletusta huonompi.
+
+Poolissa kaikki muunnelmat oletus mukaan lukien ajetaan työprosesseissa;
+aikarajan jälkeen valmistumattomat muunnelmat hylätään ja niiden työprosessit
+lopetetaan (multiprocessing.Pool.terminate). Aikarajan kanssa pääprosessi
+laskee samaan aikaan ahneen oletuksen (engine='greedy', ei aikabudjetteja),
+jota käytetään oletuksen tilalla, jos oletusmuunnelma ei ehdi aikarajaan.
+"""
+
+import queue
+import random
+import time
+from multiprocessing import Pool
+
+from sea_watch_17 import (
+    DAYMEN,
+    NORMAL_START,
+    WORKERS,
+    build_workbook_and_report,
+    generate_schedule,
+    score_schedule,
+)
+
+
+DEFAULT_VARIANTS = 8
+TARGET_HOURS = (8.0, 8.5, 9.0)
+SOFT_UPPER_HOURS = (9.0, 9.5, 10.0)
+
+
+def portfolio_variants(count, seed=0):
+    """
+    Muunnelmat portfoliolle: ensimmäinen on oletus ({}), muut satunnaisia.
+
+    Sama count ja seed antavat aina samat muunnelmat.
+    """
+    rng = random.Random(seed)
+    variants = [{}]
+    while len(variants) < count:
+        order = list(DAYMEN)
+        rng.shuffle(order)
+        variants.append({
+            'dayman_order': order,
+            'swap_night_workers': rng.random() < 0.5,
+            'night_split': rng.choice(('auto', None, rng.randrange(2, NORMAL_START - 1))),
+            'target_hours': rng.choice(TARGET_HOURS),
+            'soft_upper_hours': rng.choice(SOFT_UPPER_HOURS),
+        })
+    return variants[:count]
+
+
+def run_variant(days_data, constraints, min_longest_rest_hours, variant, generate_kwargs):
+    """
+    Ajaa yhden muunnelman ja pisteyttää sen (prosessipoolin työfunktio).
+
+    Returns:
+        (score, all_days, report); työkirja kootaan vasta parhaasta
+    """
+    _, all_days, report = generate_schedule(
+        days_data, constraints=constraints, min_longest_rest_hours=min_longest_rest_hours,
+        variant=variant, **generate_kwargs
+    )
+    score = score_schedule(all_days, days_data, constraints, min_longest_rest_hours)
+    return score, all_days, report
+
+
+def generate_portfolio(days_data, constraints=None, min_longest_rest_hours=6,
+                       variants=DEFAULT_VARIANTS, max_workers=None, time_limit=None,
+                       seed=0, **generate_kwargs):
+    """
+    Generoi työvuorot usealla heuristiikkamuunnelmalla ja palauttaa parhaan.
+
+    Args:
+        variants: Muunnelmien määrä tai valmis lista muunnelma-dictejä
+        max_workers: Prosessien määrä (None = ytimien määrä, 0 tai 1 = ajo
+            samassa prosessissa ilman poolia)
+        time_limit: Aikaraja sekunteina (None = odota kaikki); kesken jääneet
+            muunnelmat keskeytetään ja myöhästynyt oletus korvataan ahneella
+            oletuksella. Ilman poolia (max_workers <= 1) raja tarkistetaan vain
+            muunnelmien välissä: käynnissä oleva muunnelma ajetaan loppuun.
+        seed: Satunnaisten muunnelmien siemen
+        generate_kwargs: Muut generate_schedule-parametrit (engine, ...)
+
+    Returns:
+        (workbook, all_days, report, summary); summary: best (indeksi),
+        variant, score, scores ({indeksi: pisteet} valmistuneille),
+        completed, greedy_fallback (True, jos oletuksen tilalla on ahne
+        oletus), elapsed
+    """
+    if isinstance(variants, int):
+        variants = portfolio_variants(variants, seed)
+    variants = [dict(v) for v in variants] or [{}]
+    started = time.perf_counter()
+    deadline = None if time_limit is None else started + time_limit
+    results = {}
+    greedy_fallback = False
+
+    def args(index):
+        return (days_data, constraints, min_longest_rest_hours, variants[index], generate_kwargs)
+
+    if max_workers is not None and max_workers <= 1:
+        for index in range(len(variants)):
+            if index and deadline is not None and time.perf_counter() >= deadline:
+                break
+            results[index] = run_variant(*args(index))
+    else:
+        greedy_kwargs = {
+            key: value for key, value in generate_kwargs.items()
+            if key not in ('engine', 'exact_time_budget', 'improve_time_budget')
+        }
+        fallback = None
+        finished = queue.Queue()
+        # Poolista poistuttaessa terminate(): kesken jääneet muunnelmat lopetetaan
+        with Pool(max_workers) as pool:
+            for index in range(len(variants)):
+                pool.apply_async(
+                    run_variant, args(index),
+                    callback=lambda result, index=index: finished.put((index, result, None)),
+                    error_callback=lambda error, index=index: finished.put((index, None, error)),
+                )
+            if deadline is not None:
+                # Ahne oletus lasketaan valmiiksi pääprosessissa poolin rinnalla,
+                # jotta myöhästynyt oletus ei pidennä ajoa aikarajan yli
+                fallback = run_variant(
+                    days_data, constraints, min_longest_rest_hours, variants[0], greedy_kwargs
+                )
+            for _ in range(len(variants)):
+                timeout = None if deadline is None else max(0.0, deadline - time.perf_counter())
+                try:
+                    index, result, error = finished.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if error is not None:
+                    raise error
+                results[index] = result
+        greedy_fallback = 0 not in results
+        if greedy_fallback:
+            results[0] = fallback
+
+    # Paras pisteillä, tasapelissä pienin indeksi (oletus voittaa tasapelin)
+    best = min(results, key=lambda index: (results[index][0], index))
+    score, all_days, report = results[best]
+    wb, _ = build_workbook_and_report(all_days, len(days_data), WORKERS)
+    summary = {
+        'best': best,
+        'variant': variants[best],
+        'score': score,
+        'scores': {index: results[index][0] for index in sorted(results)},
+        'completed': len(results) - greedy_fallback,
+        'greedy_fallback': greedy_fallback,
+        'elapsed': time.perf_counter() - started,
+    }
+    return wb, all_days, report, summary
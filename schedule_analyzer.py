@@ -11,8 +11,11 @@ Analysoi generoituja työvuoroja ja tunnistaa:
 """
 
 from typing import Dict, List, Any
+from stcw_engine import RestProfile, check_stcw_profiles, pack_slots, work_gaps
+from day_schedule import work_bits
 from sea_watch_17 import (
     check_stcw_sliding,
+    check_stcw_timeline,
     get_work_ranges,
     slot_to_time_str,
     NORMAL_START,
@@ -24,12 +27,140 @@ from sea_watch_17 import (
 )
 
 
+def build_stcw_timeline(all_days: Dict, worker: str,
+                        min_longest_rest_hours: float = 6) -> Dict[str, List]:
+    """
+    Laskee työntekijän STCW-aikajanan koko matkan yli yhdellä läpikäynnillä.
+    
+    Returns:
+        Dict: status, total_rest, longest_rest (arvo per slotti, päivät peräkkäin)
+    """
+    work = []
+    for day in all_days[worker]:
+        work.extend(day['work_slots'])
+    return check_stcw_timeline(work, min_longest_rest_hours)
+
+
+def stcw_verdict_from_timeline(timeline: Dict[str, List], day_idx: int) -> tuple:
+    """
+    Johtaa check_stcw_sliding-tuloksen (edellinen päivä + päivä day_idx)
+    aikajanasta ilman uutta laskentaa.
+    
+    Liukuvan tarkistuksen ikkuna alkaen edellisen päivän slotista s päättyy
+    aikajanan slottiin 48 * (day_idx - 1) + 47 + s.
+    
+    Returns:
+        (ok, worst_slot, {'total_rest', 'longest_rest'}) tai (True, None, None)
+    """
+    first = 48 * day_idx - 1
+    worst_slot = None
+    worst_total = None
+    for s in range(48):
+        t = first + s
+        if timeline['status'][t] == "OK":
+            continue
+        if worst_slot is None or timeline['total_rest'][t] < worst_total:
+            worst_slot = s
+            worst_total = timeline['total_rest'][t]
+    
+    if worst_slot is None:
+        return True, None, None
+    t = first + worst_slot
+    return False, worst_slot, {
+        'total_rest': timeline['total_rest'][t],
+        'longest_rest': timeline['longest_rest'][t],
+    }
+
+
+def find_stcw_violation_periods(timeline: Dict[str, List], first_slot: int = 47) -> List[Dict]:
+    """
+    Ryhmittelee aikajanan peräkkäiset rikeslotit jaksoiksi.
+    
+    Oletuksena ohitetaan ensimmäisen päivän ikkunat joihin kuuluu aikaa
+    ennen matkan alkua (kuten päiväkohtainen tarkistus).
+    
+    Returns:
+        Lista dictejä: start_slot, end_slot (matkan slotteja, end mukaan lukien),
+        status, min_total_rest, min_longest_rest
+    """
+    periods = []
+    current = None
+    statuses = timeline['status']
+    for t in range(first_slot, len(statuses)):
+        if statuses[t] == "OK":
+            current = None
+            continue
+        if current is None:
+            current = {
+                'start_slot': t,
+                'end_slot': t,
+                'status': statuses[t],
+                'min_total_rest': timeline['total_rest'][t],
+                'min_longest_rest': timeline['longest_rest'][t],
+            }
+            periods.append(current)
+            continue
+        current['end_slot'] = t
+        if statuses[t] == "TOTAL_REST_VIOLATION":
+            current['status'] = statuses[t]
+        current['min_total_rest'] = min(current['min_total_rest'], timeline['total_rest'][t])
+        current['min_longest_rest'] = min(current['min_longest_rest'], timeline['longest_rest'][t])
+    return periods
+
+
+def format_stcw_violation_period(period: Dict) -> str:
+    """Muotoilee rikejakson, esim. 'päivä 2 06:00 - päivä 2 09:30'."""
+    start_day, start_slot = divmod(period['start_slot'], 48)
+    end_day, end_slot = divmod(period['end_slot'], 48)
+    return (
+        f"päivä {start_day + 1} {slot_to_time_str(start_slot)} - "
+        f"päivä {end_day + 1} {slot_to_time_str(end_slot)}: "
+        f"lepoa vähimmillään {period['min_total_rest']}h, "
+        f"pisin lepo {period['min_longest_rest']}h"
+    )
+
+
+def build_worker_rest_profiles(all_days: Dict, worker: str) -> List[RestProfile]:
+    """Lepoprofiili jokaiselle työntekijän päivälle (lasketaan kerran)."""
+    return [RestProfile.from_bits(work_bits(day)) for day in all_days[worker]]
+
+
+def find_profile_stcw_violations(profiles: List[RestProfile],
+                                 min_longest_rest_hours: float = 6) -> List[Dict]:
+    """
+    Tarkistaa pitkän jakson päiväpareittain pelkistä lepoprofiileista.
+    
+    Returns:
+        Lista rikepäivistä: day_idx (0-pohjainen), worst_slot, total_rest, longest_rest
+    """
+    violations = []
+    for d in range(1, len(profiles)):
+        ok, worst_slot, result = check_stcw_profiles(
+            profiles[d - 1], profiles[d], min_longest_rest_hours
+        )
+        if not ok:
+            violations.append({
+                'day_idx': d,
+                'worst_slot': worst_slot,
+                'total_rest': result['total_rest'],
+                'longest_rest': result['longest_rest']
+            })
+    return violations
+
+
 def analyze_worker_day(worker: str, day_idx: int, day_data: Dict, 
                        prev_day_data: Dict = None,
-                       min_longest_rest_hours: float = 6) -> Dict[str, Any]:
+                       min_longest_rest_hours: float = 6,
+                       stcw_timeline: Dict[str, List] = None,
+                       rest_profile: RestProfile = None,
+                       prev_rest_profile: RestProfile = None) -> Dict[str, Any]:
     """
     Analysoi yhden työntekijän yhden päivän vuorot.
     
+    Jos stcw_timeline (build_stcw_timeline) annetaan, STCW-tulos luetaan
+    siitä eikä päiväparia lasketa uudelleen. Muuten käytetään
+    lepoprofiileja (rest_profile, prev_rest_profile), jos ne on annettu.
+    
     Returns:
         Dict sisältäen:
         - hours: työtunnit
@@ -56,7 +187,14 @@ def analyze_worker_day(worker: str, day_idx: int, day_data: Dict,
         prev_work = prev_day_data['work_slots']
         
         # Käytä liukuvaa 24h ikkunaa
-        ok, worst_slot, stcw_result = check_stcw_sliding(prev_work, work, min_longest_rest_hours)
+        if stcw_timeline is not None:
+            ok, worst_slot, stcw_result = stcw_verdict_from_timeline(stcw_timeline, day_idx)
+        elif rest_profile is not None and prev_rest_profile is not None:
+            ok, worst_slot, stcw_result = check_stcw_profiles(
+                prev_rest_profile, rest_profile, min_longest_rest_hours
+            )
+        else:
+            ok, worst_slot, stcw_result = check_stcw_sliding(prev_work, work, min_longest_rest_hours)
         
         # DEBUG
         print(f"DEBUG STCW {worker} päivä {day_idx+1}: ok={ok}, worst_slot={worst_slot}")
@@ -73,7 +211,10 @@ def analyze_worker_day(worker: str, day_idx: int, day_data: Dict,
             )
     
     # 3. Tarkista turhat tauot (yli 1h aukot työjaksojen välissä)
-    gaps = find_work_gaps(work)
+    if rest_profile is not None:
+        gaps = find_profile_gaps(rest_profile)
+    else:
+        gaps = find_work_gaps(work)
     for gap_start, gap_end, gap_hours in gaps:
         if gap_hours > 1 and gap_start >= NORMAL_START and gap_end <= NORMAL_END:
             # Ohita lounastauko
@@ -101,28 +242,25 @@ def analyze_worker_day(worker: str, day_idx: int, day_data: Dict,
 
 def find_work_gaps(work_slots: List[bool]) -> List[tuple]:
     """
-    Etsii aukot työjaksojen välissä.
+    Etsii aukot työjaksojen välissä (stcw_engine.work_gaps).
     
     Returns:
         Lista tupleista: (gap_start_slot, gap_end_slot, gap_hours)
     """
-    gaps = []
-    in_work = False
-    work_end = None
-    
-    for i, w in enumerate(work_slots):
-        if w:
-            if work_end is not None and not in_work:
-                # Löytyi aukko
-                gap_hours = (i - work_end) / 2
-                if gap_hours >= 1:
-                    gaps.append((work_end, i, gap_hours))
-            in_work = True
-            work_end = i + 1
-        else:
-            in_work = False
-    
-    return gaps
+    return [
+        (start, end, (end - start) / 2)
+        for start, end, _ in work_gaps(pack_slots(work_slots), width=len(work_slots))
+        if end - start >= 2
+    ]
+
+
+def find_profile_gaps(profile: RestProfile) -> List[tuple]:
+    """find_work_gaps lepoprofiilista: työjaksojen väliset vähintään 1h lepojaksot."""
+    return [
+        (start, start + run, run / 2)
+        for start, run in profile.internal_runs
+        if run >= 2
+    ]
 
 
 def count_night_hours(work_slots: List[bool]) -> float:
@@ -267,11 +405,25 @@ def analyze_schedule(all_days: Dict, days_data: List[Dict],
     # Käytä buffer-arvoa jos annettu, muuten stcw-arvoa
     min_longest_rest = buffer_longest_rest_hours if buffer_longest_rest_hours else stcw_longest_rest_hours
     
+    # STCW-aikajana koko matkalle kerralla: päiväanalyysit ja rikejaksot
+    # lukevat sitä, joten lepoprofiileja ei tarvita
+    stcw_timelines = {
+        dm: build_stcw_timeline(all_days, dm, min_longest_rest)
+        for dm in daymen
+    }
+    stcw_periods = []
+    for dm in daymen:
+        for period in find_stcw_violation_periods(stcw_timelines[dm]):
+            period['worker'] = dm
+            stcw_periods.append(period)
+    
     analysis = {
         'num_days': num_days,
         'worker_analyses': [],
         'op_coverage_analyses': [],
         'hour_balance_analyses': [],
+        'stcw_timelines': stcw_timelines,
+        'stcw_violation_periods': stcw_periods,
         'summary': {
             'total_issues': 0,
             'total_warnings': 0,
@@ -308,7 +460,10 @@ def analyze_schedule(all_days: Dict, days_data: List[Dict],
             day_data = all_days[dm][d]
             prev_day_data = all_days[dm][d - 1] if d > 0 else None
             
-            worker_analysis = analyze_worker_day(dm, d, day_data, prev_day_data, min_longest_rest)
+            worker_analysis = analyze_worker_day(
+                dm, d, day_data, prev_day_data, min_longest_rest,
+                stcw_timeline=stcw_timelines[dm]
+            )
             analysis['worker_analyses'].append(worker_analysis)
             
             # Päivitä yhteenveto
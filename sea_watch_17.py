@@ -11,10 +11,38 @@ Vaiheet:
 - VAIHE 4: Täytä aukot
 """
 
+import hashlib
+import heapq
+import json
+import time
+from collections import OrderedDict
+from copy import copy, deepcopy
+from threading import Lock
+
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import PatternFill, Border, Side, Alignment, Font
 from openpyxl.utils import get_column_letter
 
+from stcw_engine import (
+    DAY_MASK,
+    TWO_DAY_MASK,
+    ForwardModel,
+    RestProfile,
+    StcwState,
+    StcwVerdictCache,
+    pack_slots,
+    unpack_slots,
+    check_stcw_at_slot_bits,
+    stcw_timeline,
+    stcw_violation_mask,
+    window_total_slots,
+    work_gaps,
+)
+from day_schedule import DAY_FIELDS, DaySchedule, work_bits
+from exact_day import DEFAULT_TIME_BUDGET, evaluate_day, solve_day_exact
+from local_search import DEFAULT_IMPROVE_BUDGET, W_STCW, improve_day
+
 # ============================================================================
 # VAKIOT
 # ============================================================================
@@ -39,6 +67,34 @@ WORKERS = ['Bosun', 'Dayman EU', 'Dayman PH1', 'Dayman PH2',
 DAYMEN = ['Dayman EU', 'Dayman PH1', 'Dayman PH2']
 WATCHMEN = ['Watchman 1', 'Watchman 2', 'Watchman 3']
 
+# STCW-laskennan toteutus: "bitmask" (stcw_engine) tai "python" (listat)
+STCW_BACKENDS = ('bitmask', 'python')
+STCW_BACKEND = 'bitmask'
+
+# Jaettu LRU-välimuisti bitmask-tarkistuksille (ks. set_stcw_cache_size)
+STCW_CACHE = StcwVerdictCache()
+
+# Daymenien päiväratkaisija: "greedy" (vaiheet) tai "exact" (exact_day)
+ENGINES = ('greedy', 'exact')
+
+# Heuristiikan muunnelman (generate_schedule(variant=...)) avaimet:
+# - dayman_order: daymenien käsittelyjärjestys (tasapelien ratkaisu kaikissa vaiheissa)
+# - swap_night_workers: jatkuvan yön aikaisen ja myöhäisen tekijän vaihto
+# - night_split: jatkuvan yön jakokohta (slotti, "auto" = choose_night_split_slot)
+# - target_hours, soft_upper_hours: lopullisen tasapainotuksen tavoitteet
+VARIANT_KEYS = ('dayman_order', 'swap_night_workers', 'night_split',
+                'target_hours', 'soft_upper_hours')
+
+# Generoinnin kulkeva tila (generate_schedule(initial_state=..., return_state=True)):
+# - day_index: seuraavan generoitavan päivän indeksi matkalla (rajoitteet, siemen)
+# - prev_day_work: edellisen päivän daymenien työslotit {dayman: 48 bool}
+# - pending_next_day: keskiyön yli kulkevat slotit {dayman: {'work': [...], 'sluice': [...]}}
+# - prev_day_info: edellisen päivän days_data-rivi (jatkuvan yön tunnistus)
+SCHEDULE_STATE_KEYS = ('day_index', 'prev_day_work', 'pending_next_day', 'prev_day_info')
+
+# STCW-korjauksen (fix_stcw_violations) siirtojen enimmäismäärä päivässä
+STCW_REPAIR_MAX_MOVES = 100
+
 
 # ============================================================================
 # AIKA- JA SLOTTIFUNKTIOT
@@ -117,6 +173,122 @@ def parse_time_str(time_str):
     return time_to_slot(h, m)
 
 
+# ============================================================================
+# TYÖPÄIVÄN TILA
+# ============================================================================
+
+class WorkerDayState(list):
+    """
+    Työntekijän päivän työslotit ja juoksevat laskurit.
+
+    On tavallinen 48 alkion bool-lista, joten vaiheet käsittelevät sitä
+    kuten ennenkin (work[s] = True, add_block, work[:]). Alkion asetus
+    päivittää laskurit inkrementaalisesti, joten tunnit, yötunnit,
+    ensimmäinen/viimeinen työslotti ja blokkien määrä ovat O(1).
+
+    masks: päivän kategorialistat (arrival_slots, ...) samassa paikassa,
+    ks. to_day_schedule().
+    """
+
+    __slots__ = ('bits', 'work_count', 'night_count', 'block_count', 'masks')
+
+    _NIGHT_MASK = ((1 << NORMAL_START) - 1) | (((1 << 48) - 1) & ~((1 << NORMAL_END) - 1))
+
+    def __init__(self, slots=None, masks=None):
+        super().__init__(slots if slots is not None else [False] * 48)
+        self.masks = masks if masks is not None else {}
+        self._recount()
+
+    def _recount(self):
+        self.bits = pack_slots(self)
+        self.work_count = bin(self.bits).count('1')
+        self.night_count = bin(self.bits & self._NIGHT_MASK).count('1')
+        # Blokin alku = työslotti, jota ei edellä työslotti
+        self.block_count = bin(self.bits & ~(self.bits << 1)).count('1')
+
+    def __setitem__(self, slot, value):
+        if isinstance(slot, slice):
+            super().__setitem__(slot, value)
+            self._recount()
+            return
+        if slot < 0:
+            slot += 48
+        value = bool(value)
+        if self[slot] == value:
+            super().__setitem__(slot, value)
+            return
+        super().__setitem__(slot, value)
+        neighbours = (slot > 0 and self[slot - 1]) + (slot < 47 and self[slot + 1])
+        step = 1 if value else -1
+        self.bits ^= 1 << slot
+        self.work_count += step
+        if not (NORMAL_START <= slot < NORMAL_END):
+            self.night_count += step
+        self.block_count += step * (1 - neighbours)
+
+    @property
+    def hours(self):
+        return self.work_count / 2
+
+    @property
+    def night_hours(self):
+        """Työtunnit 00:00-08:00 ja 17:00-24:00."""
+        return self.night_count / 2
+
+    @property
+    def first_work_slot(self):
+        """Ensimmäinen työslotti (-1 jos ei töitä)."""
+        return (self.bits & -self.bits).bit_length() - 1
+
+    @property
+    def last_work_slot(self):
+        """Viimeinen työslotti (-1 jos ei töitä)."""
+        return self.bits.bit_length() - 1
+
+    def count_slots(self, start, end):
+        """Työslottien määrä välillä [start, end)."""
+        return bin(self.bits >> start & ((1 << max(end - start, 0)) - 1)).count('1')
+
+    def last_work_slot_before(self, end):
+        """Viimeinen työslotti ennen slottia end (-1 jos ei ole)."""
+        return (self.bits & ((1 << end) - 1)).bit_length() - 1
+
+    def to_day_schedule(self):
+        """Päivän tallennusmuoto (työslotit + masks)."""
+        return DaySchedule(work_slots=self, **self.masks)
+
+
+def work_hours(work):
+    """Työtunnit: WorkerDayStatesta suoraan, listasta laskemalla."""
+    if isinstance(work, WorkerDayState):
+        return work.work_count / 2
+    return sum(work) / 2
+
+
+def count_work_slots(work, start, end):
+    """Työslottien määrä välillä [start, end)."""
+    if isinstance(work, WorkerDayState):
+        return work.count_slots(start, end)
+    return sum(1 for s in range(start, end) if work[s])
+
+
+def last_work_slot_before(work, end):
+    """Viimeinen työslotti ennen slottia end (-1 jos ei ole)."""
+    if isinstance(work, WorkerDayState):
+        return work.last_work_slot_before(end)
+    for s in range(end - 1, -1, -1):
+        if work[s]:
+            return s
+    return -1
+
+
+def work_slot_bits(work):
+    """Työslotit bittimaskina: WorkerDayStatesta suoraan, listasta pakkaamalla."""
+    if isinstance(work, WorkerDayState):
+        return work.bits
+    return pack_slots(work)
+
+
 # ============================================================================
 # WATCHMAN-FUNKTIOT
 # ============================================================================
@@ -288,7 +460,7 @@ def find_available_watchman(slot, watchman_states, wm_work, max_hours=MAX_HOURS)
         if wm_work[wm][slot]:
             continue  # Jo töissä tässä slotissa
         
-        current_hours = sum(wm_work[wm]) / 2
+        current_hours = work_hours(wm_work[wm])
         if current_hours >= max_hours:
             continue  # Max tunnit täynnä
         
@@ -298,21 +470,65 @@ def find_available_watchman(slot, watchman_states, wm_work, max_hours=MAX_HOURS)
     return None
 
 
-def would_cause_stcw_violation(dm, new_slots, dm_work, prev_day_work, min_longest_rest_hours=6):
+def assumed_next_day(next_day_info=None):
     """
-    Tarkistaa aiheuttaisiko uusien slottien lisääminen STCW-rikkeen.
+    Oletettu seuraava työpäivä eteenpäin-tarkistuksiin.
     
-    Tarkistaa sekä edellinen->nykyinen että nykyinen->seuraava päivä.
-    Huomioi myös carry-overin (slotit jotka menevät yli keskiyön).
+    Oletuksena normaali 08-16 työpäivä ilman lounasta. Jos seuraavan päivän
+    tiedot (days_data) annetaan, mukaan lisätään sen tunnetut kaikkien
+    daymanien tapahtumat (tulot ja shiftaukset).
+    
+    Returns:
+        48 slotin bool-lista
+    """
+    next_day = [False] * 48
+    
+    # Lisää normaali työpäivä (08-16, lounas pois)
+    for slot in range(NORMAL_START, NORMAL_END):
+        if LUNCH_START <= slot < LUNCH_END:
+            continue
+        next_day[slot] = True
+    
+    if next_day_info is not None:
+        times = parse_day_times(next_day_info)
+        for start in times.get('arrival_starts', []) + times.get('shifting_starts', []):
+            for slot in range(start, min(start + 2, 48)):
+                next_day[slot] = True
+    
+    return next_day
+
+
+# Koottujen eteenpäin-mallien muisti: (seuraavan päivän bitit, pisin lepo) -> malli
+_FORWARD_MODELS = OrderedDict()
+FORWARD_MODEL_CACHE_MAX = 64
+
+
+def get_forward_model(next_day_bits, min_longest_rest_hours=6):
+    """
+    Palauttaa kootun ForwardModel-olion seuraavalle päivälle.
+    
+    Mallit jaetaan koko prosessissa: sama seuraava päivä (esim. oletuspäivä
+    + sama carry-over) kootaan vain kerran.
+    """
+    key = (next_day_bits, min_longest_rest_hours)
+    model = _FORWARD_MODELS.get(key)
+    if model is None:
+        model = ForwardModel(next_day_bits, min_longest_rest_hours)
+        _FORWARD_MODELS[key] = model
+        while len(_FORWARD_MODELS) > FORWARD_MODEL_CACHE_MAX:
+            _FORWARD_MODELS.popitem(last=False)
+    return model
+
+
+def _stcw_violation_pairs(dm, new_slots, dm_work, prev_day_work, next_day=None):
+    """
+    Muodostaa would_cause_stcw_violation-tarkistuksen (edellinen, nykyinen) -parit.
     
     Args:
-        dm: Dayman
-        new_slots: Lista sloteista jotka lisättäisiin
-        dm_work: Nykyiset työvuorot (dict tai lista)
-        prev_day_work: Edellisen päivän työvuorot (dict tai lista)
-        
+        next_day: Oletettu seuraava päivä (oletus: assumed_next_day())
+    
     Returns:
-        True jos aiheuttaisi rikkeen
+        [(prev_work, current_work), (current_work, next_day_work)]
     """
     # Hae nykyinen työvuoro
     if isinstance(dm_work, dict):
@@ -334,30 +550,139 @@ def would_cause_stcw_violation(dm, new_slots, dm_work, prev_day_work, min_longes
     else:
         prev_work = prev_day_work if prev_day_work else [False] * 48
     
-    # Tarkista edellinen->nykyinen
-    ok1, _, _ = check_stcw_sliding(prev_work, current_work, min_longest_rest_hours)
-    if not ok1:
-        return True
-    
-    # Tarkista nykyinen->seuraava (oletus: normaali 08-16 työpäivä + carry-over)
-    next_day_work = [False] * 48
+    # Nykyinen->seuraava (oletettu päivä + carry-over)
+    next_day_work = list(next_day) if next_day is not None else assumed_next_day()
     
     # Lisää carry-over slotit
     for slot in carry_over_slots:
         if 0 <= slot < 48:
             next_day_work[slot] = True
     
-    # Lisää normaali työpäivä (08-16, lounas pois)
-    for slot in range(NORMAL_START, NORMAL_END):
-        if LUNCH_START <= slot < LUNCH_END:
-            continue
-        next_day_work[slot] = True
+    return [(prev_work, current_work), (current_work, next_day_work)]
+
+
+def would_cause_stcw_violation(dm, new_slots, dm_work, prev_day_work, min_longest_rest_hours=6,
+                               next_day=None):
+    """
+    Tarkistaa aiheuttaisiko uusien slottien lisääminen STCW-rikkeen.
     
-    ok2, _, _ = check_stcw_sliding(current_work, next_day_work, min_longest_rest_hours)
-    if not ok2:
-        return True
+    Tarkistaa sekä edellinen->nykyinen että nykyinen->seuraava päivä.
+    Huomioi myös carry-overin (slotit jotka menevät yli keskiyön).
     
-    return False
+    Args:
+        dm: Dayman
+        new_slots: Lista sloteista jotka lisättäisiin
+        dm_work: Nykyiset työvuorot (dict tai lista)
+        prev_day_work: Edellisen päivän työvuorot (dict tai lista)
+        next_day: Oletettu seuraava päivä (oletus: normaali 08-16 päivä)
+        
+    Returns:
+        True jos aiheuttaisi rikkeen
+    """
+    matrix = stcw_feasibility_matrix(
+        [dm], [new_slots], dm_work, prev_day_work, min_longest_rest_hours, next_day
+    )
+    return not matrix[dm][0]
+
+
+def would_cause_stcw_violation_many(workers, new_slots, dm_work, prev_day_work, min_longest_rest_hours=6,
+                                    next_day=None):
+    """
+    would_cause_stcw_violation usealle työntekijälle yhdellä kutsulla.
+    
+    Returns:
+        Dict {työntekijä: True jos aiheuttaisi rikkeen}
+    """
+    matrix = stcw_feasibility_matrix(
+        workers, [new_slots], dm_work, prev_day_work, min_longest_rest_hours, next_day
+    )
+    return {dm: not matrix[dm][0] for dm in workers}
+
+
+def stcw_feasibility_matrix(workers, slot_groups, dm_work, prev_day_work, min_longest_rest_hours=6,
+                            next_day=None):
+    """
+    Kokeilee usean slottiryhmän lisäämistä usealle työntekijälle kerralla.
+    
+    Vastaa would_cause_stcw_violation-kutsua jokaiselle (työntekijä, ryhmä)
+    -parille, mutta ryhmien bittimaskit ja oletettu seuraava päivä
+    lasketaan vain kerran, ja työntekijän edellinen ja nykyinen päivä
+    pakataan kerran kaikille ryhmille. Slotit >= 48 siirtyvät seuraavalle
+    päivälle (carry-over). Eteenpäin-tarkistus tehdään koottua
+    ForwardModel-taulukkoa vasten.
+    
+    Args:
+        workers: Työntekijät (dm_work-avaimet, tai yksi kun dm_work on lista)
+        slot_groups: Lista slottilistoja
+        dm_work: Nykyiset työvuorot (dict tai lista)
+        prev_day_work: Edellisen päivän työvuorot (dict tai lista)
+        next_day: Oletettu seuraava päivä (oletus: assumed_next_day())
+    
+    Returns:
+        Dict {työntekijä: [True jos ryhmän lisääminen on STCW-OK, ...]}
+    """
+    if next_day is None:
+        next_day = assumed_next_day()
+    next_day_bits = pack_slots(next_day)
+    
+    # Ryhmien maskit jaetaan kaikkien työntekijöiden kesken
+    group_bits = []
+    for group in slot_groups:
+        current_mask = 0
+        carry_mask = 0
+        for slot in group:
+            if 0 <= slot < 48:
+                current_mask |= 1 << slot
+            elif 48 <= slot < 96:
+                carry_mask |= 1 << (slot - 48)
+        group_bits.append((current_mask, next_day_bits | carry_mask))
+    
+    day_pairs = {}
+    for dm in workers:
+        current_work = dm_work[dm] if isinstance(dm_work, dict) else dm_work
+        if isinstance(prev_day_work, dict):
+            prev_work = prev_day_work.get(dm, [False] * 48)
+        else:
+            prev_work = prev_day_work if prev_day_work else [False] * 48
+        day_pairs[dm] = (prev_work, current_work)
+    
+    use_bits = STCW_BACKEND == 'bitmask' and all(
+        len(prev) == 48 and len(cur) == 48 for prev, cur in day_pairs.values()
+    )
+    if not use_bits:
+        return {
+            dm: [
+                all(
+                    check_stcw_ok(cur, prev, min_longest_rest_hours)
+                    for prev, cur in _stcw_violation_pairs(dm, group, dm_work, prev_day_work, next_day)
+                )
+                for group in slot_groups
+            ]
+            for dm in workers
+        }
+    
+    packed = {
+        dm: (pack_slots(prev), pack_slots(cur))
+        for dm, (prev, cur) in day_pairs.items()
+    }
+    
+    forward_models = [
+        get_forward_model(next_bits, min_longest_rest_hours)
+        for _, next_bits in group_bits
+    ]
+    
+    matrix = {}
+    for dm in workers:
+        prev_bits, cur_bits = packed[dm]
+        row = []
+        for (current_mask, _), forward in zip(group_bits, forward_models):
+            bits = cur_bits | current_mask
+            row.append(
+                STCW_CACHE.ok(prev_bits, bits, min_longest_rest_hours)
+                and forward.ok(bits)
+            )
+        matrix[dm] = row
+    return matrix
 
 
 # ============================================================================
@@ -415,6 +740,41 @@ def analyze_stcw(work_48h):
     return analysis
 
 
+def set_stcw_backend(backend):
+    """
+    Valitsee STCW-laskennan toteutuksen.
+    
+    Args:
+        backend: "bitmask" (oletus, stcw_engine) tai "python" (alkuperäinen listatoteutus)
+    
+    Returns:
+        Edellinen toteutus
+    """
+    global STCW_BACKEND
+    if backend not in STCW_BACKENDS:
+        raise ValueError(f"Tuntematon STCW-backend: {backend}")
+    previous = STCW_BACKEND
+    STCW_BACKEND = backend
+    return previous
+
+
+def set_stcw_cache_size(maxsize):
+    """
+    Asettaa STCW-verdiktivälimuistin koon (0 = pois käytöstä).
+    
+    Returns:
+        Edellinen koko
+    """
+    previous = STCW_CACHE.maxsize
+    STCW_CACHE.resize(maxsize)
+    return previous
+
+
+def stcw_cache_info():
+    """Palauttaa STCW-välimuistin osumat, ohitukset, poistot ja koon."""
+    return STCW_CACHE.info()
+
+
 def check_stcw_sliding(prev_day_work, current_day_work, min_longest_rest_hours=6):
     """
     Tarkistaa STCW-vaatimukset liukuvalla 24h ikkunalla.
@@ -433,6 +793,20 @@ def check_stcw_sliding(prev_day_work, current_day_work, min_longest_rest_hours=6
     if current_day_work is None:
         current_day_work = [False] * 48
     
+    if STCW_BACKEND == 'bitmask' and len(prev_day_work) == 48 and len(current_day_work) == 48:
+        return STCW_CACHE.sliding(
+            pack_slots(prev_day_work),
+            pack_slots(current_day_work),
+            min_longest_rest_hours
+        )
+    
+    return _check_stcw_sliding_python(prev_day_work, current_day_work, min_longest_rest_hours)
+
+
+def _check_stcw_sliding_python(prev_day_work, current_day_work, min_longest_rest_hours=6):
+    """
+    Listapohjainen check_stcw_sliding (vertailutoteutus).
+    """
     combined = prev_day_work + current_day_work  # 96 slottia
     
     worst_slot = None
@@ -466,14 +840,54 @@ def check_stcw_ok(work_slots, prev_day_work=None, min_longest_rest_hours=6):
     if prev_day_work is None:
         prev_day_work = [False] * 48
     
+    if STCW_BACKEND == 'bitmask' and len(prev_day_work) == 48 and len(work_slots) == 48:
+        return STCW_CACHE.ok(pack_slots(prev_day_work), pack_slots(work_slots), min_longest_rest_hours)
+    
     ok, _, _ = check_stcw_sliding(prev_day_work, work_slots, min_longest_rest_hours)
     return ok
 
 
+def check_stcw_ok_batch(candidates, min_longest_rest_hours=6):
+    """
+    Tarkistaa STCW:n usealle ehdokkaalle kerralla.
+    
+    Args:
+        candidates: Lista (prev_day_work, current_day_work) -pareja
+    
+    Returns:
+        Lista bool-arvoja samassa järjestyksessä (True = OK)
+    """
+    return [
+        check_stcw_ok(work, prev, min_longest_rest_hours)
+        for prev, work in candidates
+    ]
+
+
+def build_stcw_states(dm_work, prev_day_work, workers, min_longest_rest_hours=6):
+    """
+    Luo jokaiselle työntekijälle StcwState-olion (edellinen + nykyinen päivä).
+    
+    Tilaa käytetään vaiheissa jotka kokeilevat ja lisäävät slotteja yksi
+    kerrallaan: kokeilu ei kopioi listaa ja laskee vain muuttuneet ikkunat.
+    Tila pitää päivittää (set/clear) aina kun listaa muutetaan.
+    """
+    if prev_day_work is None:
+        prev_day_work = {}
+    return {
+        w: StcwState(prev_day_work.get(w, [False] * 48), dm_work[w], min_longest_rest_hours)
+        for w in workers
+    }
+
+
 def check_stcw_at_slot(work_48h, end_slot, min_longest_rest_hours=6):
     """
     Tarkistaa STCW-statuksen tietyssä kohdassa.
     """
+    if STCW_BACKEND == 'bitmask' and end_slot >= 0:
+        return check_stcw_at_slot_bits(
+            pack_slots(work_48h), len(work_48h), end_slot, min_longest_rest_hours
+        )
+    
     start_slot = max(0, end_slot - 47)
     window = work_48h[start_slot:end_slot + 1]
     
@@ -500,6 +914,73 @@ def check_stcw_at_slot(work_48h, end_slot, min_longest_rest_hours=6):
     }
 
 
+def check_stcw_timeline(work_slots, min_longest_rest_hours=6):
+    """
+    STCW-status jokaiselle slotille koko matkan yli.
+    
+    Args:
+        work_slots: Työntekijän kaikkien päivien työslotit peräkkäin
+    
+    Returns:
+        Dict: status, total_rest, longest_rest (listat, arvo per slotti
+        kuten check_stcw_at_slot(work_slots, slot))
+    """
+    if STCW_BACKEND == 'bitmask':
+        return stcw_timeline(work_slots, min_longest_rest_hours)
+    
+    timeline = {'status': [], 'total_rest': [], 'longest_rest': []}
+    for slot in range(len(work_slots)):
+        result = check_stcw_at_slot(work_slots, slot, min_longest_rest_hours)
+        for key in timeline:
+            timeline[key].append(result[key])
+    return timeline
+
+
+# Aikaisimman aloituksen taulukko: (edellisen päivän bitit, tavoiteslotit,
+# pisin lepo) -> aloitusslotti. Täytetään laiskasti ja jaetaan koko prosessissa.
+_EARLIEST_START_TABLE = {}
+EARLIEST_START_TABLE_MAX = 100000
+
+# Synteettisen työpäivän bitit: (aloitusslotti, tavoiteslotit) -> int
+_SYNTHETIC_DAY_BITS = {}
+
+
+def _synthetic_day(start_slot, target_slots):
+    """Työpäivä joka alkaa start_slotista ja ohittaa lounaan (max klo 24 asti)."""
+    test_work = [False] * 48
+    slots_added = 0
+    slot = start_slot
+    
+    while slots_added < target_slots and slot < 48:
+        # Ohita lounas
+        if LUNCH_START <= slot < LUNCH_END:
+            slot += 1
+            continue
+        test_work[slot] = True
+        slots_added += 1
+        slot += 1
+    
+    return test_work
+
+
+def _synthetic_day_bits(start_slot, target_slots):
+    key = (start_slot, target_slots)
+    bits = _SYNTHETIC_DAY_BITS.get(key)
+    if bits is None:
+        bits = pack_slots(_synthetic_day(start_slot, target_slots))
+        _SYNTHETIC_DAY_BITS[key] = bits
+    return bits
+
+
+def _earliest_start_from_bits(prev_bits, target_slots, min_longest_rest_hours):
+    """Laskee taulukon arvon: ensimmäinen aloitus jolla STCW on OK."""
+    for start_slot in range(NORMAL_START, NORMAL_END):
+        test_bits = _synthetic_day_bits(start_slot, target_slots)
+        if STCW_CACHE.ok(prev_bits, test_bits, min_longest_rest_hours):
+            return start_slot
+    return NORMAL_START
+
+
 def find_earliest_valid_start(prev_day_work, min_hours=MIN_HOURS, min_longest_rest_hours=6):
     """
     Etsii aikaisimman aloitusslottin jolla työpäivä ei riko STCW:tä.
@@ -507,6 +988,10 @@ def find_earliest_valid_start(prev_day_work, min_hours=MIN_HOURS, min_longest_re
     Simuloi työpäivän eri aloitusajoilla ja tarkistaa STCW:n.
     Olettaa että työntekijä tekee min_hours tunnin työpäivän.
     
+    Bitmask-backendillä tulos haetaan muistitaulukosta, jonka avain on
+    edellinen päivä pakattuna 48-bittiseksi luvuksi (ikkuna edellisen
+    päivän slotista 0 näkee koko päivän, joten lyhyempi avain ei riitä).
+    
     Args:
         prev_day_work: Edellisen päivän työvuoro (48 slottia)
         min_hours: Tavoitetunnit (oletus 8h)
@@ -524,26 +1009,22 @@ def find_earliest_valid_start(prev_day_work, min_hours=MIN_HOURS, min_longest_re
     
     target_slots = int(min_hours * 2)  # 8h = 16 slottia
     
+    if STCW_BACKEND == 'bitmask' and len(prev_day_work) == 48:
+        key = (pack_slots(prev_day_work), target_slots, min_longest_rest_hours)
+        start_slot = _EARLIEST_START_TABLE.get(key)
+        if start_slot is None:
+            start_slot = _earliest_start_from_bits(*key)
+            if len(_EARLIEST_START_TABLE) < EARLIEST_START_TABLE_MAX:
+                _EARLIEST_START_TABLE[key] = start_slot
+        return start_slot
+    
     # Kokeile eri aloitusaikoja
     for start_slot in range(NORMAL_START, NORMAL_END):
         # Simuloi työpäivä tästä aloituksesta
-        test_work = [False] * 48
-        slots_added = 0
-        slot = start_slot
-        
-        while slots_added < target_slots and slot < 48:
-            # Ohita lounas
-            if LUNCH_START <= slot < LUNCH_END:
-                slot += 1
-                continue
-            test_work[slot] = True
-            slots_added += 1
-            slot += 1
+        test_work = _synthetic_day(start_slot, target_slots)
         
         # Tarkista STCW
-        ok, _, _ = check_stcw_sliding(prev_day_work, test_work, min_longest_rest_hours)
-        
-        if ok:
+        if check_stcw_ok(test_work, prev_day_work, min_longest_rest_hours):
             return start_slot
     
     # Jos mikään aloitusaika ei toimi normaalityöaikana, 
@@ -551,12 +1032,201 @@ def find_earliest_valid_start(prev_day_work, min_hours=MIN_HOURS, min_longest_re
     return NORMAL_START
 
 
+def warm_earliest_start_table(prev_days=None, min_hours_values=(MIN_HOURS,),
+                              min_longest_rest_values=(6,)):
+    """
+    Täyttää aikaisimman aloituksen taulukon etukäteen (valinnainen).
+    
+    Args:
+        prev_days: Edellisten päivien työvuorolistat. Oletuksena kaikki
+            yhden yhtenäisen työblokin päivät (1176 kpl), jotka kattavat
+            tavallisimmat yö- ja iltavuorot.
+        min_hours_values: Tavoitetunnit joille taulukko täytetään
+        min_longest_rest_values: Pisimmän levon vaatimukset
+    
+    Returns:
+        Taulukon koko täytön jälkeen
+    """
+    if prev_days is None:
+        prev_days = (
+            [start <= slot < end for slot in range(48)]
+            for start in range(48) for end in range(start + 1, 49)
+        )
+    
+    prev_days = list(prev_days)
+    for min_hours in min_hours_values:
+        for min_longest_rest_hours in min_longest_rest_values:
+            for prev in prev_days:
+                find_earliest_valid_start(prev, min_hours, min_longest_rest_hours)
+    
+    return len(_EARLIEST_START_TABLE)
+
+
+def clear_earliest_start_table():
+    """Tyhjentää aikaisimman aloituksen taulukon."""
+    _EARLIEST_START_TABLE.clear()
+
+
 # ============================================================================
 # RAJOITTEIDEN KÄSITTELY
 # ============================================================================
 
+def _range_bits(start, end):
+    """Slottivälin [start, end) bitit (tyhjä jos start >= end)."""
+    if start is None or end is None:
+        return 0
+    start = max(start, 0)
+    if start >= end:
+        return 0
+    return ((1 << (end - start)) - 1) << start
+
+
+# Lounastauon slotit (ei täytetä aukkoja täyttäessä)
+LUNCH_BITS = _range_bits(LUNCH_START, LUNCH_END)
+
+# Normaalin työajan (08-17) slotit
+NORMAL_BITS = _range_bits(NORMAL_START, NORMAL_END)
+
+
+class ConstraintIndex:
+    """
+    Rajoitelista käännettynä hakemistoksi.
+
+    Päivä- ja työntekijäkohtaiset säännöt (kielletyt ja pakolliset slotit
+    bittimaskeina, tuntikatto, vapaapäivä) kootaan ensimmäisellä kyselyllä
+    ja tallennetaan, joten can_work_slot, must_work_slot ym. ovat O(1).
+    Semantiikka on sama kuin rajoitelistan läpikäynnillä.
+
+    Iterointi ja len palauttavat alkuperäisen listan, joten hakemistoa voi
+    käyttää kaikkialla missä constraints-listaa on käytetty.
+    """
+
+    __slots__ = ('constraints', '_rules', '_min_hours', '_max_hours', '_days_off', '_night')
+
+    def __init__(self, constraints=None):
+        self.constraints = list(constraints or [])
+        self._rules = {}
+        self._min_hours = {}
+        self._max_hours = {}
+        self._days_off = {}
+        self._night = {}
+        for c in self.constraints:
+            c_type = c.get("type")
+            worker = c.get("worker")
+            if c_type == "min_hours":
+                self._min_hours.setdefault(worker, c.get("value", MIN_HOURS))
+            elif c_type == "max_hours":
+                self._max_hours.setdefault(worker, c.get("value", MAX_HOURS))
+
+    def __iter__(self):
+        return iter(self.constraints)
+
+    def __len__(self):
+        return len(self.constraints)
+
+    def _matching(self, worker, day_idx):
+        for c in self.constraints:
+            c_worker = c.get("worker")
+            c_day = c.get("day")
+            if c_worker and c_worker != worker:
+                continue
+            if c_day is not None and c_day != day_idx + 1:
+                continue
+            yield c
+
+    def rules(self, worker, day_idx):
+        """
+        Työntekijän päivän säännöt: (kielletyt bitit, pakolliset bitit,
+        tuntikatot, kaikki kielletty).
+        """
+        key = (worker, day_idx)
+        rules = self._rules.get(key)
+        if rules is None:
+            forbidden = 0
+            mandatory = 0
+            hour_caps = []
+            blocked = False
+            for c in self._matching(worker, day_idx):
+                c_type = c.get("type")
+                if c_type == "no_night_shift":
+                    forbidden |= _range_bits(0, NORMAL_START)
+                elif c_type == "no_evening_shift":
+                    forbidden |= _range_bits(NORMAL_END, 48)
+                elif c_type == "cannot_work_slot":
+                    forbidden |= _range_bits(
+                        parse_time_str(c.get("start_time")), parse_time_str(c.get("end_time"))
+                    )
+                elif c_type == "must_work_slot":
+                    mandatory |= _range_bits(
+                        parse_time_str(c.get("start_time")), parse_time_str(c.get("end_time"))
+                    )
+                elif c_type == "max_hours":
+                    hour_caps.append(c.get("value", MAX_HOURS))
+                elif c_type == "day_off":
+                    blocked = True
+            rules = (forbidden, mandatory, tuple(hour_caps), blocked)
+            self._rules[key] = rules
+        return rules
+
+    def can_work(self, worker, slot, day_idx, current_hours=0):
+        forbidden, _, hour_caps, blocked = self.rules(worker, day_idx)
+        if blocked or forbidden >> slot & 1:
+            return False
+        for cap in hour_caps:
+            if current_hours >= cap:
+                return False
+        return True
+
+    def must_work(self, worker, slot, day_idx):
+        return bool(self.rules(worker, day_idx)[1] >> slot & 1)
+
+    def mandatory_bits(self, worker, day_idx):
+        return self.rules(worker, day_idx)[1]
+
+    def is_day_off(self, worker, day_idx):
+        key = (worker, day_idx)
+        day_off = self._days_off.get(key)
+        if day_off is None:
+            day_off = any(
+                c.get("type") == "day_off" and c.get("worker") == worker
+                and (c.get("day") is None or c.get("day") == day_idx + 1)
+                for c in self.constraints
+            )
+            self._days_off[key] = day_off
+        return day_off
+
+    def min_hours(self, worker):
+        return self._min_hours.get(worker, MIN_HOURS)
+
+    def max_hours(self, worker):
+        return self._max_hours.get(worker, MAX_HOURS)
+
+    def preferred_night_workers(self, day_idx):
+        """assign_night_shift -työntekijät päivälle rajoitteiden järjestyksessä."""
+        workers = self._night.get(day_idx)
+        if workers is None:
+            workers = tuple(
+                c.get("worker") for c in self.constraints
+                if c.get("type") == "assign_night_shift"
+                and (c.get("day") is None or c.get("day") == day_idx + 1)
+            )
+            self._night[day_idx] = workers
+        return workers
+
+
+def compile_constraints(constraints):
+    """Kääntää rajoitelistan ConstraintIndexiksi (valmis hakemisto palautetaan sellaisenaan)."""
+    if isinstance(constraints, ConstraintIndex):
+        return constraints
+    return ConstraintIndex(constraints)
+
+
 def can_work_slot(worker, slot, day_idx, constraints, current_hours=0):
     """Tarkistaa voiko työntekijä tehdä tietyn slotin."""
+    if isinstance(constraints, ConstraintIndex):
+        if 0 <= slot < 48:
+            return constraints.can_work(worker, slot, day_idx, current_hours)
+        constraints = constraints.constraints
     if not constraints:
         return True
     
@@ -594,6 +1264,10 @@ def can_work_slot(worker, slot, day_idx, constraints, current_hours=0):
 
 def must_work_slot(worker, slot, day_idx, constraints):
     """Tarkistaa onko työntekijän pakko tehdä tietty slotti."""
+    if isinstance(constraints, ConstraintIndex):
+        if 0 <= slot < 48:
+            return constraints.must_work(worker, slot, day_idx)
+        constraints = constraints.constraints
     if not constraints:
         return False
     
@@ -619,6 +1293,8 @@ def must_work_slot(worker, slot, day_idx, constraints):
 
 def is_day_off(worker, day_idx, constraints):
     """Tarkistaa onko työntekijällä vapaapäivä."""
+    if isinstance(constraints, ConstraintIndex):
+        return constraints.is_day_off(worker, day_idx)
     if not constraints:
         return False
     
@@ -633,6 +1309,8 @@ def is_day_off(worker, day_idx, constraints):
 
 def get_min_hours(worker, constraints):
     """Palauttaa työntekijän minimitunnit."""
+    if isinstance(constraints, ConstraintIndex):
+        return constraints.min_hours(worker)
     for c in constraints or []:
         if c.get("worker") == worker and c.get("type") == "min_hours":
             return c.get("value", MIN_HOURS)
@@ -641,6 +1319,8 @@ def get_min_hours(worker, constraints):
 
 def get_max_hours(worker, constraints):
     """Palauttaa työntekijän maksimitunnit."""
+    if isinstance(constraints, ConstraintIndex):
+        return constraints.max_hours(worker)
     for c in constraints or []:
         if c.get("worker") == worker and c.get("type") == "max_hours":
             return c.get("value", MAX_HOURS)
@@ -649,6 +1329,11 @@ def get_max_hours(worker, constraints):
 
 def get_preferred_night_worker(day_idx, constraints, daymen):
     """Palauttaa yövuoroon määrätyn työntekijän."""
+    if isinstance(constraints, ConstraintIndex):
+        for worker in constraints.preferred_night_workers(day_idx):
+            if worker in daymen:
+                return worker
+        return None
     if not constraints:
         return None
     
@@ -666,6 +1351,15 @@ def get_preferred_night_worker(day_idx, constraints, daymen):
 # VAIHE 0: JATKUVIEN YÖVUOROJEN ANALYYSI
 # ============================================================================
 
+def is_continuous_night(curr, next_day):
+    """Jatkuuko päivän curr op keskiyön yli seuraavaan päivään (next_day)."""
+    curr_port_ops = curr.get('port_operations') or []
+    next_port_ops = next_day.get('port_operations') or []
+    curr_op_end = curr_port_ops[-1].get('end_hour') if curr_port_ops else curr.get('port_op_end_hour')
+    next_op_start = next_port_ops[0].get('start_hour') if next_port_ops else next_day.get('port_op_start_hour')
+    return curr_op_end == 0 and next_op_start == 0
+
+
 def analyze_continuous_nights(days_data):
     """
     Analysoi jatkuvat yövuorot etukäteen.
@@ -675,15 +1369,7 @@ def analyze_continuous_nights(days_data):
     num_days = len(days_data)
     
     for d in range(num_days - 1):
-        curr = days_data[d]
-        next_day = days_data[d + 1]
-        
-        curr_port_ops = curr.get('port_operations') or []
-        next_port_ops = next_day.get('port_operations') or []
-        curr_op_end = curr_port_ops[-1].get('end_hour') if curr_port_ops else curr.get('port_op_end_hour')
-        next_op_start = next_port_ops[0].get('start_hour') if next_port_ops else next_day.get('port_op_start_hour')
-        
-        if curr_op_end == 0 and next_op_start == 0:
+        if is_continuous_night(days_data[d], days_data[d + 1]):
             continuous_nights.append({
                 'day_index': d,
             })
@@ -691,6 +1377,34 @@ def analyze_continuous_nights(days_data):
     return continuous_nights
 
 
+def is_reset_day(info):
+    """
+    Pysyykö päivän kaikki ennalta tiedetty työ normaalissa työajassa (08-17):
+    ei op-slotteja sen ulkopuolella eikä tuloja, lähtöjä, slusseja tai
+    shiftauksia sen ulkopuolella (joten myöskään keskiyön yli ei kulje mitään).
+    """
+    times = parse_day_times(info)
+    events = (times.op_bits | times.arrival_bits | times.departure_bits
+              | times.sluice_arr_bits | times.sluice_dep_bits | times.shifting_bits)
+    return not events & ~NORMAL_BITS
+
+
+def find_reset_points(days_data):
+    """
+    Nollakohdat: päivät d (1..N-1), joita edeltävä päivä on is_reset_day eikä
+    jatkuvaa yötä ole päivältä d-1 päivälle d (analyze_continuous_nights).
+
+    Nollakohdan jälkeinen päivä riippuu aiemmista päivistä vain edellisen
+    päivän normaalin työajan työn kautta, joten matkan segmentit voidaan
+    generoida rinnakkain (parallel_segments.generate_schedule_parallel).
+    """
+    night_days = {night['day_index'] + 1 for night in analyze_continuous_nights(days_data)}
+    return [
+        d for d in range(1, len(days_data))
+        if d not in night_days and is_reset_day(days_data[d - 1])
+    ]
+
+
 def evaluate_night_split(prev_early, prev_late, split_slot, arrival_start=None, departure_start=None, min_longest_rest_hours=6):
     """
     Arvioi yövuoron jakokohdan hyvyyttä.
@@ -728,8 +1442,8 @@ def choose_night_split_slot(prev_early, prev_late, arrival_start=None, departure
     best_slot = time_to_slot(3, 0)
     best_score = None
     
-    for split_slot in candidate_slots:
-        score = evaluate_night_split(
+    scores = [
+        evaluate_night_split(
             prev_early,
             prev_late,
             split_slot,
@@ -737,6 +1451,10 @@ def choose_night_split_slot(prev_early, prev_late, arrival_start=None, departure
             departure_start,
             min_longest_rest_hours=min_longest_rest_hours
         )
+        for split_slot in candidate_slots
+    ]
+    
+    for split_slot, score in zip(candidate_slots, scores):
         if best_score is None or score < best_score:
             best_score = score
             best_slot = split_slot
@@ -748,26 +1466,144 @@ def choose_night_split_slot(prev_early, prev_late, arrival_start=None, departure
 # VAIHE 1: PAKOLLISET SLOTIT
 # ============================================================================
 
-def parse_day_times(info):
+class DayTimes:
     """
-    Parsii päivän ajat sloteiksi.
-    Palauttaa dictin kaikista relevanteista sloteista.
+    Päivän ajat sloteina (parse_day_times), muuttumaton.
+
+    Kentät ovat samat kuin aiemmassa dictissä (times['op_start'],
+    times.get('arrival_starts', []) toimivat), listat ovat tupleja.
+    Lisäksi valmiiksi lasketut bittimaskit (bitti = slotti, vain päivän
+    sisällä):
+    - op_bits: satamaoperaatioiden slotit
+    - op_outside_bits: op-slotit normaalin työajan (08-17) ulkopuolella
+    - op_inside_bits: op-slotit normaalina työaikana (ilman lounasta)
+    - arrival_bits, departure_bits, shifting_bits: 1h tapahtumat
+    - sluice_arr_bits, sluice_dep_bits: 2.5h slussit
     """
-    port_operations_info = info.get('port_operations')
-    if port_operations_info:
-        port_operations = []
-        for operation in port_operations_info:
-            op_start_h = operation.get('start_hour')
-            op_start_m = operation.get('start_minute', 0)
-            op_end_h = operation.get('end_hour')
-            op_end_m = operation.get('end_minute', 0)
-            if op_start_h is None:
-                continue
-            op_start = time_to_slot(op_start_h, op_start_m)
-            if op_end_h is not None and op_end_h < op_start_h:
-                op_end = 48
-            elif op_end_h == 0 and op_start_h > 0:
-                op_end = 48
+
+    _KEYS = (
+        'op_start', 'op_end', 'op_ranges',
+        'arrival_start', 'arrival_starts',
+        'departure_start', 'departure_starts',
+        'sluice_arr_start', 'sluice_arr_starts',
+        'sluice_dep_start', 'sluice_dep_starts',
+        'shifting_start', 'shifting_starts',
+    )
+    _BITS = (
+        'op_bits', 'op_outside_bits', 'op_inside_bits', 'arrival_bits', 'departure_bits',
+        'sluice_arr_bits', 'sluice_dep_bits', 'shifting_bits',
+    )
+    __slots__ = _KEYS + _BITS
+
+    def __init__(self, op_ranges=(), arrival_starts=(), departure_starts=(),
+                 sluice_arr_starts=(), sluice_dep_starts=(), shifting_starts=()):
+        op_ranges = tuple(tuple(r) for r in op_ranges)
+        fields = {
+            'op_start': min(start for start, _ in op_ranges) if op_ranges else None,
+            'op_end': max(end for _, end in op_ranges) if op_ranges else None,
+            'op_ranges': op_ranges,
+        }
+        for name, starts in (('arrival', arrival_starts), ('departure', departure_starts),
+                             ('sluice_arr', sluice_arr_starts), ('sluice_dep', sluice_dep_starts),
+                             ('shifting', shifting_starts)):
+            starts = tuple(starts)
+            fields[name + '_starts'] = starts
+            fields[name + '_start'] = starts[0] if starts else None
+
+        op_bits = 0
+        for start, end in op_ranges:
+            op_bits |= _range_bits(start, min(end, 48))
+        normal_bits = _range_bits(NORMAL_START, NORMAL_END)
+        fields['op_bits'] = op_bits
+        fields['op_outside_bits'] = op_bits & ~normal_bits & ~_range_bits(LUNCH_START, LUNCH_START + 1)
+        fields['op_inside_bits'] = op_bits & normal_bits & ~_range_bits(LUNCH_START, LUNCH_END)
+        for name, length in (('arrival', 2), ('departure', 2), ('sluice_arr', 5),
+                             ('sluice_dep', 5), ('shifting', 2)):
+            bits = 0
+            for start in fields[name + '_starts']:
+                bits |= _range_bits(start, min(start + length, 48))
+            fields[name + '_bits'] = bits
+
+        for name, value in fields.items():
+            object.__setattr__(self, name, value)
+
+    @classmethod
+    def from_dict(cls, times):
+        """DayTimes vanhasta dict-muodosta (tai sellaisenaan)."""
+        if isinstance(times, DayTimes):
+            return times
+        return cls(
+            op_ranges=times.get('op_ranges', ()),
+            arrival_starts=times.get('arrival_starts', ()),
+            departure_starts=times.get('departure_starts', ()),
+            sluice_arr_starts=times.get('sluice_arr_starts', ()),
+            sluice_dep_starts=times.get('sluice_dep_starts', ()),
+            shifting_starts=times.get('shifting_starts', ()),
+        )
+
+    def __setattr__(self, name, value):
+        raise AttributeError("DayTimes on muuttumaton")
+
+    def __delattr__(self, name):
+        raise AttributeError("DayTimes on muuttumaton")
+
+    def __getitem__(self, key):
+        if key not in self._KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        if key in self._KEYS:
+            return getattr(self, key)
+        return default
+
+    def __contains__(self, key):
+        return key in self._KEYS
+
+    def __iter__(self):
+        return iter(self._KEYS)
+
+    def __len__(self):
+        return len(self._KEYS)
+
+    def keys(self):
+        return list(self._KEYS)
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self._KEYS]
+
+    def __eq__(self, other):
+        if isinstance(other, DayTimes):
+            return self.items() == other.items()
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(tuple(self.items()))
+
+    def __repr__(self):
+        return f"DayTimes({dict(self.items())!r})"
+
+
+def parse_day_times(info):
+    """
+    Parsii päivän ajat sloteiksi.
+    Palauttaa DayTimes-olion (dict-yhteensopiva) kaikista relevanteista sloteista.
+    """
+    port_operations_info = info.get('port_operations')
+    if port_operations_info:
+        port_operations = []
+        for operation in port_operations_info:
+            op_start_h = operation.get('start_hour')
+            op_start_m = operation.get('start_minute', 0)
+            op_end_h = operation.get('end_hour')
+            op_end_m = operation.get('end_minute', 0)
+            if op_start_h is None:
+                continue
+            op_start = time_to_slot(op_start_h, op_start_m)
+            if op_end_h is not None and op_end_h < op_start_h:
+                op_end = 48
+            elif op_end_h == 0 and op_start_h > 0:
+                op_end = 48
             elif op_end_h is not None:
                 op_end = time_to_slot(op_end_h, op_end_m)
             else:
@@ -860,33 +1696,21 @@ def parse_day_times(info):
         shifting_m = info.get('shifting_minute', 0)
         shifting_starts = [time_to_slot(shifting_h, shifting_m)] if shifting_h is not None else []
 
-    # Laske op_start ja op_end jos operaatioita on
-    if port_operations:
-        op_start = min(start for start, _ in port_operations)
-        op_end = max(end for _, end in port_operations)
-    else:
-        op_start = None
-        op_end = None
-
-    return {
-        'op_start': op_start,
-        'op_end': op_end,
-        'op_ranges': port_operations,
-        'arrival_start': arrival_starts[0] if arrival_starts else None,
-        'arrival_starts': arrival_starts,
-        'departure_start': departure_starts[0] if departure_starts else None,
-        'departure_starts': departure_starts,
-        'sluice_arr_start': sluice_arr_starts[0] if sluice_arr_starts else None,
-        'sluice_arr_starts': sluice_arr_starts,
-        'sluice_dep_start': sluice_dep_starts[0] if sluice_dep_starts else None,
-        'sluice_dep_starts': sluice_dep_starts,
-        'shifting_start': shifting_starts[0] if shifting_starts else None,
-        'shifting_starts': shifting_starts,
-    }
+    # op_start ja op_end lasketaan DayTimesissa operaatioista
+    return DayTimes(
+        op_ranges=port_operations,
+        arrival_starts=arrival_starts,
+        departure_starts=departure_starts,
+        sluice_arr_starts=sluice_arr_starts,
+        sluice_dep_starts=sluice_dep_starts,
+        shifting_starts=shifting_starts,
+    )
 
 
 def is_op_slot(times, slot):
     """Palauttaa True jos slot kuuluu johonkin satamaoperaatiojaksoon."""
+    if isinstance(times, DayTimes):
+        return slot >= 0 and bool(times.op_bits >> slot & 1)
     return any(start <= slot < min(end, 48) for start, end in times.get('op_ranges', []))
 
 
@@ -894,11 +1718,13 @@ def apply_constraint_slots(dm_work, dm_ops, daymen, day_idx, times, constraints)
     """
     Vaihe 0.5: Lisää pakolliset slotit rajoitteista (must_work_slot).
     """
+    constraints = compile_constraints(constraints)
     for dm in daymen:
         if is_day_off(dm, day_idx, constraints):
             continue
+        mandatory = constraints.mandatory_bits(dm, day_idx)
         for slot in range(48):
-            if must_work_slot(dm, slot, day_idx, constraints):
+            if mandatory >> slot & 1:
                 dm_work[dm][slot] = True
                 if is_op_slot(times, slot):
                     dm_ops[dm][slot] = True
@@ -912,7 +1738,7 @@ def apply_arrival_slots(dm_work, dm_arr, active_daymen, day_idx, times, constrai
         for dm in active_daymen:
             can_add = True
             for slot in range(arrival_start, arrival_start + 2):
-                if not can_work_slot(dm, slot, day_idx, constraints, sum(dm_work[dm])/2):
+                if not can_work_slot(dm, slot, day_idx, constraints, work_hours(dm_work[dm])):
                     can_add = False
                     break
             if can_add:
@@ -928,13 +1754,13 @@ def apply_departure_slots(dm_work, dm_dep, active_daymen, day_idx, times, constr
         for dm in active_daymen:
             can_do = True
             for slot in range(departure_start, departure_start + 2):
-                if not can_work_slot(dm, slot, day_idx, constraints, sum(dm_work[dm])/2):
+                if not can_work_slot(dm, slot, day_idx, constraints, work_hours(dm_work[dm])):
                     can_do = False
                     break
             if not can_do:
                 continue
 
-            hours = sum(dm_work[dm]) / 2
+            hours = work_hours(dm_work[dm])
             continuity = 1 if (departure_start > 0 and dm_work[dm][departure_start - 1]) else 0
             scores[dm] = -hours + continuity
 
@@ -945,7 +1771,8 @@ def apply_departure_slots(dm_work, dm_dep, active_daymen, day_idx, times, constr
 
 def apply_sluice_arrival_slots(dm_work, dm_sluice, daymen, times, pending_next_day=None,
                                 prev_day_work=None, wm_work=None, wm_sluice=None, 
-                                watchman_states=None, min_longest_rest_hours=6):
+                                watchman_states=None, min_longest_rest_hours=6,
+                                next_day=None):
     """
     Vaihe 1.3: Slussi tulo - 1. tunti 2 henkilöä, loput 1.5h 3 henkilöä (2.5h kokonaan).
     
@@ -957,6 +1784,7 @@ def apply_sluice_arrival_slots(dm_work, dm_sluice, daymen, times, pending_next_d
         wm_work: Watchmanien työvuorot
         wm_sluice: Watchmanien sluice-merkinnät
         watchman_states: Watchmanien extended_start/end tilat
+        next_day: Oletettu seuraava päivä STCW-tarkistukseen (oletus 08-16)
     
     Returns:
         pending_next_day päivitettynä
@@ -972,16 +1800,20 @@ def apply_sluice_arrival_slots(dm_work, dm_sluice, daymen, times, pending_next_d
         # Kaikki slussin slotit (myös yli keskiyön menevät) STCW-tarkistusta varten
         sluice_slots_full = list(range(sluice_arr_start, sluice_arr_start + 5))
         
+        # Tarkista aiheuttaisiko STCW-rikkeen: koko slussi (myös yli keskiyön)
+        # ja 1. tunti samalla kutsulla
+        feasible = stcw_feasibility_matrix(
+            daymen,
+            [sluice_slots_full, [sluice_arr_start, sluice_arr_start + 1]],
+            dm_work, prev_day_work, min_longest_rest_hours, next_day
+        )
+        
         # Pisteytetään daymanit
         scores = {}
         for dm in daymen:
-            hours = sum(dm_work[dm]) / 2
-            # Tarkista aiheuttaisiko STCW-rikkeen (käytä kaikkia slotteja)
-            would_violate = would_cause_stcw_violation(
-                dm, sluice_slots_full, dm_work, prev_day_work, min_longest_rest_hours
-            )
+            hours = work_hours(dm_work[dm])
             # Rankaistaan niitä jotka aiheuttaisivat rikkeen
-            stcw_penalty = -1000 if would_violate else 0
+            stcw_penalty = -1000 if not feasible[dm][0] else 0
             scores[dm] = -hours + stcw_penalty
 
         sorted_daymen = sorted(daymen, key=lambda x: scores[x], reverse=True)
@@ -992,8 +1824,7 @@ def apply_sluice_arrival_slots(dm_work, dm_sluice, daymen, times, pending_next_d
             if len(first_hour_workers) >= 2:
                 break
             # Tarkista STCW
-            if not would_cause_stcw_violation(dm, [sluice_arr_start, sluice_arr_start + 1], 
-                                               dm_work, prev_day_work, min_longest_rest_hours):
+            if feasible[dm][1]:
                 first_hour_workers.append(('dayman', dm))
         
         # Jos ei tarpeeksi daymaneita, käytä watchmaneja
@@ -1023,12 +1854,15 @@ def apply_sluice_arrival_slots(dm_work, dm_sluice, daymen, times, pending_next_d
 
         # Loput 1.5h (3 slottia) - valitse 3 henkilöä
         second_part_workers = []
+        # Käytä kaikkia slotteja (myös yli keskiyön) STCW-tarkistuksessa
+        slots_2nd_full = list(range(sluice_arr_start + 2, sluice_arr_start + 5))
+        second_part_violates = would_cause_stcw_violation_many(
+            sorted_daymen, slots_2nd_full, dm_work, prev_day_work, min_longest_rest_hours, next_day
+        )
         for dm in sorted_daymen:
             if len(second_part_workers) >= 3:
                 break
-            # Käytä kaikkia slotteja (myös yli keskiyön) STCW-tarkistuksessa
-            slots_2nd_full = list(range(sluice_arr_start + 2, sluice_arr_start + 5))
-            if not would_cause_stcw_violation(dm, slots_2nd_full, dm_work, prev_day_work, min_longest_rest_hours):
+            if not second_part_violates[dm]:
                 second_part_workers.append(('dayman', dm))
         
         # Jos ei tarpeeksi daymaneita, käytä watchmaneja
@@ -1062,7 +1896,8 @@ def apply_sluice_arrival_slots(dm_work, dm_sluice, daymen, times, pending_next_d
 
 def apply_sluice_departure_slots(dm_work, dm_sluice, daymen, times, pending_next_day=None,
                                   prev_day_work=None, wm_work=None, wm_sluice=None,
-                                  watchman_states=None, min_longest_rest_hours=6):
+                                  watchman_states=None, min_longest_rest_hours=6,
+                                  next_day=None):
     """
     Vaihe 1.4: Slussi lähtö - 2 henkilöä (2.5h).
     
@@ -1074,6 +1909,7 @@ def apply_sluice_departure_slots(dm_work, dm_sluice, daymen, times, pending_next
         wm_work: Watchmanien työvuorot
         wm_sluice: Watchmanien sluice-merkinnät
         watchman_states: Watchmanien extended_start/end tilat
+        next_day: Oletettu seuraava päivä STCW-tarkistukseen (oletus 08-16)
     
     Returns:
         pending_next_day päivitettynä
@@ -1089,21 +1925,22 @@ def apply_sluice_departure_slots(dm_work, dm_sluice, daymen, times, pending_next
         # Kaikki slussin slotit (myös yli keskiyön menevät) STCW-tarkistusta varten
         sluice_slots_full = list(range(sluice_dep_start, sluice_dep_start + 5))
         
+        # Tarkista aiheuttaisiko STCW-rikkeen (käytä kaikkia slotteja)
+        would_violate = would_cause_stcw_violation_many(
+            daymen, sluice_slots_full, dm_work, prev_day_work, min_longest_rest_hours, next_day
+        )
+        
         # Pisteytetään daymanit
         scores = {}
         for dm in daymen:
-            hours = sum(dm_work[dm]) / 2
+            hours = work_hours(dm_work[dm])
             continuity = 1 if (sluice_dep_start > 0 and dm_work[dm][sluice_dep_start - 1]) else 0
             
             # Tarkista onko jo osallistunut slussiin tänään (rankaistaan)
             already_in_sluice = any(dm_sluice[dm])
             sluice_penalty = -500 if already_in_sluice else 0
             
-            # Tarkista aiheuttaisiko STCW-rikkeen (käytä kaikkia slotteja)
-            would_violate = would_cause_stcw_violation(
-                dm, sluice_slots_full, dm_work, prev_day_work, min_longest_rest_hours
-            )
-            stcw_penalty = -1000 if would_violate else 0
+            stcw_penalty = -1000 if would_violate[dm] else 0
             scores[dm] = -hours + continuity + stcw_penalty + sluice_penalty
 
         sorted_daymen = sorted(daymen, key=lambda x: scores[x], reverse=True)
@@ -1113,7 +1950,7 @@ def apply_sluice_departure_slots(dm_work, dm_sluice, daymen, times, pending_next
         for dm in sorted_daymen:
             if len(selected_workers) >= 2:
                 break
-            if not would_cause_stcw_violation(dm, sluice_slots_full, dm_work, prev_day_work, min_longest_rest_hours):
+            if not would_violate[dm]:
                 selected_workers.append(('dayman', dm))
         
         # Jos ei tarpeeksi daymaneita, käytä watchmaneja
@@ -1163,12 +2000,8 @@ def apply_op_outside_normal_hours(dm_work, dm_ops, active_daymen, day_idx, times
     op_start = times['op_start']
     op_end = times['op_end']
     
-    op_outside_slots = []
-    for start, end in times.get('op_ranges', []):
-        for slot in range(start, min(end, 48)):
-            if (slot < NORMAL_START or slot >= NORMAL_END) and slot != LUNCH_START:
-                op_outside_slots.append(slot)
-    op_outside_slots = sorted(set(op_outside_slots))
+    op_outside_bits = DayTimes.from_dict(times).op_outside_bits
+    op_outside_slots = [slot for slot in range(48) if op_outside_bits >> slot & 1]
     
     # Jos jatkuva yö edellisestä päivästä
     if continuous_night_info is not None:
@@ -1177,12 +2010,12 @@ def apply_op_outside_normal_hours(dm_work, dm_ops, active_daymen, day_idx, times
         night_split_slot = continuous_night_info['split_slot']
         
         for slot in range(0, night_split_slot):
-            if slot in op_outside_slots:
+            if op_outside_bits >> slot & 1:
                 dm_work[early_worker][slot] = True
                 dm_ops[early_worker][slot] = True
         
         for slot in range(night_split_slot, NORMAL_START):
-            if slot in op_outside_slots:
+            if op_outside_bits >> slot & 1:
                 dm_work[late_worker][slot] = True
                 dm_ops[late_worker][slot] = True
         
@@ -1190,62 +2023,64 @@ def apply_op_outside_normal_hours(dm_work, dm_ops, active_daymen, day_idx, times
     
     current_worker = None
     preferred = get_preferred_night_worker(day_idx, constraints, active_daymen)
+    stcw_states = build_stcw_states(dm_work, prev_day_work, active_daymen, min_longest_rest_hours)
     
     for slot in op_outside_slots:
         can_continue = False
         
         if current_worker is not None:
-            current_hours = sum(dm_work[current_worker]) / 2
+            current_hours = work_hours(dm_work[current_worker])
             max_h = get_max_hours(current_worker, constraints)
             
             if current_hours < max_h and can_work_slot(current_worker, slot, day_idx, constraints, current_hours):
-                test_work = dm_work[current_worker][:]
-                test_work[slot] = True
-                stcw_ok = check_stcw_ok(
-                    test_work,
-                    prev_day_work[current_worker],
-                    min_longest_rest_hours=min_longest_rest_hours
-                )
-                
-                if stcw_ok:
+                if stcw_states[current_worker].can_set(slot):
                     can_continue = True
         
         if can_continue:
             dm_work[current_worker][slot] = True
             dm_ops[current_worker][slot] = True
+            stcw_states[current_worker].set(slot)
         else:
             best_dm = _find_best_worker_for_slot(
                 slot, active_daymen, current_worker, dm_work, prev_day_work,
                 day_idx, constraints, preferred,
-                min_longest_rest_hours=min_longest_rest_hours
+                min_longest_rest_hours=min_longest_rest_hours,
+                stcw_states=stcw_states
             )
             
             if best_dm:
                 dm_work[best_dm][slot] = True
                 dm_ops[best_dm][slot] = True
+                stcw_states[best_dm].set(slot)
                 current_worker = best_dm
             elif current_worker is not None:
-                current_hours = sum(dm_work[current_worker]) / 2
+                current_hours = work_hours(dm_work[current_worker])
                 max_h = get_max_hours(current_worker, constraints)
                 if current_hours < max_h:
                     dm_work[current_worker][slot] = True
                     dm_ops[current_worker][slot] = True
+                    stcw_states[current_worker].set(slot)
 
 
 def _find_best_worker_for_slot(slot, active_daymen, current_worker, dm_work, 
                                 prev_day_work, day_idx, constraints, preferred=None,
-                                min_longest_rest_hours=6):
+                                min_longest_rest_hours=6, stcw_states=None):
     """
     Apufunktio: Etsii parhaan työntekijän tietylle slotille.
+    
+    Args:
+        stcw_states: Valinnainen {dm: StcwState}; jos annettu, STCW-kokeilu
+            tehdään tilan kautta ilman listan kopiointia
     """
     best_dm = None
     best_score = -9999
     
+    candidates = []
     for dm in active_daymen:
         if dm == current_worker:
             continue
         
-        current_hours = sum(dm_work[dm]) / 2
+        current_hours = work_hours(dm_work[dm])
         max_h = get_max_hours(dm, constraints)
         
         if current_hours >= max_h:
@@ -1254,14 +2089,19 @@ def _find_best_worker_for_slot(slot, active_daymen, current_worker, dm_work,
         if not can_work_slot(dm, slot, day_idx, constraints, current_hours):
             continue
         
-        test_work = dm_work[dm][:]
-        test_work[slot] = True
-        stcw_ok = check_stcw_ok(
-            test_work,
-            prev_day_work[dm],
-            min_longest_rest_hours=min_longest_rest_hours
-        )
-        
+        candidates.append((dm, current_hours, max_h))
+    
+    if stcw_states is not None:
+        stcw_oks = [stcw_states[dm].can_set(slot) for dm, _, _ in candidates]
+    else:
+        test_pairs = []
+        for dm, _, _ in candidates:
+            test_work = dm_work[dm][:]
+            test_work[slot] = True
+            test_pairs.append((prev_day_work[dm], test_work))
+        stcw_oks = check_stcw_ok_batch(test_pairs, min_longest_rest_hours)
+    
+    for (dm, current_hours, max_h), stcw_ok in zip(candidates, stcw_oks):
         if not stcw_ok:
             continue
         
@@ -1304,13 +2144,8 @@ def fill_op_inside_normal_hours(dm_work, dm_ops, active_daymen, day_idx, times,
     op_start = times['op_start']
     op_end = times['op_end']
     
-    op_inside_slots = []
-    for start, end in times.get('op_ranges', []):
-        for slot in range(max(start, NORMAL_START), min(end, NORMAL_END)):
-            if LUNCH_START <= slot < LUNCH_END:
-                continue
-            op_inside_slots.append(slot)
-    op_inside_slots = sorted(set(op_inside_slots))
+    op_inside_bits = DayTimes.from_dict(times).op_inside_bits
+    op_inside_slots = [slot for slot in range(48) if op_inside_bits >> slot & 1]
     
     for slot in op_inside_slots:
         workers_in_slot = [dm for dm in active_daymen if dm_work[dm][slot]]
@@ -1341,8 +2176,9 @@ def _find_best_worker_for_inside_slot(slot, active_daymen, dm_work, prev_day_wor
     best_dm = None
     best_score = -9999
     
+    candidates = []
     for dm in active_daymen:
-        current_hours = sum(dm_work[dm]) / 2
+        current_hours = work_hours(dm_work[dm])
         max_h = get_max_hours(dm, constraints)
         
         if current_hours >= max_h:
@@ -1362,6 +2198,19 @@ def _find_best_worker_for_inside_slot(slot, active_daymen, dm_work, prev_day_wor
         if slot < earliest_start:
             continue
         
+        candidates.append((dm, current_hours, max_h))
+    
+    test_pairs = []
+    for dm, _, _ in candidates:
+        test_work = dm_work[dm][:]
+        test_work[slot] = True
+        test_pairs.append((prev_day_work.get(dm, [False] * 48), test_work))
+    stcw_oks = check_stcw_ok_batch(test_pairs, min_longest_rest_hours)
+    
+    for (dm, current_hours, max_h), stcw_ok in zip(candidates, stcw_oks):
+        if not stcw_ok:
+            continue
+        
         score = 0
         
         if slot > 0 and dm_work[dm][slot - 1]:
@@ -1369,17 +2218,6 @@ def _find_best_worker_for_inside_slot(slot, active_daymen, dm_work, prev_day_wor
         if slot < 47 and dm_work[dm][slot + 1]:
             score += 200
         
-        test_work = dm_work[dm][:]
-        test_work[slot] = True
-        stcw_ok = check_stcw_ok(
-            test_work,
-            prev_day_work.get(dm, [False] * 48),
-            min_longest_rest_hours=min_longest_rest_hours
-        )
-        
-        if not stcw_ok:
-            continue
-        
         score += (max_h - current_hours) * 10
         
         if score > best_score:
@@ -1402,19 +2240,19 @@ def fill_remaining_hours(dm_work, dm_ops, active_daymen, day_idx, times, constra
         prev_day_work = {dm: [False] * 48 for dm in active_daymen}
     
     for dm in active_daymen:
-        current_hours = sum(dm_work[dm]) / 2
+        current_hours = work_hours(dm_work[dm])
         min_h = get_min_hours(dm, constraints)
         max_h = get_max_hours(dm, constraints)
         
         if current_hours >= min_h:
             continue
         
-        night_work_slots = sum(1 for s in range(0, NORMAL_START) if dm_work[dm][s])
+        night_work_slots = count_work_slots(dm_work[dm], 0, NORMAL_START)
         did_night_shift = night_work_slots >= 4
         
         if did_night_shift:
             _extend_night_shift(dm, dm_work, dm_ops, op_start, op_end, min_h, max_h, 
-                               day_idx, constraints)
+                               day_idx, constraints, times)
             continue
         
         # Laske aikaisin mahdollinen aloitus STCW:n perusteella
@@ -1446,11 +2284,12 @@ def fill_remaining_hours(dm_work, dm_ops, active_daymen, day_idx, times, constra
             dm_work[dm][slot] = True
             if is_op_slot(times, slot):
                 dm_ops[dm][slot] = True
-            current_hours = sum(dm_work[dm]) / 2
+            current_hours = work_hours(dm_work[dm])
             slot += 1
         
         # Jos tunnit eivät riitä, jatka iltapäivään/iltaan (NORMAL_END jälkeen)
         if current_hours < min_h:
+            stcw_state = StcwState(prev_day_work.get(dm, [False] * 48), dm_work[dm], min_longest_rest_hours)
             for slot in range(NORMAL_END, 48):
                 if current_hours >= min_h:
                     break
@@ -1460,29 +2299,24 @@ def fill_remaining_hours(dm_work, dm_ops, active_daymen, day_idx, times, constra
                     continue
                 
                 # Tarkista STCW ennen lisäämistä
-                test_work = dm_work[dm][:]
-                test_work[slot] = True
-                if not check_stcw_ok(test_work, prev_day_work.get(dm, [False] * 48), min_longest_rest_hours):
+                if not stcw_state.can_set(slot):
                     continue
                 
+                stcw_state.set(slot)
                 dm_work[dm][slot] = True
                 if is_op_slot(times, slot):
                     dm_ops[dm][slot] = True
-                current_hours = sum(dm_work[dm]) / 2
+                current_hours = work_hours(dm_work[dm])
 
 
 def _extend_night_shift(dm, dm_work, dm_ops, op_start, op_end, min_h, max_h, 
-                        day_idx, constraints):
+                        day_idx, constraints, times):
     """
     Apufunktio: Laajentaa yövuoroa tarvittaessa.
     """
-    current_hours = sum(dm_work[dm]) / 2
+    current_hours = work_hours(dm_work[dm])
     
-    last_night_slot = -1
-    for s in range(NORMAL_START - 1, -1, -1):
-        if dm_work[dm][s]:
-            last_night_slot = s
-            break
+    last_night_slot = last_work_slot_before(dm_work[dm], NORMAL_START)
     
     if last_night_slot >= 0 and last_night_slot < NORMAL_START - 1:
         for s in range(last_night_slot + 1, NORMAL_START):
@@ -1495,7 +2329,7 @@ def _extend_night_shift(dm, dm_work, dm_ops, op_start, op_end, min_h, max_h,
             dm_work[dm][s] = True
             if is_op_slot(times, s):
                 dm_ops[dm][s] = True
-            current_hours = sum(dm_work[dm]) / 2
+            current_hours = work_hours(dm_work[dm])
 
 
 def ensure_op_coverage(dm_work, dm_ops, op_inside_slots, active_daymen, day_idx, constraints):
@@ -1514,7 +2348,7 @@ def ensure_op_coverage(dm_work, dm_ops, op_inside_slots, active_daymen, day_idx,
         best_score = -9999
         
         for dm in active_daymen:
-            current_hours = sum(dm_work[dm]) / 2
+            current_hours = work_hours(dm_work[dm])
             max_h = get_max_hours(dm, constraints)
             
             if current_hours >= max_h:
@@ -1542,35 +2376,32 @@ def ensure_op_coverage(dm_work, dm_ops, op_inside_slots, active_daymen, day_idx,
 def fill_gaps_between_blocks(dm_work, dm_ops, active_daymen, day_idx, times, constraints):
     """
     Vaihe 3.4: Täytä turhat aukot blokkien välissä.
+
+    Aukot (max 2h lounas mukaan lukien, normaalin työajan sisällä) haetaan
+    yhdellä läpikäynnillä (work_gaps); lounas ja rajoitteiden kieltämät slotit
+    jätetään täyttämättä ja täyttö loppuu tuntikattoon.
     """
-    op_start = times['op_start']
-    op_end = times['op_end']
+    index = compile_constraints(constraints)
     
     for dm in active_daymen:
         work = dm_work[dm]
-        blocks = get_work_blocks(work)
-        max_h = get_max_hours(dm, constraints)
+        forbidden, _, hour_caps, blocked = index.rules(dm, day_idx)
+        if blocked:
+            continue
+        limit = min((get_max_hours(dm, constraints),) + hour_caps)
+        slots = work_slot_bits(work)
+        count = slots.bit_count()
         
-        for i in range(len(blocks) - 1):
-            _, block1_end = blocks[i]
-            block2_start, _ = blocks[i + 1]
-            
-            gap = block2_start - block1_end
-            
-            if 0 < gap <= 4 and block1_end >= NORMAL_START and block2_start <= NORMAL_END:
-                current_hours = sum(work) / 2
-                
-                for s in range(block1_end, block2_start):
-                    if LUNCH_START <= s < LUNCH_END:
-                        continue
-                    if current_hours >= max_h:
-                        break
-                    if not can_work_slot(dm, s, day_idx, constraints, current_hours):
-                        continue
-                    work[s] = True
-                    if is_op_slot(times, s):
-                        dm_ops[dm][s] = True
-                    current_hours = sum(work) / 2
+        for start, end, fill_bits in work_gaps(slots, LUNCH_BITS | forbidden):
+            if not (end - start <= 4 and start >= NORMAL_START and end <= NORMAL_END):
+                continue
+            while fill_bits and count / 2 < limit:
+                s = (fill_bits & -fill_bits).bit_length() - 1
+                fill_bits &= fill_bits - 1
+                work[s] = True
+                if is_op_slot(times, s):
+                    dm_ops[dm][s] = True
+                count += 1
 
 
 # ============================================================================
@@ -1588,44 +2419,137 @@ def fill_small_gaps(dm_work, dm_ops, active_daymen, times):
     for dm in active_daymen:
         work = dm_work[dm]
         
-        # Käy läpi kaikki slotit ja etsi aukot
-        for slot in range(48):
-            if work[slot]:
-                continue  # Jo töissä
-            
-            if LUNCH_START <= slot < LUNCH_END:
-                continue  # Lounastauko, älä täytä
-            
-            # Etsi lähin työ vasemmalla ja oikealla
-            left_work = -1
-            for s in range(slot - 1, -1, -1):
-                if work[s]:
-                    left_work = s
-                    break
-            
-            right_work = -1
-            for s in range(slot + 1, 48):
-                if work[s]:
-                    right_work = s
-                    break
-            
-            # Jos työtä molemmilla puolilla
-            if left_work >= 0 and right_work >= 0:
-                # Laske aukon koko ILMAN lounasslotteja
-                gap_slots = []
-                for s in range(left_work + 1, right_work):
-                    if LUNCH_START <= s < LUNCH_END:
-                        continue  # Ohita lounas
-                    if not work[s]:
-                        gap_slots.append(s)
-                
-                gap_size = len(gap_slots)
-                
-                if gap_size <= 4 and slot in gap_slots:
-                    # Täytä tämä slotti
-                    work[slot] = True
-                    if is_op_slot(times, slot):
-                        dm_ops[dm][slot] = True
+        for _, _, fill_bits in work_gaps(work_slot_bits(work), LUNCH_BITS):
+            if fill_bits.bit_count() > 4:
+                continue
+            while fill_bits:
+                s = (fill_bits & -fill_bits).bit_length() - 1
+                fill_bits &= fill_bits - 1
+                work[s] = True
+                if is_op_slot(times, s):
+                    dm_ops[dm][s] = True
+
+
+def fill_small_gaps_stcw(dm_work, dm_ops, active_daymen, times, violations):
+    """
+    fill_small_gaps, mutta daymanin täyttö perutaan jos se lisäsi rikkovia
+    24h ikkunoita. fill_small_gaps ei tunne STCW:tä, joten se täyttäisi
+    muuten STCW-korjauksen (fix_stcw_violations) jättämät aukot takaisin.
+
+    Args:
+        violations: violations(dm) -> daymanin rikkovien ikkunoiden määrä
+    """
+    before = {dm: (work_slot_bits(dm_work[dm]), violations(dm)) for dm in active_daymen}
+    fill_small_gaps(dm_work, dm_ops, active_daymen, times)
+    for dm in active_daymen:
+        bits, count = before[dm]
+        filled = work_slot_bits(dm_work[dm]) & ~bits
+        if not filled or violations(dm) <= count:
+            continue
+        while filled:
+            s = (filled & -filled).bit_length() - 1
+            filled &= filled - 1
+            dm_work[dm][s] = False
+            dm_ops[dm][s] = False
+
+
+class TransferQueue:
+    """
+    Sallitut slottisiirrot daymanilta toiselle (donor -> receiver) jonoina.
+
+    Jokaisella parilla on keko sloteista, joissa donor on töissä, receiver
+    ei ole ja slotti ei ole donorin pakollinen (tulo, lähtö, slussi, shiftaus,
+    must_work_slot). Siirron pisteet riippuvat vain parin tunneista, joten
+    parin sisällä paras siirto on aikaisin slotti (kuten ennenkin).
+
+    Siirron jälkeen vain siirretyn slotin rivit muuttuvat: uudet ehdokkaat
+    lisätään heti, vanhentuneet poistuvat kun ne nousevat keon päälle.
+    STCW-tulokset tallennetaan työntekijän versiolla; siirto vanhentaa vain
+    donorin ja receiverin tulokset.
+    """
+
+    def __init__(self, stcw_states, markers, daymen, slots):
+        self.stcw_states = stcw_states
+        self.markers = markers
+        self.daymen = list(daymen)
+        self.slots = frozenset(slots)
+        self.heaps = {}
+        self.live = {}
+        self.versions = {dm: 0 for dm in self.daymen}
+        self._verdicts = {}
+
+    def _pair(self, donor, receiver):
+        """Parin keko; kootaan ensimmäisellä käytöllä nykytilasta."""
+        pair = (donor, receiver)
+        heap = self.heaps.get(pair)
+        if heap is None:
+            self.live[pair] = set(s for s in self.slots if self._candidate(donor, receiver, s))
+            heap = self.heaps[pair] = sorted(self.live[pair])
+        return heap
+
+    def _candidate(self, donor, receiver, slot):
+        return (self.stcw_states[donor].bits >> slot & 1
+                and not self.stcw_states[receiver].bits >> slot & 1
+                and not self.markers[donor] >> slot & 1)
+
+    def _push(self, donor, receiver, slot):
+        pair = (donor, receiver)
+        if pair not in self.heaps:
+            return   # kootaan myöhemmin nykytilasta
+        if slot not in self.live[pair]:
+            self.live[pair].add(slot)
+            heapq.heappush(self.heaps[pair], slot)
+
+    def stcw_ok(self, donor, receiver, slot):
+        """Donor voi vapauttaa ja receiver ottaa slotin (tallennettu versioittain)."""
+        for dm, action in ((donor, 'clear'), (receiver, 'set')):
+            key = (dm, slot, action)
+            cached = self._verdicts.get(key)
+            if cached is None or cached[0] != self.versions[dm]:
+                state = self.stcw_states[dm]
+                verdict = state.can_clear(slot) if action == 'clear' else state.can_set(slot)
+                cached = (self.versions[dm], verdict)
+                self._verdicts[key] = cached
+            if not cached[1]:
+                return False
+        return True
+
+    def pop_legal(self, donor, receiver, is_legal):
+        """
+        Aikaisin slotti jonka is_legal(slot) hyväksyy (None jos ei ole).
+        Hylätyt mutta yhä ehdokkaat slotit palautetaan jonoon.
+        """
+        heap = self._pair(donor, receiver)
+        live = self.live[(donor, receiver)]
+        deferred = []
+        found = None
+        while heap:
+            slot = heapq.heappop(heap)
+            if not self._candidate(donor, receiver, slot):
+                live.discard(slot)
+                continue
+            if is_legal(slot):
+                live.discard(slot)
+                found = slot
+                break
+            deferred.append(slot)
+        for slot in deferred:
+            heapq.heappush(heap, slot)
+        return found
+
+    def moved(self, donor, receiver, slot):
+        """Päivittää jonot kun slotti siirtyi donorilta receiverille."""
+        self.versions[donor] += 1
+        self.versions[receiver] += 1
+        for other in self.daymen:
+            if other != receiver and self._candidate(receiver, other, slot):
+                self._push(receiver, other, slot)
+            if other != donor and self._candidate(other, donor, slot):
+                self._push(other, donor, slot)
+
+    def returned(self, donor, receiver, slot):
+        """Siirto peruttiin: slotti on taas donorilla."""
+        self.moved(receiver, donor, slot)
 
 
 def rebalance_dayman_hours(
@@ -1648,14 +2572,22 @@ def rebalance_dayman_hours(
     """
     Tasapainottaa daymanien tuntieroja siirtämällä 30 min slotteja.
     Säilyttää op-kattavuuden sekä STCW-vaatimukset.
+
+    Siirrot (normaali työaika, ei lounasta) kootaan kerran TransferQueueen;
+    jokainen kierros siirtää eniten tekevältä vähiten tekevälle parin
+    aikaisimman sallitun slotin. Työ on lineaarinen tehtyjen siirtojen
+    määrässä (plus hylätyt STCW-kokeilut).
     """
     if len(active_daymen) < 2:
         return
 
+    constraints = compile_constraints(constraints)
     max_iterations = 200
+    stcw_states = None
+    queue = None
 
     for _ in range(max_iterations):
-        hours = {dm: sum(dm_work[dm]) / 2 for dm in active_daymen}
+        hours = {dm: work_hours(dm_work[dm]) for dm in active_daymen}
         donor = max(active_daymen, key=lambda dm: hours[dm])
         receiver = min(active_daymen, key=lambda dm: hours[dm])
         diff = hours[donor] - hours[receiver]
@@ -1663,104 +2595,60 @@ def rebalance_dayman_hours(
         if diff <= max_diff_hours:
             break
 
-        moved = False
-        best_move = None
-        best_score = None
-
-        for slot in range(NORMAL_START, NORMAL_END):
-            if LUNCH_START <= slot < LUNCH_END:
-                continue
-            if not dm_work[donor][slot] or dm_work[receiver][slot]:
-                continue
-
-            # Älä siirrä pakollisia blokkeja donorilta
-            if (
-                dm_arr[donor][slot]
-                or dm_dep[donor][slot]
-                or dm_sluice[donor][slot]
-                or dm_shifting[donor][slot]
-                or must_work_slot(donor, slot, day_idx, constraints)
-            ):
-                continue
-
-            donor_hours_after = hours[donor] - 0.5
-            if donor_hours_after < get_min_hours(donor, constraints):
-                continue
-
-            receiver_hours = hours[receiver]
-            receiver_max = get_max_hours(receiver, constraints)
-            if receiver_hours >= receiver_max:
-                continue
-            if receiver_hours >= soft_upper_hours:
-                continue
-            if not can_work_slot(receiver, slot, day_idx, constraints, receiver_hours):
-                continue
-
-            # Op-kattavuus: jos donor on ainoa, receiverin pitää ottaa slotti.
-            is_op = is_op_slot(times, slot)
-            op_workers = [
-                dm for dm in active_daymen
-                if dm_work[dm][slot] and dm_ops[dm][slot]
-            ]
-            donor_is_only_op = is_op and op_workers == [donor]
-
-            # Testaa STCW donorille ja receiverille
-            donor_test = dm_work[donor][:]
-            donor_test[slot] = False
-            receiver_test = dm_work[receiver][:]
-            receiver_test[slot] = True
-
-            if not check_stcw_ok(
-                donor_test,
-                prev_day_work[donor],
-                min_longest_rest_hours=min_longest_rest_hours
-            ):
-                continue
-            if not check_stcw_ok(
-                receiver_test,
-                prev_day_work[receiver],
-                min_longest_rest_hours=min_longest_rest_hours
-            ):
-                continue
-
-            donor_after = donor_hours_after
-            receiver_after = receiver_hours + 0.5
-            new_diff = donor_after - receiver_after
-            score = (
-                abs(hours[donor] - target_hours) + abs(hours[receiver] - target_hours)
-            ) - (
-                abs(donor_after - target_hours) + abs(receiver_after - target_hours)
-            )
-            score += (diff - new_diff) * 2
+        # Parin tuntiehdot ovat samat kaikille sloteille
+        receiver_hours = hours[receiver]
+        if hours[donor] - 0.5 < get_min_hours(donor, constraints):
+            break
+        if receiver_hours >= get_max_hours(receiver, constraints) or receiver_hours >= soft_upper_hours:
+            break
 
-            if best_score is None or score > best_score:
-                best_score = score
-                best_move = (slot, is_op, donor_is_only_op)
-
-        if best_move is not None:
-            slot, is_op, donor_is_only_op = best_move
-
-            dm_work[donor][slot] = False
-            dm_work[receiver][slot] = True
-
-            if is_op:
-                dm_ops[receiver][slot] = True
-                dm_ops[donor][slot] = False
-            elif dm_ops[donor][slot] and not dm_work[donor][slot]:
-                dm_ops[donor][slot] = False
-
-            if donor_is_only_op and not any(
-                dm_work[dm][slot] and dm_ops[dm][slot] for dm in active_daymen
-            ):
-                dm_work[donor][slot] = True
-                dm_work[receiver][slot] = False
-                dm_ops[donor][slot] = True
-                if not dm_work[receiver][slot]:
-                    dm_ops[receiver][slot] = False
-            else:
-                moved = True
+        if queue is None:
+            stcw_states = build_stcw_states(dm_work, prev_day_work, active_daymen, min_longest_rest_hours)
+            markers = {
+                dm: (pack_slots(dm_arr[dm]) | pack_slots(dm_dep[dm]) | pack_slots(dm_sluice[dm])
+                     | pack_slots(dm_shifting[dm]) | constraints.mandatory_bits(dm, day_idx))
+                for dm in active_daymen
+            }
+            slots = [s for s in range(NORMAL_START, NORMAL_END) if not LUNCH_START <= s < LUNCH_END]
+            queue = TransferQueue(stcw_states, markers, active_daymen, slots)
+
+        def is_legal(slot):
+            return (can_work_slot(receiver, slot, day_idx, constraints, receiver_hours)
+                    and queue.stcw_ok(donor, receiver, slot))
+
+        slot = queue.pop_legal(donor, receiver, is_legal)
+        if slot is None:
+            break
 
-        if not moved:
+        # Op-kattavuus: jos donor on ainoa, receiverin pitää ottaa slotti.
+        is_op = is_op_slot(times, slot)
+        donor_is_only_op = is_op and [
+            dm for dm in active_daymen if dm_work[dm][slot] and dm_ops[dm][slot]
+        ] == [donor]
+
+        dm_work[donor][slot] = False
+        dm_work[receiver][slot] = True
+        stcw_states[donor].clear(slot)
+        stcw_states[receiver].set(slot)
+        queue.moved(donor, receiver, slot)
+
+        if is_op:
+            dm_ops[receiver][slot] = True
+            dm_ops[donor][slot] = False
+        elif dm_ops[donor][slot] and not dm_work[donor][slot]:
+            dm_ops[donor][slot] = False
+
+        if donor_is_only_op and not any(
+            dm_work[dm][slot] and dm_ops[dm][slot] for dm in active_daymen
+        ):
+            dm_work[donor][slot] = True
+            dm_work[receiver][slot] = False
+            stcw_states[donor].set(slot)
+            stcw_states[receiver].clear(slot)
+            queue.returned(donor, receiver, slot)
+            dm_ops[donor][slot] = True
+            if not dm_work[receiver][slot]:
+                dm_ops[receiver][slot] = False
             break
 
 
@@ -1781,6 +2669,8 @@ def fix_stcw_violations(
     wm_sluice=None,
     watchman_states=None,
     pending_next_day=None,
+    next_day=None,
+    max_moves=STCW_REPAIR_MAX_MOVES,
 ):
     """
     VAIHE 6: Korjaa STCW-rikkeet jälkikäteen.
@@ -1790,11 +2680,27 @@ def fix_stcw_violations(
     
     Tarkistaa sekä:
     - prev_day -> current_day (edellinen päivä vaikuttaa nykyiseen)
-    - current_day -> next_day (nykyinen päivä vaikuttaa seuraavaan, simuloitu)
+    - current_day -> next_day (nykyinen päivä vaikuttaa seuraavaan, simuloitu;
+      oletuspäivä on next_day tai normaali 08-16 päivä)
+
+    next_day on joko kaikille yhteinen oletettu päivä tai {dayman: päivä},
+    kun seuraavan päivän todellinen työ tunnetaan (repair_after_edit).
+    pending_next_day on vain keskiyön yli kulkevaa carry-overia.
     
-    Priorisoi:
+    Siirtoehdokkaat:
     1. Slussi-slottien siirto watchmanille (jos mahdollista)
     2. Aamuslottien siirto toiselle daymanille
+    
+    Daymanin kaikki ehdokkaat arvioidaan kerralla ja tehdään se, joka vähentää
+    eniten rikkovia ikkunoita. Tasapelissä ratkaisee daymanien tuntitasapaino
+    siirron jälkeen (vajaus minimitunneista, suurin tuntiero), sitten
+    rikkovien ikkunoiden lepo, slussisiirto ensin ja aikaisin slotti. Siirron jälkeen
+    tarkistetaan uudelleen vain donori, sekä jumiin jääneet daymanit, koska
+    donorista voi tulla niille vastaanottaja.
+    
+    Returns:
+        Dict: iterations (työlistan käsittelyt), moves, checks (STCW-arvioinnit)
+        ja unresolved (daymanit joille rike jäi)
     """
     if wm_work is None:
         wm_work = {wm: [False] * 48 for wm in WATCHMEN}
@@ -1804,6 +2710,12 @@ def fix_stcw_violations(
         watchman_states = {wm: {'extended_start': False, 'extended_end': False} for wm in WATCHMEN}
     if pending_next_day is None:
         pending_next_day = {dm: {'work': [], 'sluice': []} for dm in DAYMEN}
+    if next_day is None:
+        next_day = assumed_next_day()
+    if isinstance(next_day, dict):
+        next_day_bits = {dm: pack_slots(next_day.get(dm)) for dm in DAYMEN}
+    else:
+        next_day_bits = dict.fromkeys(DAYMEN, pack_slots(next_day))
     
     def check_stcw_both_directions(dm, test_work):
         """
@@ -1821,18 +2733,22 @@ def fix_stcw_violations(
         if not ok1:
             return False, worst1, analysis1
         
-        # Simuloi seuraava päivä: carry-over + normaali 08-16 työpäivä
-        next_day_test = [False] * 48
+        # Simuloi seuraava päivä: carry-over + oletettu työpäivä
+        carry_over = [
+            s for s in pending_next_day.get(dm, {}).get('work', []) if 0 <= s < 48
+        ]
         
-        # Lisää carry-over slotit
-        for s in pending_next_day.get(dm, {}).get('work', []):
-            if 0 <= s < 48:
-                next_day_test[s] = True
+        # Koottu malli: OK-tapaus on pelkkä haku, analyysi vain rikkeelle
+        if STCW_BACKEND == 'bitmask' and len(test_work) == 48:
+            carry_bits = 0
+            for s in carry_over:
+                carry_bits |= 1 << s
+            forward = get_forward_model(next_day_bits[dm] | carry_bits, min_longest_rest_hours)
+            if forward.ok(pack_slots(test_work)):
+                return True, None, analysis1
         
-        # Lisää normaali työpäivä (08-16, lounas pois)
-        for s in range(NORMAL_START, NORMAL_END):
-            if LUNCH_START <= s < LUNCH_END:
-                continue
+        next_day_test = unpack_slots(next_day_bits[dm])
+        for s in carry_over:
             next_day_test[s] = True
         
         # Tarkista nykyinen -> seuraava
@@ -1847,149 +2763,188 @@ def fix_stcw_violations(
         
         return True, None, analysis1
     
-    max_iterations = 100
-    
-    for iteration in range(max_iterations):
-        violation_found = False
-        
-        for dm in active_daymen:
-            ok, worst_slot, analysis = check_stcw_both_directions(dm, dm_work[dm])
-            
-            if ok:
+    # Työlista: vain ne daymanit joiden ikkunat ovat muuttuneet tarkistetaan
+    # uudelleen. Tulokset tallennetaan työntekijän versiolla, ja siirto
+    # vanhentaa vain donorin ja receiverin tulokset.
+    order = {dm: i for i, dm in enumerate(active_daymen)}
+    version = {dm: 0 for dm in active_daymen}
+    verdicts = {}
+    scores = {}
+    receiver_verdicts = {}
+    bounds = {}
+    stats = {'iterations': 0, 'moves': 0, 'checks': 0, 'unresolved': []}
+
+    def verdict(dm):
+        """Daymanin nykyisen työn tarkistus molempiin suuntiin (välimuistissa)."""
+        cached = verdicts.get(dm)
+        if cached is None or cached[0] != version[dm]:
+            stats['checks'] += 1
+            cached = (version[dm], check_stcw_both_directions(dm, dm_work[dm])[0])
+            verdicts[dm] = cached
+        return cached[1]
+
+    def neighbour_bits(dm):
+        """Edellisen päivän ja oletetun seuraavan päivän (+ carry-over) bitit."""
+        cached = bounds.get(dm)
+        if cached is None or cached[0] != version[dm]:
+            carry_bits = 0
+            for s in pending_next_day.get(dm, {}).get('work', []):
+                if 0 <= s < 48:
+                    carry_bits |= 1 << s
+            cached = (version[dm], pack_slots(prev_day_work.get(dm, [False] * 48)),
+                      next_day_bits[dm] | carry_bits)
+            bounds[dm] = cached
+        return cached[1], cached[2]
+
+    def score(dm, removed_slot=None):
+        """
+        STCW-tilanne (rikkovat ikkunat, -lepo rikkovissa ikkunoissa) molempiin
+        suuntiin; pienempi on parempi. removed_slot = kokeiltava poistettava slotti.
+        """
+        key = (dm, version[dm], removed_slot)
+        if key in scores:
+            return scores[key]
+        stats['checks'] += 1
+        prev_bits, forward_bits = neighbour_bits(dm)
+        bits = pack_slots(dm_work[dm])
+        if removed_slot is not None:
+            bits &= ~(1 << removed_slot)
+        windows = 0
+        rest = 0
+        for first, second in ((prev_bits, bits), (bits, forward_bits)):
+            mask = stcw_violation_mask(first, second, min_longest_rest_hours)
+            rest96 = ~(first | (second << 48)) & TWO_DAY_MASK
+            while mask:
+                s = (mask & -mask).bit_length() - 1
+                rest += window_total_slots(rest96 >> s & DAY_MASK)
+                windows += 1
+                mask &= mask - 1
+        scores[key] = (windows, -rest)
+        return scores[key]
+
+    def receiver_ok(receiver, slot):
+        key = (receiver, version[receiver], slot)
+        if key not in receiver_verdicts:
+            stats['checks'] += 1
+            receiver_test = dm_work[receiver][:]
+            receiver_test[slot] = True
+            receiver_verdicts[key] = check_stcw_both_directions(receiver, receiver_test)[0]
+        return receiver_verdicts[key]
+
+    def best_move(dm):
+        """
+        Kokoaa daymanin kaikki siirtoehdokkaat yhdellä kertaa ja palauttaa
+        eniten STCW-tilannetta parantavan: (ikkunat, tasapaino, lepo, laji,
+        slotti, vastaanottaja). Tasapelissä tuntitasapainoltaan paras, sitten
+        slussisiirto watchmanille ennen siirtoa toiselle daymanille.
+        """
+        base = score(dm)
+        candidates = []
+        hours = {d: work_hours(dm_work[d]) for d in active_daymen}
+
+        def balance(receiver=None):
+            """Tunnit siirron jälkeen: (vajaus minimeistä, suurin ero); pienempi on parempi."""
+            after_hours = dict(hours)
+            after_hours[dm] -= 0.5
+            if receiver is not None:
+                after_hours[receiver] += 0.5
+            shortfall = sum(max(0.0, get_min_hours(d, constraints) - h)
+                            for d, h in after_hours.items())
+            return shortfall, max(after_hours.values()) - min(after_hours.values())
+
+        # VAIHE 1: Slussi-slotit watchmanille
+        for slot in range(48):
+            if not dm_sluice[dm][slot]:
                 continue
-            
-            violation_found = True
-            moved = False
-            
-            # VAIHE 1: Yritä siirtää slussi-slotteja watchmanille
-            sluice_slots = [s for s in range(48) if dm_sluice[dm][s]]
-            
-            for slot in sluice_slots:
-                # Etsi watchman joka voi ottaa slotin
-                wm = find_available_watchman(slot, watchman_states, wm_work)
-                
-                if wm is None:
-                    continue
-                
-                # Testaa siirto
-                dm_test = dm_work[dm][:]
-                dm_test[slot] = False
-                
-                dm_ok_after, _, new_analysis = check_stcw_both_directions(dm, dm_test)
-                
-                # Jos tilanne ei parane, ohita
-                if not dm_ok_after:
-                    if analysis and new_analysis:
-                        old_rest = analysis['longest_rest']
-                        new_rest = new_analysis['longest_rest']
-                        if new_rest <= old_rest:
-                            continue
-                    elif not new_analysis:
-                        continue
-                
-                # Tee siirto
-                dm_work[dm][slot] = False
-                dm_sluice[dm][slot] = False
-                wm_work[wm][slot] = True
-                wm_sluice[wm][slot] = True
-                update_watchman_state(wm, slot, watchman_states)
-                
-                # Päivitä myös pending_next_day jos slotti oli carry-over
-                if slot in pending_next_day.get(dm, {}).get('work', []):
-                    pending_next_day[dm]['work'].remove(slot)
-                if slot in pending_next_day.get(dm, {}).get('sluice', []):
-                    pending_next_day[dm]['sluice'].remove(slot)
-                
-                moved = True
-                break
-            
-            if moved:
-                break  # Aloita uusi iteraatio alusta
-            
-            # VAIHE 2: Yritä siirtää normaaleja slotteja toiselle daymanille
-            morning_slots = list(range(NORMAL_START, LUNCH_START))  # 08:00-11:30
-            other_slots = list(range(LUNCH_END, NORMAL_END))  # 12:00-17:00
-            
+            wm = find_available_watchman(slot, watchman_states, wm_work)
+            if wm is None:
+                continue
+            after = score(dm, slot)
+            if after < base:
+                candidates.append((after[0], balance(), after[1], 0, slot, wm))
+
+        # VAIHE 2: Normaalit slotit toiselle daymanille
+        donor_min = get_min_hours(dm, constraints)
+        donor_hours_after = hours[dm] - 0.5
+        morning_slots = list(range(NORMAL_START, LUNCH_START))  # 08:00-11:30
+        other_slots = list(range(LUNCH_END, NORMAL_END))  # 12:00-17:00
+        if donor_hours_after >= donor_min:
             for slot in morning_slots + other_slots:
                 if not dm_work[dm][slot]:
                     continue
-                
+
                 # Älä siirrä pakollisia
-                if (dm_arr[dm][slot] or dm_dep[dm][slot] or 
+                if (dm_arr[dm][slot] or dm_dep[dm][slot] or
                     dm_sluice[dm][slot] or dm_shifting[dm][slot] or
                     must_work_slot(dm, slot, day_idx, constraints)):
                     continue
-                
-                # Etsi toinen työntekijä joka voi ottaa slotin
+
+                after = score(dm, slot)
+                if not after < base:
+                    continue
+
                 for receiver in active_daymen:
-                    if receiver == dm:
+                    if receiver == dm or dm_work[receiver][slot]:
                         continue
-                    
-                    if dm_work[receiver][slot]:
-                        continue  # Receiver jo töissä tässä slotissa
-                    
-                    receiver_hours = sum(dm_work[receiver]) / 2
-                    receiver_max = get_max_hours(receiver, constraints)
-                    
-                    if receiver_hours >= receiver_max:
+                    receiver_hours = hours[receiver]
+                    if receiver_hours >= get_max_hours(receiver, constraints):
                         continue
-                    
                     if not can_work_slot(receiver, slot, day_idx, constraints, receiver_hours):
                         continue
-                    
-                    # Testaa siirto
-                    dm_test = dm_work[dm][:]
-                    dm_test[slot] = False
-                    
-                    receiver_test = dm_work[receiver][:]
-                    receiver_test[slot] = True
-                    
-                    # Tarkista että siirto parantaa tilannetta
-                    dm_ok_after, _, new_analysis = check_stcw_both_directions(dm, dm_test)
-                    
-                    # Jos tilanne ei parane, ohita
-                    if not dm_ok_after:
-                        if analysis and new_analysis:
-                            old_rest = analysis['total_rest']
-                            new_rest = new_analysis['total_rest']
-                            if new_rest <= old_rest:
-                                continue
-                        elif not new_analysis:
-                            continue
-                    
-                    # Tarkista ettei siirto aiheuta rikettä receiverille
-                    receiver_ok, _, _ = check_stcw_both_directions(receiver, receiver_test)
-                    
-                    if not receiver_ok:
-                        continue  # Siirto aiheuttaisi rikkeen receiverille
-                    
-                    # Tarkista donor min tunnit
-                    dm_hours_after = sum(dm_test) / 2
-                    if dm_hours_after < get_min_hours(dm, constraints):
-                        continue
-                    
-                    # Op-kattavuus tarkistus
-                    is_op = is_op_slot(times, slot)
-                    
-                    # Tee siirto
-                    dm_work[dm][slot] = False
-                    dm_work[receiver][slot] = True
-                    
-                    if is_op:
-                        dm_ops[dm][slot] = False
-                        dm_ops[receiver][slot] = True
-                    
-                    moved = True
-                    break
-                
-                if moved:
-                    break
-            
-            if moved:
-                break  # Aloita uusi iteraatio alusta
-        
-        if not violation_found:
-            break  # Kaikki OK
+                    if receiver_ok(receiver, slot):
+                        candidates.append((after[0], balance(receiver), after[1], 1, slot, receiver))
+
+        return min(candidates) if candidates else None
+
+    worklist = [(order[dm], dm) for dm in active_daymen]
+    queued = set(active_daymen)
+    stuck = set()
+
+    while worklist:
+        _, dm = heapq.heappop(worklist)
+        queued.discard(dm)
+        stats['iterations'] += 1
+
+        if verdict(dm) or stats['moves'] >= max_moves:
+            continue
+
+        move = best_move(dm)
+        if move is None:
+            stuck.add(dm)
+            continue
+
+        kind, slot, target = move[-3:]
+        if kind == 0:
+            dm_work[dm][slot] = False
+            dm_sluice[dm][slot] = False
+            wm_work[target][slot] = True
+            wm_sluice[target][slot] = True
+            update_watchman_state(target, slot, watchman_states)
+
+            # Päivitä myös pending_next_day jos slotti oli carry-over
+            if slot in pending_next_day.get(dm, {}).get('work', []):
+                pending_next_day[dm]['work'].remove(slot)
+            if slot in pending_next_day.get(dm, {}).get('sluice', []):
+                pending_next_day[dm]['sluice'].remove(slot)
+        else:
+            dm_work[dm][slot] = False
+            dm_work[target][slot] = True
+            version[target] += 1
+            if is_op_slot(times, slot):
+                dm_ops[dm][slot] = False
+                dm_ops[target][slot] = True
+        version[dm] += 1
+        stats['moves'] += 1
+
+        # Donorin tunnit laskivat: jumiin jääneet voivat nyt antaa sille slotteja
+        for other in [dm] + sorted(stuck, key=order.get):
+            if other not in queued:
+                heapq.heappush(worklist, (order[other], other))
+                queued.add(other)
+        stuck.clear()
+
+    stats['unresolved'] = [dm for dm in active_daymen if not verdict(dm)]
+    return stats
 
 
 # ============================================================================
@@ -2000,40 +2955,15 @@ def generate_bosun_schedule(times):
     """
     Generoi bosunin työvuorot (08-17 + tulo/lähtö + slussi + shiftaus).
     """
-    bosun_work = [False] * 48
-    bosun_arr = [False] * 48
-    bosun_dep = [False] * 48
-    bosun_sluice = [False] * 48
-    bosun_shifting = [False] * 48
-    
-    for arrival_start in times.get('arrival_starts', []):
-        add_block(bosun_work, arrival_start, arrival_start + 2, bosun_arr)
-
-    for departure_start in times.get('departure_starts', []):
-        add_block(bosun_work, departure_start, departure_start + 2, bosun_dep)
-
-    for sluice_arr_start in times.get('sluice_arr_starts', []):
-        add_block(bosun_work, sluice_arr_start, sluice_arr_start + 5, bosun_sluice)
-
-    for sluice_dep_start in times.get('sluice_dep_starts', []):
-        add_block(bosun_work, sluice_dep_start, sluice_dep_start + 5, bosun_sluice)
-
-    for shifting_start in times.get('shifting_starts', []):
-        add_block(bosun_work, shifting_start, shifting_start + 2, bosun_shifting)
+    times = DayTimes.from_dict(times)
+    sluice = times.sluice_arr_bits | times.sluice_dep_bits
+    normal = _range_bits(NORMAL_START, NORMAL_END) & ~_range_bits(LUNCH_START, LUNCH_END)
+    work = (times.arrival_bits | times.departure_bits | sluice
+            | times.shifting_bits | normal)
     
-    for slot in range(NORMAL_START, NORMAL_END):
-        if LUNCH_START <= slot < LUNCH_END:
-            continue
-        bosun_work[slot] = True
-    
-    return {
-        'work_slots': bosun_work,
-        'arrival_slots': bosun_arr,
-        'departure_slots': bosun_dep,
-        'port_op_slots': [False] * 48,
-        'sluice_slots': bosun_sluice,
-        'shifting_slots': bosun_shifting
-    }
+    return DaySchedule.from_bits(
+        work, times.arrival_bits, times.departure_bits, 0, sluice, times.shifting_bits
+    )
 
 
 def generate_watchman_schedule(worker, wm_work=None, wm_sluice=None):
@@ -2066,13 +2996,14 @@ def generate_watchman_schedule(worker, wm_work=None, wm_sluice=None):
     for start, end in watch_blocks.get(worker, []):
         add_block(work_slots, start, end)
 
+    return DaySchedule(work_slots=work_slots, sluice_slots=sluice_slots)
+
+
+def build_rest_profiles(work_by_worker):
+    """Lepoprofiilit työvuorolistoista: {worker: RestProfile}."""
     return {
-        'work_slots': work_slots,
-        'arrival_slots': [False] * 48,
-        'departure_slots': [False] * 48,
-        'port_op_slots': [False] * 48,
-        'sluice_slots': sluice_slots,
-        'shifting_slots': [False] * 48
+        worker: work if isinstance(work, RestProfile) else RestProfile.from_slots(work)
+        for worker, work in work_by_worker.items()
     }
 
 
@@ -2081,19 +3012,21 @@ def choose_continuous_night_workers(prev_day_daymen_work):
     Valitse jatkuvan yön tekijät:
     - early_worker: se dayman, joka teki edellisen päivän viimeisen iltaslotin
     - late_worker: ensisijaisesti Dayman PH2
+
+    prev_day_daymen_work voi sisältää työslottilistoja tai RestProfile-olioita.
     """
     daymen = ['Dayman EU', 'Dayman PH1', 'Dayman PH2']
+    profiles = build_rest_profiles(prev_day_daymen_work)
 
     latest_worker = None
     latest_slot = -1
     for dm in daymen:
-        work = prev_day_daymen_work.get(dm, [False] * 48)
-        for slot in range(47, -1, -1):
-            if work[slot]:
-                if slot > latest_slot:
-                    latest_slot = slot
-                    latest_worker = dm
-                break
+        profile = profiles.get(dm)
+        if profile is None:
+            continue
+        if profile.last_work_slot > latest_slot:
+            latest_slot = profile.last_work_slot
+            latest_worker = dm
 
     early_worker = latest_worker or 'Dayman EU'
     late_worker = 'Dayman PH2'
@@ -2104,74 +3037,513 @@ def choose_continuous_night_workers(prev_day_daymen_work):
 
 
 # ============================================================================
-# PÄÄFUNKTIO
+# TARKKA PÄIVÄRATKAISU
 # ============================================================================
 
-def generate_schedule(days_data, constraints=None, min_longest_rest_hours=6):
+def build_exact_day_problem(active_daymen, day_idx, times, constraints, prev_day_work,
+                            forced_bits, next_day=None, min_longest_rest_hours=6):
     """
-    Generoi työvuorot blokkipohjaisella lähestymistavalla.
-    
+    Kokoaa exact_day.solve_day_exact -syötteet päivän tiedoista.
+
     Args:
-        days_data: Lista päivien tiedoista
-        constraints: Lista rajoitteista (valinnainen)
-    
+        forced_bits: {dm: bitit} pakolliset työslotit (tulot, shiftaukset,
+            carry-over, must_work_slot)
+
     Returns:
-        (workbook, all_days, report)
+        Dict solve_day_exact:n avainsanaparametreiksi
     """
-    if constraints is None:
-        constraints = []
-    
-    all_days = {w: [] for w in WORKERS}
-    num_days = len(days_data)
-    
-    # VAIHE 0: Analysoi jatkuvat yövuorot
-    continuous_nights = analyze_continuous_nights(days_data)
+    constraints = compile_constraints(constraints)
+    times = DayTimes.from_dict(times)
+    if next_day is None:
+        next_day = assumed_next_day()
+
+    forced = {}
+    forbidden = {}
+    min_slots = {}
+    max_slots = {}
+    for dm in active_daymen:
+        forbidden_bits, mandatory, hour_caps, _ = constraints.rules(dm, day_idx)
+        forbidden[dm] = forbidden_bits
+        forced[dm] = forced_bits.get(dm, 0) | mandatory
+        min_slots[dm] = int(get_min_hours(dm, constraints) * 2)
+        max_slots[dm] = int(min((get_max_hours(dm, constraints),) + hour_caps) * 2)
+
+    normal = _range_bits(NORMAL_START, NORMAL_END) & ~_range_bits(LUNCH_START, LUNCH_END)
+    return {
+        'workers': list(active_daymen),
+        'prev_bits': {dm: pack_slots(prev_day_work[dm]) for dm in active_daymen},
+        'next_bits': pack_slots(next_day),
+        'forced': forced,
+        'forbidden': forbidden,
+        'min_slots': min_slots,
+        'max_slots': max_slots,
+        # Lounasslottia ei vaadita katettavaksi (kuten vaiheet 1 ja 3)
+        'cover_bits': times.op_bits & ~_range_bits(LUNCH_START, LUNCH_END),
+        'demand_bits': times.departure_bits,
+        'penalty_bits': _range_bits(0, 48) & ~normal,
+        'min_longest_rest_hours': min_longest_rest_hours,
+    }
+
+
+def apply_exact_day(dm_work, dm_ops, dm_dep, active_daymen, day_idx, times, constraints,
+                    prev_day_work, forced_bits, next_day=None, min_longest_rest_hours=6,
+                    time_budget=DEFAULT_TIME_BUDGET):
+    """
+    Ratkaisee aktiivisten daymanien päivän tarkasti ja korvaa ahneen
+    tuloksen, jos tarkka ratkaisu on kustannukseltaan parempi.
+
+    Ahne päivä on haun lähtöratkaisu ja se pisteytetään aina samalla
+    tavoitteella (STCW-rikkeet oletettuun seuraavaan päivään sakkona, ei
+    karsintana). Tarkka tulos otetaan käyttöön vain jos se on aidosti
+    halvempi eikä jätä enempää op-slotteja kattamatta, myös aikarajan
+    loppuessa, joten tulos ei koskaan huonone.
+    Tulo-, shiftaus- ja slussimerkinnät säilyvät (pakollisia); op- ja
+    lähtömerkinnät lasketaan uudesta työstä.
+
+    Returns:
+        solve_day_exact:n tulos ja 'applied' (True jos työ vaihdettiin)
+    """
+    times = DayTimes.from_dict(times)
+    problem = build_exact_day_problem(
+        active_daymen, day_idx, times, constraints, prev_day_work, forced_bits,
+        next_day=next_day, min_longest_rest_hours=min_longest_rest_hours
+    )
+    incumbent = {dm: pack_slots(dm_work[dm]) for dm in active_daymen}
+    result = solve_day_exact(time_budget=time_budget, incumbent=incumbent, **problem)
+
+    # Op-kattavuus (aina vähintään yksi dayman) on ehdoton: tarkka tulos ei
+    # saa jättää katettavaksi enempää slotteja kuin ahne päivä
+    def uncovered(work):
+        covered = 0
+        for bits in work.values():
+            covered |= bits
+        return (problem['cover_bits'] & ~covered).bit_count()
+
+    result['applied'] = (result['work'] is not None and result['incumbent_cost'] is not None
+                         and result['cost'] < result['incumbent_cost']
+                         and uncovered(result['work']) <= uncovered(incumbent))
+    if not result['applied']:
+        return result
+
+    store_dayman_work(dm_work, dm_ops, dm_dep, active_daymen, times, result['work'])
+    return result
+
+
+def store_dayman_work(dm_work, dm_ops, dm_dep, active_daymen, times, work):
+    """
+    Kirjoittaa uudet työbitit daymanien päivään ja päivittää op- ja
+    lähtömerkinnät (tulo, shiftaus ja slussi ovat pakollisia, ne säilyvät).
+
+    Args:
+        work: {dm: bitit}
+    """
+    times = DayTimes.from_dict(times)
+    for dm in active_daymen:
+        bits = work[dm]
+        dm_work[dm][:] = unpack_slots(bits)
+        dm_ops[dm][:] = unpack_slots(bits & times.op_bits)
+        dm_dep[dm][:] = [False] * 48
+
+    # Lähtö: kaksi ensimmäistä koko tunnin töissä olevaa
+    for start in times.departure_starts:
+        block = _range_bits(start, min(start + 2, 48))
+        selected = [dm for dm in active_daymen if work[dm] & block == block][:2]
+        for dm in selected:
+            for slot in range(start, min(start + 2, 48)):
+                dm_dep[dm][slot] = True
+
+
+def apply_local_search(dm_work, dm_ops, dm_dep, active_daymen, day_idx, times, constraints,
+                       prev_day_work, forced_bits, next_day=None, min_longest_rest_hours=6,
+                       time_budget=DEFAULT_IMPROVE_BUDGET, seed=0):
+    """
+    Parantaa daymanien päivää aikarajatulla paikallishaulla (local_search).
+
+    Pakollisiksi katsotaan vain ne forced_bits-slotit jotka ovat yhä
+    daymanilla (STCW-korjaus on voinut siirtää slussin watchmanille).
+    Tulos kirjoitetaan vain jos tavoite parani.
+
+    Returns:
+        improve_day:n tulos ja 'applied'
+    """
+    times = DayTimes.from_dict(times)
+    problem = build_exact_day_problem(
+        active_daymen, day_idx, times, constraints, prev_day_work, forced_bits,
+        next_day=next_day, min_longest_rest_hours=min_longest_rest_hours
+    )
+    problem['forced'] = {dm: problem['forced'][dm] & dm_work[dm].bits for dm in active_daymen}
+    work = {dm: dm_work[dm].bits for dm in active_daymen}
+    result = improve_day(work=work, time_budget=time_budget, seed=seed, **problem)
+    result['applied'] = result['cost_after'] < result['cost_before']
+    if result['applied']:
+        store_dayman_work(dm_work, dm_ops, dm_dep, active_daymen, times, result['work'])
+    return result
+
+
+def score_schedule(all_days, days_data, constraints=None, min_longest_rest_hours=6):
+    """
+    Koko matkan tavoite (pienempi on parempi) eri ratkaisujen vertailuun.
+
+    Jokaiselle päivälle exact_day.evaluate_day aktiivisille daymaneille
+    (kattavuus, 8–10h, tasapaino, yö-/lounastyö, blokit) ja kaikille
+    työntekijöille W_STCW jokaisesta rikkovasta 24h ikkunasta edellisen
+    päivän kanssa.
+    """
+    constraints = compile_constraints(constraints)
+    cost = 0
+    prev_bits = {w: 0 for w in all_days}
+    for day_idx, info in enumerate(days_data):
+        times = parse_day_times(info)
+        active_daymen = [dm for dm in DAYMEN if not is_day_off(dm, day_idx, constraints)]
+        prev_day_work = {dm: unpack_slots(prev_bits[dm]) for dm in active_daymen}
+        problem = build_exact_day_problem(
+            active_daymen, day_idx, times, constraints, prev_day_work, {},
+            min_longest_rest_hours=min_longest_rest_hours
+        )
+        work = {dm: work_bits(all_days[dm][day_idx]) for dm in active_daymen}
+        cost += evaluate_day(active_daymen, work, problem['cover_bits'],
+                             problem['penalty_bits'], problem['min_slots'])
+        for worker in all_days:
+            bits = work_bits(all_days[worker][day_idx])
+            violations = stcw_violation_mask(prev_bits[worker], bits, min_longest_rest_hours)
+            cost += W_STCW * violations.bit_count()
+            prev_bits[worker] = bits
+    return cost
+
+
+# ============================================================================
+# PÄÄFUNKTIO
+# ============================================================================
+
+DEFAULT_DAY_MEMO_SIZE = 4096
+
+
+class DayMemo:
+    """
+    Rajattu LRU-muisti generate_schedule:n päivätuloksille.
+
+    Päivän tulos riippuu vain sen omista syötteistä ja edelliseltä päivältä
+    kulkevasta tilasta, joten avain on näiden kanoninen tiiviste
+    (_day_memo_key). Kun matkan päivää muutetaan, sitä edeltävät päivät
+    saadaan muistista ja vain muutettu päivä ja sen jälkeiset lasketaan.
+    Arvot kopioidaan sisään ja ulos, joten palautettujen päivien muokkaus
+    ei muuta muistia. Lukitus sallii käytön useasta säikeestä.
+    """
+
+    def __init__(self, maxsize=DEFAULT_DAY_MEMO_SIZE):
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self._maxsize = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.resize(maxsize)
+
+    @property
+    def maxsize(self):
+        return self._maxsize
+
+    def resize(self, maxsize):
+        """Asettaa koon (0 = pois käytöstä) ja poistaa ylimääräiset vanhimmat."""
+        if maxsize < 0:
+            raise ValueError(f"Muistin koko ei voi olla negatiivinen: {maxsize}")
+        with self._lock:
+            self._maxsize = maxsize
+            self._evict()
+
+    def clear(self):
+        """Tyhjentää muistin ja nollaa tilastot."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def info(self):
+        """Palauttaa tilastot: hits, misses, evictions, size, maxsize."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'maxsize': self._maxsize,
+            }
+
+    def _evict(self):
+        while len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key):
+        """
+        Palauttaa (päivät {worker: DaySchedule}, pending_next_day, raporttirivi)
+        kopioina tai None.
+        """
+        if not self._maxsize:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        days, pending, line = entry
+        return ({w: day.copy() for w, day in days.items()},
+                {dm: {k: list(v) for k, v in slots.items()} for dm, slots in pending.items()},
+                line)
+
+    def put(self, key, days, pending, line=None):
+        """Tallentaa päivän tuloksen (kopioina)."""
+        if not self._maxsize:
+            return
+        entry = ({w: day.copy() for w, day in days.items()},
+                 {dm: {k: list(v) for k, v in slots.items()} for dm, slots in pending.items()},
+                 line)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._evict()
+
+
+# Jaettu päivämuisti (ks. set_day_memo_size)
+DAY_MEMO = DayMemo()
+
+
+def set_day_memo_size(maxsize):
+    """
+    Asettaa generate_schedule:n päivämuistin koon (0 = pois käytöstä).
+
+    Returns:
+        Edellinen koko
+    """
+    previous = DAY_MEMO.maxsize
+    DAY_MEMO.resize(maxsize)
+    return previous
+
+
+def day_memo_info():
+    """Palauttaa päivämuistin osumat, ohitukset, poistot ja koon."""
+    return DAY_MEMO.info()
+
+
+def _day_memo_key(day_idx, info, next_day_info, continuous_night, prev_day_work,
+                  pending_next_day, constraints, settings):
+    """
+    Päivän kanoninen tiiviste: päivän syöte, oletetun seuraavan päivän syöte,
+    jatkuva yö, edelliseltä päivältä kulkeva tila (daymenien työ, carry-over),
+    päivään vaikuttavat rajoitteet ja generoinnin asetukset.
+    """
+    applicable = [
+        c for c in constraints
+        if c.get('day') is None or c.get('day') == day_idx + 1
+        or c.get('type') in ('min_hours', 'max_hours')
+    ]
+    payload = json.dumps([
+        day_idx,
+        info,
+        next_day_info,
+        continuous_night,
+        [pack_slots(prev_day_work[dm]) for dm in DAYMEN],
+        [pending_next_day[dm] for dm in DAYMEN],
+        applicable,
+        settings,
+    ], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _generation_settings(engine, variant):
+    """
+    Tarkistaa enginen ja muunnelman ennen generointia.
+
+    Returns:
+        (variant, dayman_order, target_hours, soft_upper_hours)
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Tuntematon engine: {engine}")
+    variant = dict(variant or {})
+    unknown = set(variant) - set(VARIANT_KEYS)
+    if unknown:
+        raise ValueError(f"Tuntematon muunnelman avain: {sorted(unknown)}")
+    dayman_order = list(variant.get('dayman_order') or DAYMEN)
+    if sorted(dayman_order) != sorted(DAYMEN):
+        raise ValueError(f"dayman_order ei ole daymenien järjestys: {dayman_order}")
+    target_hours = variant.get('target_hours', 8.5)
+    soft_upper_hours = variant.get('soft_upper_hours', 9.5)
+    return variant, dayman_order, target_hours, soft_upper_hours
+
+
+_END = object()
+
+
+def _days_with_next(days_source, lookahead):
+    """
+    Käy päivät läpi pareina (päivä, seuraava päivä tai None).
+
+    Seuraava päivä luetaan lähteestä etukäteen vain kun lookahead on päällä,
+    muuten pari on (päivä, None) ja lähdettä luetaan päivä kerrallaan.
+    """
+    source = iter(days_source)
+    current = next(source, _END)
+    while current is not _END:
+        if lookahead:
+            following = next(source, _END)
+            yield current, (None if following is _END else following)
+        else:
+            yield current, None
+            following = next(source, _END)
+        current = following
+
+
+def _initial_state(state):
+    """
+    Tarkistaa ja normalisoi generoinnin alkutilan (SCHEDULE_STATE_KEYS).
+
+    None tai puuttuvat avaimet = matkan alku: päivä 0, edellinen päivä lepoa
+    eikä keskiyön yli kulkevia slotteja. prev_day_work voi olla lista tai
+    DaySchedule; vain daymenien työ vaikuttaa generointiin.
+
+    Returns:
+        (day_index, prev_day_work, pending_next_day, prev_day_info)
+    """
+    state = dict(state or {})
+    unknown = set(state) - set(SCHEDULE_STATE_KEYS)
+    if unknown:
+        raise ValueError(f"Tuntematon tilan avain: {sorted(unknown)}")
+    day_index = state.get('day_index', 0)
+    if not isinstance(day_index, int) or day_index < 0:
+        raise ValueError(f"day_index ei ole päivän indeksi: {day_index}")
+
+    prev_work = state.get('prev_day_work') or {}
+    prev_day_work = {}
+    for dm in DAYMEN:
+        work = prev_work.get(dm)
+        if work is None:
+            work = [False] * 48
+        elif isinstance(work, DaySchedule):
+            work = work['work_slots']
+        work = [bool(slot) for slot in work]
+        if len(work) != 48:
+            raise ValueError(f"{dm}: edellisen päivän työssä on oltava 48 slottia")
+        prev_day_work[dm] = work
+
+    pending = state.get('pending_next_day') or {}
+    pending_next_day = {
+        dm: {key: [int(slot) for slot in pending.get(dm, {}).get(key, [])]
+             for key in ('work', 'sluice')}
+        for dm in DAYMEN
+    }
+    return day_index, prev_day_work, pending_next_day, deepcopy(state.get('prev_day_info'))
+
+
+def _final_state(day_index, prev_day_work, pending_next_day, prev_day_info):
+    """Kulkeva tila seuraavalle segmentille (kopiot, JSON-yhteensopiva)."""
+    return {
+        'day_index': day_index,
+        'prev_day_work': {dm: list(prev_day_work[dm]) for dm in DAYMEN},
+        'pending_next_day': {
+            dm: {key: list(pending_next_day[dm][key]) for key in ('work', 'sluice')}
+            for dm in DAYMEN
+        },
+        'prev_day_info': deepcopy(prev_day_info),
+    }
+
+
+def _generate_days(days_source, constraints, min_longest_rest_hours, use_next_day_events,
+                   engine, exact_time_budget, improve_time_budget, improve_seed,
+                   variant, dayman_order, target_hours, soft_upper_hours,
+                   initial_state=None):
+    """
+    Generoi päivät yksi kerrallaan (generate_schedule ja generate_schedule_iter).
+
+    Muistissa pidetään vain seuraavan päivän tarvitsema tila: edellisen
+    päivän daymenien työ ja syöte sekä keskiyön yli kulkevat slotit.
+    initial_state jatkaa aiemmin generoidusta tilasta (_initial_state).
+
+    Yields:
+        (day_idx, {worker: DaySchedule}, improve_line tai None, tila päivän
+        jälkeen); day_idx on päivän indeksi matkalla
+    """
+    first_day, prev_day_work, pending_next_day, prev_info = _initial_state(initial_state)
+
+    # Rajoitteet käännetään kerran; vaiheet kysyvät hakemistolta
+    constraints = compile_constraints(constraints)
     
-    # Pending-slotit edelliseltä päivältä (carry-over keskiyön yli)
-    pending_next_day = {dm: {'work': [], 'sluice': []} for dm in DAYMEN}
+    # Päivämuistin avaimeen kuuluvat asetukset (myös laskentapolun valinta)
+    memo_settings = [
+        min_longest_rest_hours, use_next_day_events, engine, exact_time_budget,
+        improve_time_budget, improve_seed, variant, STCW_BACKEND,
+    ]
     
     # Generoi päivä kerrallaan
-    for day_idx, info in enumerate(days_data):
+    for day_idx, (info, next_day_info) in enumerate(
+            _days_with_next(days_source, use_next_day_events), first_day):
         # Parsitaan päivän ajat
         times = parse_day_times(info)
         
-        # Edellisen päivän työvuorot
-        prev_day_work = {}
-        for dm in DAYMEN:
-            if day_idx > 0:
-                prev_day_work[dm] = all_days[dm][day_idx - 1]['work_slots']
-            else:
-                prev_day_work[dm] = [False] * 48
+        # Oletettu seuraava päivä eteenpäin-tarkistuksiin
+        next_day = assumed_next_day(next_day_info)
+        
+        # Jatkuva yö edelliseltä päivältä tähän päivään
+        continuous_night = prev_info is not None and is_continuous_night(prev_info, info)
+        prev_info = info
+
+        # Päivämuisti: sama syöte ja sama kulkeva tila -> sama päivä
+        memo_key = _day_memo_key(
+            day_idx, info, next_day_info, continuous_night, prev_day_work,
+            pending_next_day, constraints, memo_settings
+        )
+        memoized = DAY_MEMO.get(memo_key)
+        if memoized is not None:
+            days, pending_next_day, improve_line = memoized
+            prev_day_work = {dm: list(days[dm]['work_slots']) for dm in DAYMEN}
+            yield (day_idx, days, improve_line,
+                   _final_state(day_idx + 1, prev_day_work, pending_next_day, prev_info))
+            continue
+        improve_line = None
         
         # Tarkista jatkuva yö
         continuous_night_info = None
-        for night_info in continuous_nights:
-            if night_info['day_index'] == day_idx - 1:
-                prev_day_daymen_work = {
-                    dm: all_days[dm][day_idx - 1]['work_slots']
-                    for dm in DAYMEN
-                }
-                early_worker, late_worker = choose_continuous_night_workers(prev_day_daymen_work)
+        if continuous_night:
+            early_worker, late_worker = choose_continuous_night_workers(
+                build_rest_profiles(prev_day_work)
+            )
+            if variant.get('swap_night_workers'):
+                early_worker, late_worker = late_worker, early_worker
 
+            split_slot = variant.get('night_split')
+            if split_slot == 'auto':
+                split_slot = choose_night_split_slot(
+                    prev_day_work[early_worker], prev_day_work[late_worker],
+                    min_longest_rest_hours=min_longest_rest_hours
+                )
+            elif split_slot is None:
                 split_slot = time_to_slot(1, 0)
 
-                continuous_night_info = {
-                    'early_worker': early_worker,
-                    'late_worker': late_worker,
-                    'split_slot': split_slot
-                }
-                break
+            continuous_night_info = {
+                'early_worker': early_worker,
+                'late_worker': late_worker,
+                'split_slot': split_slot
+            }
         
-        # Alusta työvuorolistat
-        dm_work = {dm: [False] * 48 for dm in DAYMEN}
+        # Alusta työvuorolistat (tunnit ym. laskurit WorkerDayStatessa)
         dm_arr = {dm: [False] * 48 for dm in DAYMEN}
         dm_dep = {dm: [False] * 48 for dm in DAYMEN}
         dm_ops = {dm: [False] * 48 for dm in DAYMEN}
         dm_sluice = {dm: [False] * 48 for dm in DAYMEN}
         dm_shifting = {dm: [False] * 48 for dm in DAYMEN}
+        dm_work = {
+            dm: WorkerDayState(masks={
+                'arrival_slots': dm_arr[dm],
+                'departure_slots': dm_dep[dm],
+                'port_op_slots': dm_ops[dm],
+                'sluice_slots': dm_sluice[dm],
+                'shifting_slots': dm_shifting[dm],
+            })
+            for dm in DAYMEN
+        }
         
         # Alusta watchman-tietorakenteet
-        wm_work = {wm: [False] * 48 for wm in WATCHMEN}
+        wm_work = {wm: WorkerDayState() for wm in WATCHMEN}
         wm_sluice = {wm: [False] * 48 for wm in WATCHMEN}
         watchman_states = {wm: {'extended_start': False, 'extended_end': False} for wm in WATCHMEN}
         
@@ -2188,7 +3560,7 @@ def generate_schedule(days_data, constraints=None, min_longest_rest_hours=6):
         pending_next_day = {dm: {'work': [], 'sluice': []} for dm in DAYMEN}
         
         # Aktiiviset daymanit
-        active_daymen = [dm for dm in DAYMEN if not is_day_off(dm, day_idx, constraints)]
+        active_daymen = [dm for dm in dayman_order if not is_day_off(dm, day_idx, constraints)]
         
         # VAIHE 0.5: Pakolliset slotit rajoitteista
         apply_constraint_slots(dm_work, dm_ops, DAYMEN, day_idx, times, constraints)
@@ -2199,14 +3571,23 @@ def generate_schedule(days_data, constraints=None, min_longest_rest_hours=6):
         pending_next_day = apply_sluice_arrival_slots(
             dm_work, dm_sluice, DAYMEN, times, pending_next_day,
             prev_day_work=prev_day_work, wm_work=wm_work, wm_sluice=wm_sluice,
-            watchman_states=watchman_states, min_longest_rest_hours=min_longest_rest_hours
+            watchman_states=watchman_states, min_longest_rest_hours=min_longest_rest_hours,
+            next_day=next_day
         )
         pending_next_day = apply_sluice_departure_slots(
             dm_work, dm_sluice, DAYMEN, times, pending_next_day,
             prev_day_work=prev_day_work, wm_work=wm_work, wm_sluice=wm_sluice,
-            watchman_states=watchman_states, min_longest_rest_hours=min_longest_rest_hours
+            watchman_states=watchman_states, min_longest_rest_hours=min_longest_rest_hours,
+            next_day=next_day
         )
         apply_shifting_slots(dm_work, dm_shifting, DAYMEN, times)
+
+        # Pakolliset slotit tarkalle ratkaisijalle (lähtöjen tekijät valitaan uudelleen)
+        forced_bits = {
+            dm: dm_work[dm].bits & ~times.departure_bits | pack_slots(dm_arr[dm])
+            for dm in active_daymen
+        }
+
         apply_op_outside_normal_hours(
             dm_work, dm_ops, active_daymen, day_idx, times,
             constraints, prev_day_work, continuous_night_info,
@@ -2237,11 +3618,20 @@ def generate_schedule(days_data, constraints=None, min_longest_rest_hours=6):
             active_daymen, day_idx, times, constraints, prev_day_work,
             min_longest_rest_hours=min_longest_rest_hours,
             wm_work=wm_work, wm_sluice=wm_sluice, watchman_states=watchman_states,
-            pending_next_day=pending_next_day
+            pending_next_day=pending_next_day, next_day=next_day
         )
         
-        # VAIHE 7: Täytä pienet aukot (max 2h) - kutsutaan lopuksi kun kaikki muu on valmis
-        fill_small_gaps(dm_work, dm_ops, active_daymen, times)
+        # VAIHE 7: Täytä pienet aukot (max 2h) - kutsutaan lopuksi kun kaikki muu on valmis.
+        # Täyttö ei saa kumota STCW-korjausta (oletettu seuraava päivä + carry-over)
+        def violations(dm):
+            forward = pack_slots(next_day)
+            for s in pending_next_day[dm]['work']:
+                forward |= 1 << s
+            bits = work_slot_bits(dm_work[dm])
+            return (stcw_violation_mask(pack_slots(prev_day_work[dm]), bits, min_longest_rest_hours)
+                    | stcw_violation_mask(bits, forward, min_longest_rest_hours) << 48).bit_count()
+
+        fill_small_gaps_stcw(dm_work, dm_ops, active_daymen, times, violations)
 
         # Lopullinen tasapainotus myöhäisten korjausten jälkeen
         rebalance_dayman_hours(
@@ -2249,34 +3639,191 @@ def generate_schedule(days_data, constraints=None, min_longest_rest_hours=6):
             active_daymen, day_idx, times, constraints, prev_day_work,
             min_longest_rest_hours=min_longest_rest_hours,
             max_diff_hours=0.5,
-            target_hours=8.5,
-            soft_upper_hours=9.5
+            target_hours=target_hours,
+            soft_upper_hours=soft_upper_hours
         )
+
+        # VAIHE 7.5: Tarkka ratkaisu ahneen päivän pohjalta (ei slussipäivinä)
+        if (engine == 'exact' and active_daymen
+                and not (times.sluice_arr_bits or times.sluice_dep_bits)):
+            apply_exact_day(
+                dm_work, dm_ops, dm_dep, active_daymen, day_idx, times, constraints,
+                prev_day_work, forced_bits, next_day=next_day,
+                min_longest_rest_hours=min_longest_rest_hours,
+                time_budget=exact_time_budget
+            )
+
+        # VAIHE 7.6: Aikarajattu paikallishaku (valinnainen)
+        if improve_time_budget > 0 and active_daymen:
+            improved = apply_local_search(
+                dm_work, dm_ops, dm_dep, active_daymen, day_idx, times, constraints,
+                prev_day_work, forced_bits, next_day=next_day,
+                min_longest_rest_hours=min_longest_rest_hours,
+                time_budget=improve_time_budget, seed=improve_seed + day_idx
+            )
+            improve_line = (
+                f"Paikallishaku päivä {day_idx + 1}: tavoite {improved['cost_before']} -> "
+                f"{improved['cost_after']}, {improved['moves']} siirtoa "
+                f"({improved['moves_per_second']:.0f}/s)"
+            )
         
         # VAIHE 8: Täytä watchmanien aukot vuoron ja lisätyön välissä
         align_watchman_extra_work(wm_work, wm_sluice)
         
         # Tallenna daymanien tulokset
-        for dm in DAYMEN:
-            all_days[dm].append({
-                'work_slots': dm_work[dm],
-                'arrival_slots': dm_arr[dm],
-                'departure_slots': dm_dep[dm],
-                'port_op_slots': dm_ops[dm],
-                'sluice_slots': dm_sluice[dm],
-                'shifting_slots': dm_shifting[dm]
-            })
+        days = {dm: dm_work[dm].to_day_schedule() for dm in DAYMEN}
         
         # Bosun
-        all_days['Bosun'].append(generate_bosun_schedule(times))
+        days['Bosun'] = generate_bosun_schedule(times)
         
         # Watchmanit (yhdistää slussi-vuorot vakiovuoroihin)
         for wm in WATCHMEN:
-            all_days[wm].append(generate_watchman_schedule(wm, wm_work, wm_sluice))
+            days[wm] = generate_watchman_schedule(wm, wm_work, wm_sluice)
+        days = {w: days[w] for w in WORKERS}
+
+        DAY_MEMO.put(memo_key, days, pending_next_day, improve_line)
+
+        # Seuraavalle päivälle kulkeva tila otetaan ennen luovutusta, joten
+        # kuluttajan muokkaukset eivät vaikuta seuraavaan päivään
+        prev_day_work = {dm: list(days[dm]['work_slots']) for dm in DAYMEN}
+        yield (day_idx, days, improve_line,
+               _final_state(day_idx + 1, prev_day_work, pending_next_day, prev_info))
+
+
+def generate_schedule_iter(days_source, constraints=None, min_longest_rest_hours=6,
+                           use_next_day_events=False, engine='greedy',
+                           exact_time_budget=DEFAULT_TIME_BUDGET, improve_time_budget=0,
+                           improve_seed=0, variant=None, initial_state=None, with_state=False):
+    """
+    Generoi työvuorot päivä kerrallaan pitkille matkoille.
+
+    days_source voi olla mikä tahansa iteroitava päivien tiedoista (lista,
+    generaattori, tiedostosta luettu virta). Jokainen päivä luovutetaan heti
+    kun se on valmis, eikä aiempia päiviä pidetä muistissa, joten 90-365
+    päivän matkat onnistuvat vakiomuistilla (päivämuisti DAY_MEMO on rajattu;
+    set_day_memo_size(0) poistaa senkin). Seuraava päivä luetaan lähteestä
+    etukäteen vain kun use_next_day_events=True. Parametrit ja tulokset ovat
+    samat kuin generate_schedule:lla.
+
+    Virheelliset asetukset (engine, variant, initial_state) tarkistetaan
+    heti kutsussa.
+
+    Args:
+        initial_state: Jatka tallennetusta tilasta (ks. generate_schedule)
+        with_state: Luovuta jokaisen päivän jälkeinen tila, josta generointi
+            voidaan myöhemmin jatkaa (esim. tarkistuspisteenä)
+
+    Yields:
+        (day_idx, days) tai with_state=True: (day_idx, days, state);
+        days[worker] on päivän DaySchedule, day_idx päivän indeksi matkalla
+
+    Esim. write_schedule_jsonl(generate_schedule_iter(days), fp)
+    """
+    settings = _generation_settings(engine, variant)
+    _initial_state(initial_state)
+    generated = _generate_days(
+        days_source, constraints, min_longest_rest_hours, use_next_day_events,
+        engine, exact_time_budget, improve_time_budget, improve_seed, *settings,
+        initial_state=initial_state
+    )
+    if with_state:
+        return ((day_idx, days, state) for day_idx, days, _, state in generated)
+    return ((day_idx, days) for day_idx, days, _, _ in generated)
+
+
+def generate_schedule(days_data, constraints=None, min_longest_rest_hours=6,
+                      use_next_day_events=False, engine='greedy',
+                      exact_time_budget=DEFAULT_TIME_BUDGET, improve_time_budget=0,
+                      improve_seed=0, variant=None, initial_state=None, return_state=False):
+    """
+    Generoi työvuorot blokkipohjaisella lähestymistavalla.
+    
+    Args:
+        days_data: Lista päivien tiedoista
+        constraints: Lista rajoitteista (valinnainen)
+        use_next_day_events: Käytä seuraavan päivän tunnettuja tapahtumia
+            (days_data) oletetussa seuraavassa päivässä 08-16 oletuksen lisäksi
+        engine: "greedy" (oletus) tai "exact": daymenien päivä ratkaistaan
+            lisäksi branch-and-boundilla (exact_day), paitsi slussipäivinä
+        exact_time_budget: Tarkan ratkaisun aikabudjetti per päivä (s)
+        improve_time_budget: Paikallishaun aikabudjetti per päivä (s); 0 = ei
+            paikallishakua. Raporttiin lisätään tavoite ennen ja jälkeen sekä
+            arvioidut siirrot sekunnissa.
+        improve_seed: Paikallishaun satunnaislukusiemen (päivän indeksi lisätään)
+        variant: Heuristiikan muunnelma dictinä (avaimet VARIANT_KEYS);
+            None = oletusheuristiikka (portfolio.generate_portfolio)
+        initial_state: Edelliseltä segmentiltä kulkeva tila dictinä (avaimet
+            SCHEDULE_STATE_KEYS): matkan päivän indeksi, edellisen päivän
+            daymenien työ, keskiyön yli kulkevat slotit ja edellisen päivän
+            syöte. None = matkan alku (edellinen päivä lepoa).
+        return_state: Palauta lisäksi viimeisen päivän jälkeinen tila, jolla
+            seuraava segmentti jatkaa (JSON-yhteensopiva)
+    
+    Matkan voi generoida osissa: segmentit ketjutettuna antavat saman
+    tuloksen kuin koko matka kerralla (use_next_day_events=True:lla segmentin
+    viimeinen päivä ei näe seuraavan segmentin tapahtumia).
+    
+    Päivien tulokset tallennetaan päivämuistiin (DAY_MEMO): jos päivän
+    syötteet ja edelliseltä päivältä kulkeva tila ovat samat kuin aiemmin,
+    päivä otetaan muistista (day_memo_info, set_day_memo_size).
+    
+    Kun engine="exact" tai improve_time_budget > 0, matka generoidaan myös
+    ahneesti ja ahne tulos pidetään, jos sen matkan pisteet (score_schedule)
+    ovat paremmat: päiväkohtaiset parannukset arvioidaan oletettua seuraavaa
+    päivää vasten eivätkä ne saa huonontaa koko matkaa.
+    
+    Pitkille matkoille ks. generate_schedule_iter, joka ei kokoa koko matkaa
+    muistiin (eikä tee tätä koko matkan vertailua).
+    
+    Returns:
+        (workbook, all_days, report); all_days[worker][day] on DaySchedule.
+        return_state=True: (workbook, all_days, report, state)
+    """
+    settings = _generation_settings(engine, variant)
+    first_day, prev_day_work, pending_next_day, prev_info = _initial_state(initial_state)
+    num_days = len(days_data)
+
+    def collect(engine, exact_time_budget, improve_time_budget, improve_seed):
+        """Kokoaa _generate_days-päivät: (all_days, improve_lines, tila)."""
+        all_days = {w: [] for w in WORKERS}
+        improve_lines = []
+        state = _final_state(first_day, prev_day_work, pending_next_day, prev_info)
+        for _, days, improve_line, state in _generate_days(
+                days_data, constraints, min_longest_rest_hours, use_next_day_events,
+                engine, exact_time_budget, improve_time_budget, improve_seed, *settings,
+                initial_state=initial_state):
+            for worker in WORKERS:
+                all_days[worker].append(days[worker])
+            if improve_line:
+                improve_lines.append(improve_line)
+        return all_days, improve_lines, state
+
+    # Paikallishaun tulokset raporttiin
+    all_days, improve_lines, state = collect(
+        engine, exact_time_budget, improve_time_budget, improve_seed
+    )
+
+    # Tarkka ratkaisu ja paikallishaku arvioivat päivän oletettua seuraavaa
+    # päivää vasten; jos koko matkan pisteet huononevat, pidetään ahne tulos
+    # (ahneen asetukset ovat oletukset, joten päivämuisti jaetaan sen kanssa)
+    if engine != 'greedy' or improve_time_budget > 0:
+        greedy_days, _, greedy_state = collect('greedy', DEFAULT_TIME_BUDGET, 0, 0)
+        score = score_schedule(all_days, days_data, constraints, min_longest_rest_hours)
+        greedy_score = score_schedule(greedy_days, days_data, constraints, min_longest_rest_hours)
+        if greedy_score < score:
+            # Paikallishaun rivit koskevat hylättyä tulosta
+            all_days, state = greedy_days, greedy_state
+            improve_lines = [
+                f"Matkan pisteet {score} > ahneen {greedy_score}: käytetään ahnetta tulosta"
+            ]
     
     # Rakenna Excel
     wb, report = build_workbook_and_report(all_days, num_days, WORKERS)
+    if improve_lines:
+        report = "\n".join([report] + improve_lines)
     
+    if return_state:
+        return wb, all_days, report, state
     return wb, all_days, report
 
 
@@ -2284,6 +3831,23 @@ def generate_schedule(days_data, constraints=None, min_longest_rest_hours=6):
 # EXCEL-GENEROINTI
 # ============================================================================
 
+def slot_fill_and_label(sluice, shifting, arr, dep, ops, work, slot):
+    """Slotin solun väri ja merkintä (SL, SH, B, C, OP, X tai tyhjä)."""
+    if sluice[slot]:
+        return PURPLE, "SL"
+    if shifting[slot]:
+        return PINK, "SH"
+    if arr[slot]:
+        return YELLOW, "B"
+    if dep[slot]:
+        return ORANGE, "C"
+    if ops[slot]:
+        return GREEN, "OP"
+    if work[slot]:
+        return BLUE, "X"
+    return WHITE, None
+
+
 def build_workbook_and_report(all_days, num_days, workers):
     """
     Rakentaa Excel-työkirjan ja raportin.
@@ -2302,6 +3866,9 @@ def build_workbook_and_report(all_days, num_days, workers):
         top=Side(style='thin'),
         bottom=Side(style='thin')
     )
+    # Tyylit luodaan kerran ja jaetaan soluille
+    center = Alignment(horizontal='center')
+    small_font = Font(size=8)
     
     report_lines = []
     current_row = 1
@@ -2318,8 +3885,8 @@ def build_workbook_and_report(all_days, num_days, workers):
             if slot % 2 == 0:
                 time_str = f"{slot // 2:02d}:00"
                 ws.cell(row=current_row, column=col, value=time_str)
-            ws.cell(row=current_row, column=col).alignment = Alignment(horizontal='center')
-            ws.cell(row=current_row, column=col).font = Font(size=8)
+            ws.cell(row=current_row, column=col).alignment = center
+            ws.cell(row=current_row, column=col).font = small_font
         ws.cell(row=current_row, column=50, value="Tunnit")
         current_row += 1
         
@@ -2339,30 +3906,12 @@ def build_workbook_and_report(all_days, num_days, workers):
                 col = slot + 2
                 cell = ws.cell(row=current_row, column=col)
                 cell.border = thin_border
+                cell.fill, value = slot_fill_and_label(sluice, shifting, arr, dep, ops, work, slot)
+                if value is not None:
+                    cell.value = value
                 
-                if sluice[slot]:
-                    cell.fill = PURPLE
-                    cell.value = "SL"
-                elif shifting[slot]:
-                    cell.fill = PINK
-                    cell.value = "SH"
-                elif arr[slot]:
-                    cell.fill = YELLOW
-                    cell.value = "B"
-                elif dep[slot]:
-                    cell.fill = ORANGE
-                    cell.value = "C"
-                elif ops[slot]:
-                    cell.fill = GREEN
-                    cell.value = "OP"
-                elif work[slot]:
-                    cell.fill = BLUE
-                    cell.value = "X"
-                else:
-                    cell.fill = WHITE
-                
-                cell.alignment = Alignment(horizontal='center')
-                cell.font = Font(size=8)
+                cell.alignment = center
+                cell.font = small_font
             
             hours_cell = ws.cell(row=current_row, column=50)
             hours_cell.value = f'=COUNTA(B{current_row}:AW{current_row})/2'
@@ -2383,13 +3932,171 @@ def build_workbook_and_report(all_days, num_days, workers):
     return wb, report
 
 
+def write_schedule_xlsx(days, path, workers=WORKERS):
+    """
+    Kirjoittaa päivät Excel-tiedostoon virtana (openpyxl write-only).
+
+    Asettelu on sama kuin build_workbook_and_report:lla, mutta rivit
+    kirjoitetaan sitä mukaa kun päiviä tulee, joten koko matkaa ei pidetä
+    muistissa.
+
+    Args:
+        days: Iteroitava (day_idx, {worker: DaySchedule}), esim.
+            generate_schedule_iter
+        path: Tiedostopolku tai binääritiedosto
+        workers: Työntekijät rivijärjestyksessä
+
+    Returns:
+        Kirjoitettujen päivien määrä
+    """
+    wb = Workbook(write_only=True)
+    wb.calculation.calcMode = "auto"
+    wb.calculation.fullCalcOnLoad = True
+    wb.calculation.forceFullCalc = True
+    wb.calculation.calcOnSave = True
+    ws = wb.create_sheet("Työvuorot")
+    
+    # Sarakeleveydet on asetettava ennen ensimmäistä riviä
+    ws.column_dimensions['A'].width = 12
+    for col in range(2, 50):
+        ws.column_dimensions[get_column_letter(col)].width = 4
+    ws.column_dimensions[get_column_letter(50)].width = 6
+    
+    thin_border = Border(
+        left=Side(style='thin'),
+        right=Side(style='thin'),
+        top=Side(style='thin'),
+        bottom=Side(style='thin')
+    )
+    center = Alignment(horizontal='center')
+    small_font = Font(size=8)
+    title_font = Font(bold=True, size=14)
+
+    def template(fill=None, border=None):
+        cell = WriteOnlyCell(ws)
+        cell.alignment = center
+        cell.font = small_font
+        if fill is not None:
+            cell.fill = fill
+        if border is not None:
+            cell.border = border
+        return cell._style
+
+    # Tyylit kootaan kerran ja kopioidaan soluille (tyylin asetus on hidas)
+    header_style = template()
+    slot_styles = {
+        id(fill): template(fill, thin_border)
+        for fill in (PURPLE, PINK, YELLOW, ORANGE, GREEN, BLUE, WHITE)
+    }
+
+    def styled(value, style):
+        cell = WriteOnlyCell(ws, value=value)
+        cell._style = copy(style)
+        return cell
+
+    header = ["Työntekijä"]
+    header += [
+        styled(f"{slot // 2:02d}:00" if slot % 2 == 0 else None, header_style)
+        for slot in range(48)
+    ]
+    header.append("Tunnit")
+    
+    current_row = 1
+    written = 0
+    for day_idx, day in days:
+        title = WriteOnlyCell(ws, value=f"Päivä {day_idx + 1}")
+        title.font = title_font
+        ws.append([title])
+        ws.append(header)
+        current_row += 2
+        
+        for worker in workers:
+            day_data = day[worker]
+            work = day_data['work_slots']
+            arr = day_data['arrival_slots']
+            dep = day_data['departure_slots']
+            ops = day_data.get('port_op_slots', [False] * 48)
+            sluice = day_data.get('sluice_slots', [False] * 48)
+            shifting = day_data.get('shifting_slots', [False] * 48)
+            
+            row = [worker]
+            for slot in range(48):
+                fill, value = slot_fill_and_label(sluice, shifting, arr, dep, ops, work, slot)
+                row.append(styled(value, slot_styles[id(fill)]))
+            hours_cell = WriteOnlyCell(ws, value=f'=COUNTA(B{current_row}:AW{current_row})/2')
+            hours_cell.number_format = '0.0'
+            row.append(hours_cell)
+            ws.append(row)
+            current_row += 1
+        
+        ws.append([])
+        current_row += 1
+        written += 1
+    
+    wb.save(path)
+    return written
+
+
+def write_schedule_jsonl(days, fp):
+    """
+    Kirjoittaa päivät JSON Lines -virtana, yksi rivi päivää kohden.
+
+    Rivi on {"day": indeksi, "workers": {työntekijä: {kenttä: bittimaski}}}
+    (kentät DAY_FIELDS, bitti = slotti). read_schedule_jsonl lukee takaisin.
+
+    Args:
+        days: Iteroitava (day_idx, {worker: DaySchedule}), esim.
+            generate_schedule_iter
+        fp: Tekstitiedosto
+
+    Returns:
+        Kirjoitettujen päivien määrä
+    """
+    written = 0
+    for day_idx, day in days:
+        record = {
+            'day': day_idx,
+            'workers': {
+                worker: {field: packed.bits(field) for field in DAY_FIELDS}
+                for worker, packed in (
+                    (worker, DaySchedule.from_dict(schedule)) for worker, schedule in day.items()
+                )
+            },
+        }
+        fp.write(json.dumps(record) + "\n")
+        written += 1
+    return written
+
+
+def read_schedule_jsonl(fp):
+    """
+    Lukee write_schedule_jsonl:n kirjoittamat päivät virtana.
+
+    Yields:
+        (day_idx, {worker: DaySchedule})
+    """
+    for line in fp:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        yield record['day'], {
+            worker: DaySchedule.from_bits(*(fields.get(field, 0) for field in DAY_FIELDS))
+            for worker, fields in record['workers'].items()
+        }
+
+
 # ============================================================================
 # MANUAALINEN PÄIVÄ 1
 # ============================================================================
 
-def generate_schedule_with_manual_day1(days_data, manual_day1_slots, min_longest_rest_hours=6):
+def generate_schedule_with_manual_day1(days_data, manual_day1_slots, min_longest_rest_hours=6,
+                                       constraints=None):
     """
     Generoi työvuorot manuaalisella päivällä 1.
+
+    Päivät 2..N jatkavat manuaalisesta päivästä (initial_state), joten
+    päivän 1 työ on mukana päivän 2 STCW-tarkistuksissa ja jatkuvan yön
+    tunnistuksessa, ja rajoitteiden päivänumerot osuvat oikeille päiville.
     """
     if not days_data:
         return generate_schedule(days_data)
@@ -2403,22 +4110,211 @@ def generate_schedule_with_manual_day1(days_data, manual_day1_slots, min_longest
         else:
             work = [False] * 48
         
-        all_days[worker].append({
-            'work_slots': work,
-            'arrival_slots': [False] * 48,
-            'departure_slots': [False] * 48,
-            'port_op_slots': [False] * 48,
-            'sluice_slots': [False] * 48,
-            'shifting_slots': [False] * 48
-        })
+        all_days[worker].append(DaySchedule(work_slots=work))
     
     if num_days > 1:
+        initial_state = {
+            'day_index': 1,
+            'prev_day_work': {dm: all_days[dm][0] for dm in DAYMEN},
+            'prev_day_info': days_data[0],
+        }
         _, rest_days, _ = generate_schedule(
             days_data[1:],
-            min_longest_rest_hours=min_longest_rest_hours
+            constraints=constraints,
+            min_longest_rest_hours=min_longest_rest_hours,
+            initial_state=initial_state
         )
         for worker in WORKERS:
             all_days[worker].extend(rest_days[worker])
     
     wb, report = build_workbook_and_report(all_days, num_days, WORKERS)
     return wb, all_days, report
+
+
+# ============================================================================
+# MUOKKAUKSEN KORJAUS
+# ============================================================================
+
+def _edited_cells(all_days, edits):
+    """Muokatut solut {(worker, day, slot): työ}; joukolle arvo luetaan all_days:sta."""
+    if isinstance(edits, dict):
+        return {cell: bool(value) for cell, value in edits.items()}
+    return {
+        (worker, day, slot): bool(all_days[worker][day]['work_slots'][slot])
+        for worker, day, slot in edits
+    }
+
+
+def _pin_constraints(cells):
+    """Muokatut solut rajoitteina: työ -> must_work_slot, lepo -> cannot_work_slot."""
+    return [
+        {
+            'worker': worker,
+            'type': 'must_work_slot' if value else 'cannot_work_slot',
+            'start_time': slot_to_time_str(slot),
+            'end_time': slot_to_time_str(slot + 1),
+            'day': day + 1,
+        }
+        for (worker, day, slot), value in sorted(cells.items())
+    ]
+
+
+def _repair_day(repaired, days_data, day_idx, constraints, pinned_rest, min_longest_rest_hours):
+    """
+    Korjaa yhden päivän daymanit muokkauksen jälkeen: op-kattavuus,
+    tasapainotus, STCW-korjaus ja pienet aukot. Kirjoittaa päivän takaisin
+    repaired-rakenteeseen ja palauttaa fix_stcw_violations:n laskurit.
+    """
+    num_days = len(days_data)
+    times = parse_day_times(days_data[day_idx])
+    active_daymen = [dm for dm in DAYMEN if not is_day_off(dm, day_idx, constraints)]
+
+    dm_work = {}
+    dm_ops = {}
+    dm_arr = {}
+    dm_dep = {}
+    dm_sluice = {}
+    dm_shifting = {}
+    for dm in DAYMEN:
+        day = repaired[dm][day_idx]
+        work_mask = day.bits('work_slots')
+        # Merkinnät vain slotteihin joissa yhä tehdään työtä
+        dm_arr[dm] = unpack_slots(day.bits('arrival_slots') & work_mask)
+        dm_dep[dm] = unpack_slots(day.bits('departure_slots') & work_mask)
+        dm_ops[dm] = unpack_slots(day.bits('port_op_slots') & work_mask)
+        dm_sluice[dm] = unpack_slots(day.bits('sluice_slots') & work_mask)
+        dm_shifting[dm] = unpack_slots(day.bits('shifting_slots') & work_mask)
+        dm_work[dm] = WorkerDayState(unpack_slots(work_mask), masks={
+            'arrival_slots': dm_arr[dm],
+            'departure_slots': dm_dep[dm],
+            'port_op_slots': dm_ops[dm],
+            'sluice_slots': dm_sluice[dm],
+            'shifting_slots': dm_shifting[dm],
+        })
+
+    if day_idx > 0:
+        prev_day_work = {dm: list(repaired[dm][day_idx - 1]['work_slots']) for dm in DAYMEN}
+    else:
+        prev_day_work = {dm: [False] * 48 for dm in DAYMEN}
+
+    # Eteenpäin tarkistetaan todellista seuraavaa päivää vasten; carry-over
+    # on jo seuraavan päivän työssä
+    if day_idx + 1 < num_days:
+        next_day = {dm: repaired[dm][day_idx + 1]['work_slots'] for dm in DAYMEN}
+    else:
+        next_day = dict.fromkeys(DAYMEN, assumed_next_day())
+    next_bits = {dm: pack_slots(next_day[dm]) for dm in DAYMEN}
+
+    # Watchmanit: lukitut leposlotit eivät ole vapaina slussisiirroille
+    wm_before = {wm: repaired[wm][day_idx].bits('work_slots') for wm in WATCHMEN}
+    wm_work = {wm: unpack_slots(wm_before[wm] | pinned_rest.get(wm, 0)) for wm in WATCHMEN}
+    wm_sluice = {wm: list(repaired[wm][day_idx]['sluice_slots']) for wm in WATCHMEN}
+    watchman_states = {wm: {'extended_start': False, 'extended_end': False} for wm in WATCHMEN}
+    for wm in WATCHMEN:
+        for slot in range(48):
+            if wm_before[wm] >> slot & 1:
+                update_watchman_state(wm, slot, watchman_states)
+
+    def violations(dm):
+        """Rikkovat ikkunat edellistä ja todellista seuraavaa päivää vasten."""
+        bits = dm_work[dm].bits
+        return (stcw_violation_mask(pack_slots(prev_day_work[dm]), bits, min_longest_rest_hours)
+                | stcw_violation_mask(bits, next_bits[dm], min_longest_rest_hours) << 48).bit_count()
+
+    # Op-kattavuus STCW-tarkistetusti (vaihe 3.1)
+    fill_op_inside_normal_hours(
+        dm_work, dm_ops, active_daymen, day_idx, times, constraints, prev_day_work,
+        min_longest_rest_hours=min_longest_rest_hours
+    )
+    rebalance_dayman_hours(
+        dm_work, dm_ops, dm_arr, dm_dep, dm_sluice, dm_shifting,
+        active_daymen, day_idx, times, constraints, prev_day_work,
+        min_longest_rest_hours=min_longest_rest_hours,
+        max_diff_hours=1.0
+    )
+    stats = fix_stcw_violations(
+        dm_work, dm_ops, dm_arr, dm_dep, dm_sluice, dm_shifting,
+        active_daymen, day_idx, times, constraints, prev_day_work,
+        min_longest_rest_hours=min_longest_rest_hours,
+        wm_work=wm_work, wm_sluice=wm_sluice, watchman_states=watchman_states,
+        next_day=next_day
+    )
+    fill_small_gaps_stcw(dm_work, dm_ops, active_daymen, times, violations)
+
+    # fill_small_gaps ei tunne rajoitteita: lukittu lepo palautetaan
+    for dm in DAYMEN:
+        for slot in range(48):
+            if pinned_rest.get(dm, 0) >> slot & 1 and dm_work[dm][slot]:
+                dm_work[dm][slot] = False
+                dm_ops[dm][slot] = False
+        repaired[dm][day_idx] = dm_work[dm].to_day_schedule()
+
+    # Watchmanille siirretyt slussislotit
+    for wm in WATCHMEN:
+        moved = pack_slots(wm_work[wm]) & ~(wm_before[wm] | pinned_rest.get(wm, 0))
+        if moved:
+            day = repaired[wm][day_idx].copy()
+            day['work_slots'] = unpack_slots(day.bits('work_slots') | moved)
+            day['sluice_slots'] = unpack_slots(day.bits('sluice_slots') | moved)
+            repaired[wm][day_idx] = day
+
+    return stats
+
+
+def repair_after_edit(all_days, days_data, edits, constraints=None, min_longest_rest_hours=6):
+    """
+    Korjaa käsin muokatut vuorot paikallisesti ilman koko matkan uudelleengenerointia.
+
+    Muokatut solut lukitaan (työ pakolliseksi, lepo kielletyksi) ja vain
+    muokattujen päivien ja niitä seuraavien päivien daymanit korjataan:
+    op-kattavuus, tunnien tasapainotus, STCW-korjaus (molempiin suuntiin
+    todellisia naapuripäiviä vasten) ja pienet aukot.
+
+    Args:
+        all_days: Generoinnin tulos (ei muuteta)
+        days_data: Päivien tiedot kuten generate_schedule:lle
+        edits: {(worker, day, slot): työ} tai joukko (worker, day, slot), jolloin
+            uusi arvo on jo all_days:ssa
+        constraints: Alkuperäiset rajoitteet
+
+    Returns:
+        (all_days, summary); korjatut päivät ovat uusia DaySchedule-olioita,
+        muut jaetaan syötteen kanssa. summary: days (korjatut päivät),
+        pinned, moves, unresolved ({päivä: daymanit}), elapsed
+    """
+    started = time.perf_counter()
+    cells = _edited_cells(all_days, edits)
+    repaired = {worker: list(days) for worker, days in all_days.items()}
+
+    pinned_rest = {}
+    for (worker, day_idx, slot), value in cells.items():
+        day = repaired[worker][day_idx]
+        if day is all_days[worker][day_idx]:
+            day = day.copy()
+            repaired[worker][day_idx] = day
+        day['work_slots'][slot] = value
+        if not value:
+            pinned_rest.setdefault((worker, day_idx), 0)
+            pinned_rest[(worker, day_idx)] |= 1 << slot
+
+    constraints = compile_constraints(list(compile_constraints(constraints)) + _pin_constraints(cells))
+    edited_days = {day_idx for _, day_idx, _ in cells}
+    affected = sorted(edited_days | {d + 1 for d in edited_days if d + 1 < len(days_data)})
+
+    moves = 0
+    unresolved = {}
+    for day_idx in affected:
+        day_pins = {worker: bits for (worker, d), bits in pinned_rest.items() if d == day_idx}
+        stats = _repair_day(repaired, days_data, day_idx, constraints, day_pins,
+                            min_longest_rest_hours)
+        moves += stats['moves']
+        if stats['unresolved']:
+            unresolved[day_idx] = stats['unresolved']
+
+    return repaired, {
+        'days': affected,
+        'pinned': len(cells),
+        'moves': moves,
+        'unresolved': unresolved,
+        'elapsed': time.perf_counter() - started,
+    }
@@ -0,0 +1,1079 @@
+# -*- coding: utf-8 -*-
+"""
+STCW Engine - Bittimaskipohjainen STCW-laskenta
+
+Päivä (48 puolen tunnin slottia) esitetään kokonaislukuna, jossa bitti i
+on slotti i (1 = työ). Kahden päivän yhdistelmä on 96-bittinen luku:
+edellinen päivä bitit 0-47, nykyinen päivä bitit 48-95.
+
+Kaikki 48 liukuvaa 24h ikkunaa lasketaan bittioperaatioilla ilman
+listojen kopiointia. Tulokset ovat identtiset sea_watch_17:n
+listapohjaisen toteutuksen (analyze_stcw_window / check_stcw_sliding)
+kanssa, mukaan lukien ikkunan reunojen yhdistämissääntö.
+"""
+
+from bisect import bisect_right
+from collections import OrderedDict, deque
+from threading import Lock
+
+SLOTS_PER_DAY = 48
+DAY_MASK = (1 << SLOTS_PER_DAY) - 1
+TWO_DAY_MASK = (1 << (2 * SLOTS_PER_DAY)) - 1
+
+MIN_TOTAL_REST_SLOTS = 20   # 10h
+
+# Tavu 0 -> '0', muut -> '1' (bytes(lista) -> binäärimerkkijono)
+_BIT_CHARS = bytes([ord('0')] + [ord('1')] * 255)
+
+
+# ============================================================================
+# PAKKAUS
+# ============================================================================
+
+def pack_slots(slots):
+    """
+    Pakkaa bool-listan kokonaisluvuksi (bitti i = slotti i).
+
+    None tai tyhjä lista -> 0.
+    """
+    if not slots:
+        return 0
+    try:
+        return int(bytes(slots)[::-1].translate(_BIT_CHARS), 2)
+    except (TypeError, ValueError):
+        bits = 0
+        for i, w in enumerate(slots):
+            if w:
+                bits |= 1 << i
+        return bits
+
+
+def unpack_slots(bits, length=SLOTS_PER_DAY):
+    """Purkaa kokonaisluvun bool-listaksi."""
+    return [bool(bits >> i & 1) for i in range(length)]
+
+
+# ============================================================================
+# AJOPITUUDET
+# ============================================================================
+
+def _trailing_ones(x):
+    """Palauttaa alimpien peräkkäisten ykkösbittien määrän."""
+    return (x ^ (x + 1)).bit_length() - 1
+
+
+def work_gaps(work_bits, skip_bits=0, width=SLOTS_PER_DAY):
+    """
+    Työjaksojen väliset aukot yhdellä läpikäynnillä.
+
+    Aukko on tyhjä jakso [start, end), jota työ rajaa molemmilta puolilta;
+    päivän alun ja lopun lepo ei ole aukko.
+
+    Args:
+        work_bits: Työ bittimaskina
+        skip_bits: Slotit joita ei täytetä (esim. lounas, kielletyt)
+        width: Slottien määrä
+
+    Returns:
+        Lista tupleista (start, end, fill_bits), fill_bits = aukon slotit
+        ilman skip_bits-slotteja
+    """
+    bits = work_bits & ((1 << width) - 1)
+    gaps = []
+    if not bits:
+        return gaps
+    pos = (bits & -bits).bit_length() - 1
+    top = bits.bit_length()
+    while True:
+        pos += _trailing_ones(bits >> pos)
+        if pos >= top:
+            return gaps
+        rest = bits >> pos
+        length = (rest & -rest).bit_length() - 1
+        gaps.append((pos, pos + length, (((1 << length) - 1) << pos) & ~skip_bits))
+        pos += length
+
+
+def _run_shifts(length):
+    """
+    Siirtosarja jolla x &= x >> s jättää bitin i päälle vain jos
+    bitit i..i+length-1 ovat kaikki päällä (tuplaustekniikka).
+    Samalla sarjalla x |= x >> s levittää bitin j biteille j-length+1..j.
+    """
+    shifts = []
+    covered = 1
+    while covered * 2 <= length:
+        shifts.append(covered)
+        covered *= 2
+    if covered < length:
+        shifts.append(length - covered)
+    return tuple(shifts)
+
+
+# Esilasketut siirtosarjat pisimmän levon vaatimuksille (slotteina)
+_RUN_SHIFTS = {n: _run_shifts(n) for n in range(1, SLOTS_PER_DAY + 1)}
+
+# Lepomäärän ryhmätarkistus: 6 peräkkäisen ikkunan yhteinen ydin (43 slottia)
+_GROUP_SIZE = 6
+_GROUP_STARTS = tuple(range(0, SLOTS_PER_DAY, _GROUP_SIZE))
+_CORE_MASK = (1 << (SLOTS_PER_DAY - _GROUP_SIZE + 1)) - 1
+_CORE_MIN_REST = MIN_TOTAL_REST_SLOTS + 2   # reunakorjaukset max 2 slottia
+
+
+def _min_longest_slots(min_longest_rest_hours):
+    """
+    Muuntaa pisimmän levon vaatimuksen slottimääräksi.
+
+    Palauttaa 0 jos vaatimus täyttyy aina (raja <= 0). Lepojaksoiksi
+    lasketaan vain vähintään 2 slotin jaksot, joten raja on vähintään 2.
+    """
+    if min_longest_rest_hours <= 0:
+        return 0
+    slots = int(min_longest_rest_hours * 2)
+    if slots < min_longest_rest_hours * 2:
+        slots += 1
+    return max(slots, 2)
+
+
+# ============================================================================
+# IKKUNA-ANALYYSI
+# ============================================================================
+
+def analyze_rest_bits(rest, width=SLOTS_PER_DAY):
+    """
+    Analysoi lepobittimaskin (bitti = 1 on lepoa) kuten analyze_stcw_window.
+
+    Returns:
+        Dict: total_rest, longest_rest, rest_periods
+    """
+    rest_periods = []
+    x = rest
+    while x:
+        start = (x & -x).bit_length() - 1
+        length = _trailing_ones(x >> start)
+        if length >= 2:
+            rest_periods.append(length / 2)
+        x &= ~(((1 << length) - 1) << start)
+
+    # Yhdistä lepo jos se jatkuu ikkunan alusta loppuun (wrap-around)
+    if len(rest_periods) >= 2 and width == SLOTS_PER_DAY:
+        if rest & 1 and rest >> (width - 1) & 1:
+            combined = rest_periods[-1] + rest_periods[0]
+            rest_periods = [combined] + rest_periods[1:-1]
+
+    total_rest = sum(rest_periods)
+    longest_rest = max(rest_periods) if rest_periods else 0
+
+    return {
+        'total_rest': total_rest,
+        'longest_rest': longest_rest,
+        'rest_periods': rest_periods
+    }
+
+
+def analyze_work_bits(work, width=SLOTS_PER_DAY):
+    """Analysoi työbittimaskin (bitti = 1 on työtä) 24h ikkunana."""
+    return analyze_rest_bits(~work & ((1 << width) - 1), width)
+
+
+def window_total_slots(rest):
+    """Laskettavan levon määrä slotteina (yksittäiset leposlotit eivät lasketa)."""
+    singles = rest & ~((rest << 1) | (rest >> 1))
+    return rest.bit_count() - singles.bit_count()
+
+
+def window_longest_ok(rest, min_slots):
+    """
+    Tarkistaa täyttyykö pisimmän levon vaatimus ikkunassa.
+
+    Args:
+        rest: 48-bittinen lepomaski
+        min_slots: Pisimmän levon vaatimus slotteina (_min_longest_slots)
+    """
+    if not min_slots:
+        return True
+    if min_slots > SLOTS_PER_DAY:
+        return False
+    x = rest
+    for s in _RUN_SHIFTS[min_slots]:
+        x &= x >> s
+    if x:
+        return True
+
+    # Reunat yhdistyvät vain jos ikkunan molemmat päät ovat lepoa ja
+    # lepojaksoja (>= 2 slottia) on vähintään kaksi
+    if not (rest & 1 and rest >> (SLOTS_PER_DAY - 1) & 1):
+        return False
+    starts = rest & (rest >> 1) & ~(rest << 1)
+    if not starts & (starts - 1):
+        return False
+    first = (starts & -starts).bit_length() - 1
+    last = starts.bit_length() - 1
+    merged = _trailing_ones(rest >> first) + _trailing_ones(rest >> last)
+    return merged >= min_slots
+
+
+# ============================================================================
+# LIUKUVA TARKISTUS
+# ============================================================================
+
+def _total_rest_violations(rest96):
+    """
+    Palauttaa bittimaskin ikkunoista joissa lepoa on alle 10h.
+
+    Ikkunat käsitellään kuuden ikkunan ryhmissä: ryhmän kaikille
+    ikkunoille yhteinen 43 slotin ydin antaa alarajan levolle, ja vain
+    ne ryhmät joissa alaraja ei riitä lasketaan ikkuna kerrallaan.
+    """
+    # Lepo joka kuuluu vähintään 2 slotin jaksoon (koko 96 slotin jonossa)
+    left_pair = rest96 & (rest96 << 1)
+    right_pair = rest96 & (rest96 >> 1)
+    counted = left_pair | right_pair
+
+    violations = 0
+    edges = None
+    for base in _GROUP_STARTS:
+        if ((counted >> (base + _GROUP_SIZE - 1)) & _CORE_MASK).bit_count() >= _CORE_MIN_REST:
+            continue
+        if edges is None:
+            # Ikkunan reunalla jakso voi katketa yhden slotin mittaiseksi
+            edges = (counted & ~right_pair, (counted & ~left_pair) >> (SLOTS_PER_DAY - 1))
+        left_edge, right_edge = edges
+        for start in range(base, base + _GROUP_SIZE):
+            total = ((counted >> start) & DAY_MASK).bit_count()
+            total -= (left_edge >> start & 1) + (right_edge >> start & 1)
+            if total < MIN_TOTAL_REST_SLOTS:
+                violations |= 1 << start
+    return violations
+
+
+def _longest_rest_violations(rest96, min_slots, windows=DAY_MASK):
+    """
+    Palauttaa bittimaskin ikkunoista joissa pisin lepo jää alle vaatimuksen.
+
+    Riittävän pitkät lepojaksot etsitään kaikille ikkunoille kerralla:
+    runs-bitti j tarkoittaa että slotit j..j+min_slots-1 ovat lepoa, ja
+    levitys kertoo löytyykö sellainen kokonaan ikkunan sisältä.
+
+    Args:
+        windows: Tarkistettavat ikkunat bittimaskina (oletus kaikki)
+    """
+    if not min_slots:
+        return 0
+
+    if min_slots <= SLOTS_PER_DAY:
+        runs = rest96
+        for s in _RUN_SHIFTS[min_slots]:
+            runs &= runs >> s
+        for s in _RUN_SHIFTS[SLOTS_PER_DAY + 1 - min_slots]:
+            runs |= runs >> s
+        candidates = ~runs & windows
+    else:
+        candidates = windows
+
+    # Jäljelle jääneet ikkunat voivat vielä täyttyä reunojen yhdistämisellä,
+    # mutta vain jos ikkunan ensimmäinen ja viimeinen slotti ovat lepoa
+    both_ends = rest96 & (rest96 >> (SLOTS_PER_DAY - 1))
+    violations = candidates & ~both_ends
+    candidates &= both_ends
+    while candidates:
+        low = candidates & -candidates
+        start = low.bit_length() - 1
+        if not window_longest_ok((rest96 >> start) & DAY_MASK, min_slots):
+            violations |= low
+        candidates ^= low
+    return violations
+
+
+def stcw_violation_mask(prev_bits, current_bits, min_longest_rest_hours=6):
+    """
+    Palauttaa bittimaskin rikkovista ikkunoista (bitti s = ikkuna joka
+    alkaa edellisen päivän slotista s).
+    """
+    rest96 = ~(prev_bits | (current_bits << SLOTS_PER_DAY)) & TWO_DAY_MASK
+    return _total_rest_violations(rest96) | _longest_rest_violations(
+        rest96, _min_longest_slots(min_longest_rest_hours)
+    )
+
+
+def stcw_ok_bits(prev_bits, current_bits, min_longest_rest_hours=6):
+    """
+    Tarkistaa ovatko kaikki 48 liukuvaa ikkunaa kunnossa.
+
+    Nopea polku check_stcw_sliding_bits-funktiolle: ei etsi pahinta
+    ikkunaa eikä muodosta analyysiä.
+    """
+    rest96 = ~(prev_bits | (current_bits << SLOTS_PER_DAY)) & TWO_DAY_MASK
+    if _total_rest_violations(rest96):
+        return False
+    return not _longest_rest_violations(rest96, _min_longest_slots(min_longest_rest_hours))
+
+
+def check_stcw_sliding_bits(prev_bits, current_bits, min_longest_rest_hours=6):
+    """
+    Bittimaskiversio check_stcw_sliding-funktiosta.
+
+    Args:
+        prev_bits: Edellisen päivän työ (48 bittiä)
+        current_bits: Nykyisen päivän työ (48 bittiä)
+        min_longest_rest_hours: Pisimmän levon vaatimus tunteina
+
+    Returns:
+        (ok, worst_slot, worst_analysis) kuten check_stcw_sliding
+    """
+    violations = stcw_violation_mask(prev_bits, current_bits, min_longest_rest_hours)
+    if not violations:
+        return True, None, None
+
+    rest96 = ~(prev_bits | (current_bits << SLOTS_PER_DAY)) & TWO_DAY_MASK
+    worst_slot = None
+    worst_total = None
+
+    # Pahin = vähiten lepoa, tasatilanteessa ensimmäinen ikkuna
+    while violations:
+        low = violations & -violations
+        start = low.bit_length() - 1
+        total = window_total_slots((rest96 >> start) & DAY_MASK)
+        if worst_slot is None or total < worst_total:
+            worst_slot = start
+            worst_total = total
+        violations ^= low
+
+    rest = (rest96 >> worst_slot) & DAY_MASK
+    return False, worst_slot, analyze_rest_bits(rest)
+
+
+def check_stcw_at_slot_bits(work_bits, length, end_slot, min_longest_rest_hours=6):
+    """
+    Bittimaskiversio check_stcw_at_slot-funktiosta.
+
+    Args:
+        work_bits: Työvuorolista pakattuna (bitti i = slotti i)
+        length: Alkuperäisen listan pituus
+        end_slot: Ikkunan viimeinen slotti
+    """
+    start_slot = max(0, end_slot - (SLOTS_PER_DAY - 1))
+    stop = min(end_slot + 1, length)
+    width = max(0, stop - start_slot)
+
+    window = (work_bits >> start_slot) & ((1 << width) - 1)
+    # Puuttuvat slotit täytetään ikkunan alkuun lepona
+    window <<= SLOTS_PER_DAY - width
+
+    analysis = analyze_work_bits(window)
+
+    total_ok = analysis['total_rest'] >= 10
+    longest_ok = analysis['longest_rest'] >= min_longest_rest_hours
+
+    if total_ok and longest_ok:
+        status = "OK"
+    elif not total_ok:
+        status = "TOTAL_REST_VIOLATION"
+    else:
+        status = "LONGEST_REST_VIOLATION"
+
+    return {
+        'status': status,
+        'total_rest': analysis['total_rest'],
+        'longest_rest': analysis['longest_rest'],
+        'rest_periods': analysis['rest_periods']
+    }
+
+
+# ============================================================================
+# KOKO MATKAN AIKAJANA
+# ============================================================================
+
+def _status(total_rest, longest_rest, min_longest_rest_hours):
+    """Statusteksti kuten check_stcw_at_slot."""
+    if total_rest < 10:
+        return "TOTAL_REST_VIOLATION"
+    if longest_rest < min_longest_rest_hours:
+        return "LONGEST_REST_VIOLATION"
+    return "OK"
+
+
+def stcw_timeline(work_slots, min_longest_rest_hours=6):
+    """
+    STCW-status jokaiselle slotille koko matkan yli yhdellä läpikäynnillä.
+
+    Slotin t arvo on 24h ikkunasta joka päättyy slottiin t (kuten
+    check_stcw_at_slot(work_slots, t)); matkan alkua ennen oletetaan lepoa.
+    Lepojaksot käydään läpi kahdella osoittimella ja ikkunan sisäisten
+    jaksojen maksimi pidetään monotonisessa jonossa, joten aika on
+    O(slottien määrä).
+
+    Args:
+        work_slots: Koko matkan työslotit (päivät peräkkäin, 48 per päivä)
+        min_longest_rest_hours: Pisimmän levon vaatimus tunteina
+
+    Returns:
+        Dict: status, total_rest, longest_rest (listat, yksi arvo per slotti)
+    """
+    pad = SLOTS_PER_DAY - 1
+    rest = [True] * pad + [not w for w in work_slots]
+
+    # Maksimaaliset lepojaksot ja kunkin leposlotin jakso
+    run_start, run_end, run_of = [], [], [-1] * len(rest)
+    for i, is_rest in enumerate(rest):
+        if not is_rest:
+            continue
+        if i == 0 or not rest[i - 1]:
+            run_start.append(i)
+            run_end.append(i)
+        else:
+            run_end[-1] = i
+        run_of[i] = len(run_start) - 1
+
+    # Lasketut (>= 1h) jaksot ja niiden pituuksien kumulatiivinen summa
+    counted = [r for r in range(len(run_start)) if run_end[r] - run_start[r] >= 1]
+    c_start = [run_start[r] for r in counted]
+    c_end = [run_end[r] for r in counted]
+    c_len = [run_end[r] - run_start[r] + 1 for r in counted]
+    c_sum = [0]
+    for length in c_len:
+        c_sum.append(c_sum[-1] + length)
+
+    statuses, totals, longests = [], [], []
+    lo = hi = 0          # sisäiset lasketut jaksot: indeksit [lo, hi)
+    window_max = deque() # monotoninen jono (indeksit, pituudet laskevat)
+
+    for ws in range(len(work_slots)):
+        we = ws + pad
+
+        while lo < len(c_start) and c_start[lo] <= ws:
+            lo += 1
+        while hi < len(c_end) and c_end[hi] < we:
+            while window_max and c_len[window_max[-1]] <= c_len[hi]:
+                window_max.pop()
+            window_max.append(hi)
+            hi += 1
+        while window_max and window_max[0] < lo:
+            window_max.popleft()
+
+        lead = min(run_end[run_of[ws]], we) - ws + 1 if rest[ws] else 0
+        if lead == SLOTS_PER_DAY:
+            total = longest = SLOTS_PER_DAY
+        else:
+            trail = we - run_start[run_of[we]] + 1 if rest[we] else 0
+            lead_c = lead if lead >= 2 else 0
+            trail_c = trail if trail >= 2 else 0
+            inner = max(0, hi - lo)
+
+            total = lead_c + trail_c + (c_sum[hi] - c_sum[lo] if inner else 0)
+            longest = max(lead_c, trail_c, c_len[window_max[0]] if inner else 0)
+
+            # Reunojen yhdistäminen kuten analyze_stcw_window
+            if lead and trail and inner + (lead_c > 0) + (trail_c > 0) >= 2:
+                first = lead_c or c_len[lo]
+                last = trail_c or c_len[hi - 1]
+                longest = max(longest, first + last)
+
+        total_rest = total / 2
+        longest_rest = longest / 2
+        statuses.append(_status(total_rest, longest_rest, min_longest_rest_hours))
+        totals.append(total_rest)
+        longests.append(longest_rest)
+
+    return {
+        'status': statuses,
+        'total_rest': totals,
+        'longest_rest': longests,
+    }
+
+
+# ============================================================================
+# LEPOPROFIILI
+# ============================================================================
+
+class RestProfile:
+    """
+    Päivän (tai peräkkäisten päivien) lepojaksot ilman raakoja slotteja.
+
+    Profiili tallentaa kaikki lepojaksot (alku, pituus) slotteina, myös
+    yhden slotin jaksot, koska ikkunan reunan lepo vaikuttaa
+    yhdistämissääntöön. Profiilit yhdistetään päivien yli (compose / +),
+    ja liukuvat 24h ikkunat lasketaan suoraan jaksoista samoilla
+    säännöillä kuin analyze_stcw_window.
+    """
+
+    __slots__ = ('length', 'runs', '_starts')
+
+    def __init__(self, length, runs):
+        self.length = length
+        self.runs = tuple(runs)
+        self._starts = [start for start, _ in self.runs]
+
+    @classmethod
+    def from_slots(cls, work_slots):
+        """Profiili työslottilistasta (True = työ)."""
+        runs = []
+        start = None
+        for i, w in enumerate(work_slots):
+            if not w and start is None:
+                start = i
+            elif w and start is not None:
+                runs.append((start, i - start))
+                start = None
+        if start is not None:
+            runs.append((start, len(work_slots) - start))
+        return cls(len(work_slots), runs)
+
+    @classmethod
+    def from_bits(cls, work_bits, length=SLOTS_PER_DAY):
+        """Profiili pakatusta työbittimaskista."""
+        runs = []
+        rest = ~work_bits & ((1 << length) - 1)
+        while rest:
+            start = (rest & -rest).bit_length() - 1
+            run = _trailing_ones(rest >> start)
+            runs.append((start, run))
+            rest &= ~(((1 << run) - 1) << start)
+        return cls(length, runs)
+
+    def __repr__(self):
+        return f"RestProfile(length={self.length}, runs={self.runs!r})"
+
+    def __eq__(self, other):
+        if not isinstance(other, RestProfile):
+            return NotImplemented
+        return self.length == other.length and self.runs == other.runs
+
+    def __hash__(self):
+        return hash((self.length, self.runs))
+
+    # --- Yhteenvedot -------------------------------------------------------
+
+    @property
+    def leading_rest(self):
+        """Lepo päivän alussa (h)."""
+        if self.runs and self.runs[0][0] == 0:
+            return self.runs[0][1] / 2
+        return 0
+
+    @property
+    def trailing_rest(self):
+        """Lepo päivän lopussa (h)."""
+        if self.runs and sum(self.runs[-1]) == self.length:
+            return self.runs[-1][1] / 2
+        return 0
+
+    @property
+    def internal_runs(self):
+        """Työjaksojen väliset lepojaksot (alku, pituus) slotteina."""
+        return tuple(
+            (start, run) for start, run in self.runs
+            if start > 0 and start + run < self.length
+        )
+
+    @property
+    def rest_periods(self):
+        """Väliset lepojaksot (h), vain vähintään 1h jaksot."""
+        return [run / 2 for _, run in self.internal_runs if run >= 2]
+
+    @property
+    def work_hours(self):
+        return (self.length - sum(run for _, run in self.runs)) / 2
+
+    @property
+    def first_work_slot(self):
+        """Ensimmäinen työslotti (-1 jos ei töitä)."""
+        if self.work_hours == 0:
+            return -1
+        return self.runs[0][1] if self.runs and self.runs[0][0] == 0 else 0
+
+    @property
+    def last_work_slot(self):
+        """Viimeinen työslotti (-1 jos ei töitä)."""
+        if self.work_hours == 0:
+            return -1
+        return self.length - 1 - int(self.trailing_rest * 2)
+
+    # --- Yhdistäminen ------------------------------------------------------
+
+    def compose(self, other):
+        """Yhdistää profiilin ja sitä seuraavan profiilin (rajan lepo liitetään)."""
+        runs = list(self.runs)
+        other_runs = [(start + self.length, run) for start, run in other.runs]
+        if runs and other_runs and sum(runs[-1]) == other_runs[0][0]:
+            runs[-1] = (runs[-1][0], runs[-1][1] + other_runs[0][1])
+            other_runs = other_runs[1:]
+        return RestProfile(self.length + other.length, runs + other_runs)
+
+    __add__ = compose
+
+    # --- Ikkunat -----------------------------------------------------------
+
+    def _window_periods(self, start, width=SLOTS_PER_DAY):
+        """Ikkunan [start, start+width) lasketut jaksot slotteina ja reunojen lepo."""
+        end = start + width - 1
+        i = max(0, bisect_right(self._starts, start) - 1)
+        periods = []
+        first_rest = last_rest = False
+        for run_start, run in self.runs[i:]:
+            if run_start > end:
+                break
+            run_end = run_start + run - 1
+            if run_end < start:
+                continue
+            if run_start <= start:
+                first_rest = True
+            if run_end >= end:
+                last_rest = True
+            clipped = min(run_end, end) - max(run_start, start) + 1
+            if clipped >= 2:
+                periods.append(clipped)
+        return periods, first_rest, last_rest
+
+    def window_analysis(self, start, width=SLOTS_PER_DAY):
+        """
+        Analysoi ikkunan joka alkaa slotista start (kuten analyze_stcw_window).
+
+        Returns:
+            Dict: total_rest, longest_rest, rest_periods
+        """
+        periods, first_rest, last_rest = self._window_periods(start, width)
+        rest_periods = [run / 2 for run in periods]
+        if len(rest_periods) >= 2 and width == SLOTS_PER_DAY and first_rest and last_rest:
+            combined = rest_periods[-1] + rest_periods[0]
+            rest_periods = [combined] + rest_periods[1:-1]
+        return {
+            'total_rest': sum(rest_periods),
+            'longest_rest': max(rest_periods) if rest_periods else 0,
+            'rest_periods': rest_periods
+        }
+
+    def check_sliding(self, min_longest_rest_hours=6):
+        """
+        check_stcw_sliding kahden päivän (96 slotin) profiilille.
+
+        Returns:
+            (ok, worst_slot, worst_analysis) kuten check_stcw_sliding
+        """
+        worst_slot = None
+        worst_total = None
+        for start in range(SLOTS_PER_DAY):
+            periods, first_rest, last_rest = self._window_periods(start)
+            total = sum(periods)
+            longest = max(periods) if periods else 0
+            if len(periods) >= 2 and first_rest and last_rest:
+                longest = max(longest, periods[0] + periods[-1])
+            if total < MIN_TOTAL_REST_SLOTS or longest / 2 < min_longest_rest_hours:
+                if worst_slot is None or total < worst_total:
+                    worst_slot = start
+                    worst_total = total
+
+        if worst_slot is None:
+            return True, None, None
+        return False, worst_slot, self.window_analysis(worst_slot)
+
+
+def compose_profiles(profiles):
+    """Yhdistää peräkkäisten päivien profiilit yhdeksi."""
+    profiles = list(profiles)
+    if not profiles:
+        return RestProfile(0, [])
+    result = profiles[0]
+    for profile in profiles[1:]:
+        result = result.compose(profile)
+    return result
+
+
+def check_stcw_profiles(prev_profile, current_profile, min_longest_rest_hours=6):
+    """check_stcw_sliding kahden päivän profiileista."""
+    return prev_profile.compose(current_profile).check_sliding(min_longest_rest_hours)
+
+
+# ============================================================================
+# ETEENPÄIN-TARKISTUS
+# ============================================================================
+
+# ForwardModel-taulukoiden enimmäiskoko (head ja tail kumpikin, LRU)
+FORWARD_TABLE_SIZE = 4096
+
+
+class ForwardModel:
+    """
+    Koottu tarkistus nykyinen päivä -> oletettu seuraava päivä.
+
+    Seuraava päivä on kiinteä, joten ikkunat jakautuvat kahteen osaan:
+    - ikkunat 0..f (f = seuraavan päivän ensimmäinen työslotti) näkevät
+      seuraavasta päivästä vain lepoa, joten ne riippuvat vain nykyisestä
+      päivästä (sama kuin tarkistus tyhjää seuraavaa päivää vasten)
+    - ikkunat f+1..47 näkevät nykyisestä päivästä vain slotit f+1..47,
+      joten niiden tulos riippuu vain päivän lopusta (häntä)
+
+    Molemmat osat taulukoidaan laiskasti, joten toistuvat tarkistukset
+    ovat hakuja. Seuraavan päivän sisältö ei vaikuta hakujen hintaan.
+    Taulukot ovat LRU-rajattuja (maxsize kumpikin), koska mallit jaetaan
+    koko prosessissa ja päiväsignatuurien määrä kasvaa haun mukana.
+    """
+
+    __slots__ = ('next_bits', 'min_longest_rest_hours', 'split', 'maxsize',
+                 '_head_mask', '_head', '_tail')
+
+    def __init__(self, next_bits, min_longest_rest_hours=6, maxsize=FORWARD_TABLE_SIZE):
+        if maxsize < 1:
+            raise ValueError(f"Taulukon koon on oltava vähintään 1: {maxsize}")
+        self.next_bits = next_bits
+        self.min_longest_rest_hours = min_longest_rest_hours
+        self.maxsize = maxsize
+        first_work = (next_bits & -next_bits).bit_length() - 1 if next_bits else SLOTS_PER_DAY
+        self.split = min(first_work + 1, SLOTS_PER_DAY)
+        self._head_mask = (1 << self.split) - 1
+        self._head = OrderedDict()
+        self._tail = OrderedDict()
+
+    def _store(self, table, key, ok):
+        table[key] = ok
+        if len(table) > self.maxsize:
+            table.popitem(last=False)
+
+    def tail_ok(self, current_bits):
+        """Ovatko seuraavan päivän työtä näkevät ikkunat kunnossa."""
+        key = current_bits >> self.split
+        ok = self._tail.get(key)
+        if ok is None:
+            violations = stcw_violation_mask(current_bits, self.next_bits, self.min_longest_rest_hours)
+            ok = not violations >> self.split
+            self._store(self._tail, key, ok)
+        else:
+            self._tail.move_to_end(key)
+        return ok
+
+    def head_ok(self, current_bits):
+        """Ovatko ikkunat 0..f kunnossa (seuraava päivä niissä lepoa)."""
+        ok = self._head.get(current_bits)
+        if ok is None:
+            violations = stcw_violation_mask(current_bits, 0, self.min_longest_rest_hours)
+            ok = not violations & self._head_mask
+            self._store(self._head, current_bits, ok)
+        else:
+            self._head.move_to_end(current_bits)
+        return ok
+
+    def ok(self, current_bits):
+        """Sama tulos kuin stcw_ok_bits(current_bits, next_bits)."""
+        return self.tail_ok(current_bits) and self.head_ok(current_bits)
+
+    def info(self):
+        """Taulukoiden koot: head (koko päivä) ja tail (häntäsignatuurit)."""
+        return {'head': len(self._head), 'tail': len(self._tail), 'split': self.split,
+                'maxsize': self.maxsize}
+
+
+# ============================================================================
+# INKREMENTAALINEN TILA
+# ============================================================================
+
+def _counted_rest(rest96):
+    """Lepo joka kuuluu vähintään 2 slotin jaksoon (koko 96 slotin jonossa)."""
+    return rest96 & ((rest96 << 1) | (rest96 >> 1))
+
+
+class StcwState:
+    """
+    Yhden työntekijän STCW-tila: edellinen päivä + nykyinen päivä.
+
+    Pitää kirjaa jokaisen 48 liukuvan ikkunan lepomäärästä ja rikkovista
+    ikkunoista. Nykyisen päivän slotin s muutos koskee vain ikkunoita
+    s+1..47, ja niistä sisäikkunoiden lepomäärä muuttuu saman vakion
+    verran (lasketaan slottien s-1..s+1 perusteella). Vain ikkunat joiden
+    reunalla s on lasketaan erikseen.
+
+    Kokeilu (can_set / can_clear) ei kopioi listaa eikä muuta tilaa;
+    sitä seuraava set / clear käyttää kokeilun tuloksen uudelleen.
+    """
+
+    __slots__ = ('prev_bits', 'bits', 'min_longest_rest_hours', '_min_slots',
+                 '_rest96', '_totals', '_violations', '_pending')
+
+    def __init__(self, prev_day_work=None, current_day_work=None, min_longest_rest_hours=6):
+        self.prev_bits = pack_slots(prev_day_work)
+        self.bits = pack_slots(current_day_work)
+        self.min_longest_rest_hours = min_longest_rest_hours
+        self._min_slots = _min_longest_slots(min_longest_rest_hours)
+        self._pending = None
+        self._rebuild()
+
+    def _rebuild(self):
+        """Laskee kaikkien ikkunoiden tilastot alusta."""
+        rest96 = ~(self.prev_bits | (self.bits << SLOTS_PER_DAY)) & TWO_DAY_MASK
+        self._rest96 = rest96
+        self._totals = [
+            window_total_slots((rest96 >> start) & DAY_MASK)
+            for start in range(SLOTS_PER_DAY)
+        ]
+        violations = _longest_rest_violations(rest96, self._min_slots)
+        for start, total in enumerate(self._totals):
+            if total < MIN_TOTAL_REST_SLOTS:
+                violations |= 1 << start
+        self._violations = violations
+
+    def reset(self, current_day_work):
+        """Synkronoi tilan listan kanssa (kun listaa on muutettu muualla)."""
+        self.bits = pack_slots(current_day_work)
+        self._pending = None
+        self._rebuild()
+
+    # ------------------------------------------------------------------
+    # Kyselyt
+    # ------------------------------------------------------------------
+
+    @property
+    def ok(self):
+        """True jos kaikki ikkunat täyttävät STCW:n."""
+        return not self._violations
+
+    @property
+    def violations(self):
+        """Rikkovat ikkunat bittimaskina (bitti s = ikkuna alkaa slotista s)."""
+        return self._violations
+
+    @property
+    def hours(self):
+        """Nykyisen päivän työtunnit."""
+        return self.bits.bit_count() / 2
+
+    def window_rest_hours(self, start):
+        """Ikkunan (alkaa edellisen päivän slotista start) lepo tunteina."""
+        return self._totals[start] / 2
+
+    def is_set(self, slot):
+        """Onko nykyisen päivän slotti työtä."""
+        return bool(self.bits >> slot & 1)
+
+    def work_slots(self):
+        """Nykyinen päivä bool-listana."""
+        return unpack_slots(self.bits)
+
+    def check(self):
+        """Sama tulos kuin check_stcw_sliding(prev, current)."""
+        return check_stcw_sliding_bits(self.prev_bits, self.bits, self.min_longest_rest_hours)
+
+    # ------------------------------------------------------------------
+    # Kokeilu ja muutos
+    # ------------------------------------------------------------------
+
+    def can_set(self, slot):
+        """Olisiko tila OK jos slotti merkitään työksi (vrt. check_stcw_ok)."""
+        return not self._trial(slot, True)[0]
+
+    def can_clear(self, slot):
+        """Olisiko tila OK jos slotti vapautetaan lepoon."""
+        return not self._trial(slot, False)[0]
+
+    def set(self, slot):
+        """Merkitsee slotin työksi."""
+        self._commit(slot, True)
+
+    def clear(self, slot):
+        """Vapauttaa slotin lepoon."""
+        self._commit(slot, False)
+
+    def _trial(self, slot, value):
+        """
+        Laskee muutoksen vaikutuksen vain ikkunoihin jotka sisältävät slotin.
+
+        Returns:
+            (violations, bits, delta, interior, edge_totals, longest_done)
+        """
+        pending = self._pending
+        if pending is not None and pending[0] == slot and pending[1] == value:
+            return pending[2]
+
+        bit = 1 << slot
+        if bool(self.bits & bit) == value:
+            result = (self._violations, self.bits, 0, None, (), True)
+            self._pending = (slot, value, result)
+            return result
+
+        new_bits = self.bits | bit if value else self.bits & ~bit
+        first = slot + 1          # ensimmäinen ikkuna joka sisältää slotin
+        if first >= SLOTS_PER_DAY:
+            # Päivän viimeinen slotti ei kuulu yhteenkään ikkunaan
+            result = (self._violations, new_bits, 0, None, (), True)
+            self._pending = (slot, value, result)
+            return result
+
+        pos = SLOTS_PER_DAY + slot
+        old_rest = self._rest96
+        new_rest = old_rest ^ (1 << pos)
+        totals = self._totals
+        total_violations = 0
+
+        # Sisäikkunoissa slotit pos-1..pos+1 naapureineen ovat ikkunan
+        # sisällä, joten lepomäärä muuttuu kaikissa saman verran
+        lo = first + 2
+        hi = min(SLOTS_PER_DAY - 1, pos - 2)
+        interior = None
+        delta = 0
+        if lo <= hi:
+            local = 0b111 << (pos - 1)
+            delta = (_counted_rest(new_rest) & local).bit_count() - (_counted_rest(old_rest) & local).bit_count()
+            interior = (lo, hi)
+            if min(totals[lo:hi + 1]) + delta < MIN_TOTAL_REST_SLOTS:
+                for start in range(lo, hi + 1):
+                    if totals[start] + delta < MIN_TOTAL_REST_SLOTS:
+                        total_violations |= 1 << start
+
+        # Ikkunat joiden reunalla slotti on lasketaan suoraan
+        edge_starts = [first, first + 1] if first + 1 < SLOTS_PER_DAY else [first]
+        if hi < SLOTS_PER_DAY - 1 and hi + 1 > first + 1:
+            edge_starts.extend(range(hi + 1, SLOTS_PER_DAY))
+        edge_totals = []
+        for start in edge_starts:
+            total = window_total_slots((new_rest >> start) & DAY_MASK)
+            edge_totals.append((start, total))
+            if total < MIN_TOTAL_REST_SLOTS:
+                total_violations |= 1 << start
+
+        affected = DAY_MASK & ~((1 << first) - 1)
+        violations = (self._violations & ~affected) | total_violations
+        if not violations:
+            violations = _longest_rest_violations(new_rest, self._min_slots, affected)
+            longest_done = True
+        else:
+            # Tulos on jo selvä; pisin lepo lasketaan vasta jos muutos tehdään
+            longest_done = False
+        result = (violations, new_bits, delta, interior, edge_totals, longest_done)
+        self._pending = (slot, value, result)
+        return result
+
+    def _commit(self, slot, value):
+        violations, new_bits, delta, interior, edge_totals, longest_done = self._trial(slot, value)
+        self._pending = None
+        if new_bits == self.bits:
+            return
+        self.bits = new_bits
+        self._rest96 = ~(self.prev_bits | (new_bits << SLOTS_PER_DAY)) & TWO_DAY_MASK
+        if not longest_done:
+            affected = DAY_MASK & ~((1 << (slot + 1)) - 1)
+            violations |= _longest_rest_violations(self._rest96, self._min_slots, affected)
+        self._violations = violations
+        totals = self._totals
+        if delta:
+            lo, hi = interior
+            totals[lo:hi + 1] = [total + delta for total in totals[lo:hi + 1]]
+        for start, total in edge_totals:
+            totals[start] = total
+
+
+# ============================================================================
+# VERDIKTIVÄLIMUISTI
+# ============================================================================
+
+DEFAULT_CACHE_SIZE = 32768
+
+
+def _copy_result(result):
+    """Kopioi (ok, worst_slot, analysis) -tuloksen, jottei välimuistia muuteta."""
+    ok, worst_slot, analysis = result
+    if analysis is None:
+        return result
+    return ok, worst_slot, dict(analysis, rest_periods=list(analysis['rest_periods']))
+
+
+class StcwVerdictCache:
+    """
+    Rajattu LRU-välimuisti STCW-tarkistuksille.
+
+    Avain on (edellinen päivä, nykyinen päivä, pisimmän levon vaatimus)
+    pakattuina bitteinä, joten tulos riippuu vain avaimesta: sama
+    välimuisti on turvallinen jakaa päivien, generointien ja Streamlitin
+    uudelleenajojen kesken. Lukitus sallii käytön useasta säikeestä.
+
+    Arvona on [ok, täysi_tulos]; pelkkä ok-tarkistus tallentaa täyden
+    tuloksen vain kun se on triviaali (True, None, None).
+    """
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE):
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self._maxsize = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.resize(maxsize)
+
+    @property
+    def maxsize(self):
+        return self._maxsize
+
+    def resize(self, maxsize):
+        """Asettaa koon (0 = pois käytöstä) ja poistaa ylimääräiset vanhimmat."""
+        if maxsize < 0:
+            raise ValueError(f"Välimuistin koko ei voi olla negatiivinen: {maxsize}")
+        with self._lock:
+            self._maxsize = maxsize
+            self._evict()
+
+    def clear(self):
+        """Tyhjentää välimuistin ja nollaa tilastot."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def info(self):
+        """Palauttaa tilastot: hits, misses, evictions, size, maxsize."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'maxsize': self._maxsize,
+            }
+
+    def _evict(self):
+        while len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def _store(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        self._evict()
+
+    def ok(self, prev_bits, current_bits, min_longest_rest_hours=6):
+        """Välimuistitettu stcw_ok_bits."""
+        if not self._maxsize:
+            return stcw_ok_bits(prev_bits, current_bits, min_longest_rest_hours)
+
+        key = (prev_bits, current_bits, min_longest_rest_hours)
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None:
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        ok = stcw_ok_bits(prev_bits, current_bits, min_longest_rest_hours)
+        with self._lock:
+            if key not in self._entries:
+                self._store(key, [ok, (True, None, None) if ok else None])
+        return ok
+
+    def sliding(self, prev_bits, current_bits, min_longest_rest_hours=6):
+        """Välimuistitettu check_stcw_sliding_bits (palauttaa kopion)."""
+        if not self._maxsize:
+            return check_stcw_sliding_bits(prev_bits, current_bits, min_longest_rest_hours)
+
+        key = (prev_bits, current_bits, min_longest_rest_hours)
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None and entry[1] is not None:
+                self.hits += 1
+                return _copy_result(entry[1])
+            self.misses += 1
+
+        result = check_stcw_sliding_bits(prev_bits, current_bits, min_longest_rest_hours)
+        with self._lock:
+            self._store(key, [result[0], result])
+        return _copy_result(result)
@@ -1,12 +1,43 @@
 
 
 import pytest
+import io
 from io import BytesIO
 from openpyxl import load_workbook
+import copy
+import json
+import pickle
+import random
+
+import sea_watch_17
+from stcw_engine import (
+    ForwardModel,
+    RestProfile,
+    StcwState,
+    StcwVerdictCache,
+    check_stcw_profiles,
+    compose_profiles,
+    pack_slots,
+    stcw_ok_bits,
+    stcw_violation_mask,
+    work_gaps,
+)
+from day_schedule import DaySchedule
+from voyage_schedule import NUMPY_AVAILABLE, VoyageSchedule
+from schedule_analyzer import (
+    stcw_verdict_from_timeline,
+    find_stcw_violation_periods,
+    find_profile_gaps,
+    find_work_gaps,
+)
 from sea_watch_17 import (
     generate_schedule,
     check_stcw_at_slot,
+    check_stcw_ok,
+    check_stcw_sliding,
     rebalance_dayman_hours,
+    set_stcw_backend,
+    check_stcw_timeline,
     time_to_slot,
     slot_to_time_str,
 )
@@ -111,6 +142,35 @@ def run_scenario(arrival_hour, departure_hour, op_start_hour, op_end_hour,
     return all_days
 
 
+def make_voyage(num_days, changes=None):
+    """Matkan päivät: satama-operaatio 08-17 joka päivä, changes = {päivä: muutetut kentät}"""
+    days_data = [
+        {
+            'arrival_hour': None,
+            'arrival_minute': 0,
+            'departure_hour': None,
+            'departure_minute': 0,
+            'port_op_start_hour': 8,
+            'port_op_start_minute': 0,
+            'port_op_end_hour': 17,
+            'port_op_end_minute': 0
+        }
+        for _ in range(num_days)
+    ]
+    for day_idx, fields in (changes or {}).items():
+        days_data[day_idx].update(fields)
+    return days_data
+
+
+def night_and_sluice_voyage(num_days=6, sluice_arrival_hour=22):
+    """Jatkuva yö päivältä 2 päivälle 3 ja slussitulo päivänä 4"""
+    return make_voyage(num_days, {
+        1: {'port_op_start_hour': 10, 'port_op_end_hour': 0},
+        2: {'port_op_start_hour': 0, 'port_op_end_hour': 20},
+        3: {'sluice_arrival_hour': sluice_arrival_hour},
+    })
+
+
 
 # TESTIT: DAYMANIT TULOSSA JA LÄHDÖSSÄ
 # ---------------------------------------------------------------------
@@ -727,3 +787,1282 @@ class TestHourRebalancing:
         for slot in range(16, 36):
             assert any(dm_work[dm][slot] and dm_ops[dm][slot] for dm in daymen), \
                 f"Op-kattavuus puuttuu slotissa {slot}"
+
+    def test_transfer_queue_offers_earliest_legal_slot_and_updates_after_move(self):
+        daymen = ['Dayman EU', 'Dayman PH1']
+        work = {
+            'Dayman EU': [16 <= s < 36 for s in range(48)],
+            'Dayman PH1': [20 <= s < 32 for s in range(48)],
+        }
+        states = sea_watch_17.build_stcw_states(
+            work, {dm: [False] * 48 for dm in daymen}, daymen)
+        markers = {'Dayman EU': 1 << 16, 'Dayman PH1': 0}
+        queue = sea_watch_17.TransferQueue(states, markers, daymen, range(16, 34))
+
+        # Slotti 16 on pakollinen, 17 hylätään mutta jää jonoon
+        assert queue.pop_legal('Dayman EU', 'Dayman PH1', lambda s: s != 17) == 18
+        assert queue.pop_legal('Dayman EU', 'Dayman PH1', lambda s: True) == 17
+
+        # Siirron jälkeen PH1 voi antaa slotin 17 takaisin
+        states['Dayman EU'].clear(17)
+        states['Dayman PH1'].set(17)
+        queue.moved('Dayman EU', 'Dayman PH1', 17)
+        assert queue.pop_legal('Dayman PH1', 'Dayman EU', lambda s: True) == 17
+
+
+class TestStcwRepair:
+    """fix_stcw_violations: työlista tarkistaa uudelleen vain muuttuneet daymanit."""
+
+    DAYMEN = ['Dayman EU', 'Dayman PH1']
+
+    def _repair(self, eu_work, mandatory=()):
+        empty = lambda: {dm: [False] * 48 for dm in self.DAYMEN}
+        dm_work = empty()
+        dm_work['Dayman EU'] = list(eu_work)
+        dm_arr = empty()
+        for s in mandatory:
+            dm_arr['Dayman EU'][s] = True
+        prev_day_work = {'Dayman EU': [s >= 38 for s in range(48)],
+                         'Dayman PH1': [False] * 48}
+        times = sea_watch_17.parse_day_times({'arrivals': [], 'departures': [],
+                                              'port_operations': []})
+        stats = sea_watch_17.fix_stcw_violations(
+            dm_work, empty(), dm_arr, empty(), empty(), empty(),
+            self.DAYMEN, 1, times, [], prev_day_work)
+        return dm_work, stats
+
+    @pytest.mark.stcw_rest
+    def test_violation_is_repaired_by_moving_morning_slots(self):
+        dm_work, stats = self._repair([16 <= s < 34 for s in range(48)])
+        ok, _, _ = check_stcw_sliding([s >= 38 for s in range(48)], dm_work['Dayman EU'])
+        assert ok
+        assert stats['moves'] > 0
+        assert stats['unresolved'] == []
+        assert any(dm_work['Dayman PH1'])
+
+    @pytest.mark.stcw_rest
+    def test_unfixable_violation_is_examined_once(self):
+        eu_work = [16 <= s < 34 for s in range(48)]
+        dm_work, stats = self._repair(eu_work, mandatory=range(16, 34))
+        assert dm_work['Dayman EU'] == eu_work
+        assert stats['moves'] == 0
+        assert stats['unresolved'] == ['Dayman EU']
+        # Ei toistuvia kierroksia: kumpikin dayman käsitellään kerran
+        assert stats['iterations'] == len(self.DAYMEN)
+
+    @pytest.mark.stcw_rest
+    def test_tie_goes_to_the_receiver_with_fewest_hours(self):
+        daymen = ['Dayman EU', 'Dayman PH1', 'Dayman PH2']
+        empty = lambda: {dm: [False] * 48 for dm in daymen}
+        dm_work = {
+            'Dayman EU': [16 <= s < 34 for s in range(48)],
+            'Dayman PH1': [24 <= s < 42 for s in range(48)],   # 9 h
+            'Dayman PH2': [24 <= s < 36 for s in range(48)],   # 6 h
+        }
+        prev_day_work = empty()
+        prev_day_work['Dayman EU'] = [s >= 38 for s in range(48)]
+        times = sea_watch_17.parse_day_times({'arrivals': [], 'departures': [],
+                                              'port_operations': []})
+        stats = sea_watch_17.fix_stcw_violations(
+            dm_work, empty(), empty(), empty(), empty(), empty(),
+            daymen, 1, times, [], prev_day_work)
+        assert stats['moves'] == 1 and stats['unresolved'] == []
+        # Kumpikin vastaanottaja käy STCW:n puolesta; vähiten tunteja tehnyt saa slotin
+        assert sum(dm_work['Dayman PH2']) == 13
+        assert sum(dm_work['Dayman PH1']) == 18
+
+
+class TestWorkGaps:
+    """work_gaps: työjaksojen väliset aukot yhdellä läpikäynnillä."""
+
+    def test_gaps_are_bounded_by_work_and_skip_bits_are_not_filled(self):
+        work = [s in (2, 3, 8, 9, 20, 30) for s in range(48)]
+        lunch = (1 << 23)
+        gaps = work_gaps(pack_slots(work), lunch)
+        assert [(start, end) for start, end, _ in gaps] == [(4, 8), (10, 20), (21, 30)]
+        assert gaps[2][2] == sum(1 << s for s in range(21, 30) if s != 23)
+
+    @pytest.mark.daily_hours
+    def test_fill_small_gaps_skips_lunch_and_counts_gap_without_it(self):
+        work = {'Dayman EU': [16 <= s < 20 or 26 <= s < 34 for s in range(48)]}
+        ops = {'Dayman EU': [False] * 48}
+        times = sea_watch_17.parse_day_times({'arrivals': [], 'departures': [],
+                                              'port_operations': []})
+        # Aukko 20-26 on 6 slottia, ilman lounasta 5: ei täytetä
+        sea_watch_17.fill_small_gaps(work, ops, ['Dayman EU'], times)
+        assert not any(work['Dayman EU'][20:26])
+
+        work['Dayman EU'][20] = True
+        sea_watch_17.fill_small_gaps(work, ops, ['Dayman EU'], times)
+        assert work['Dayman EU'][16:34] == [s != 23 for s in range(16, 34)]
+        assert find_work_gaps(work['Dayman EU']) == []
+
+
+def random_block_day(rng, density=0.5):
+    """Satunnainen 48 slotin päivä vuorottelevista työ- ja lepoblokeista."""
+    day = []
+    working = rng.random() < density
+    while len(day) < 48:
+        day.extend([working] * rng.randint(1, 10))
+        working = not working
+    return day[:48]
+
+
+class TestStcwBitmaskBackend:
+    """Bittimaskipohjainen STCW-laskenta antaa samat tulokset kuin listatoteutus."""
+
+    def _with_backend(self, backend, func, *args):
+        previous = set_stcw_backend(backend)
+        try:
+            return func(*args)
+        finally:
+            set_stcw_backend(previous)
+
+    def test_default_backend_is_bitmask(self):
+        assert sea_watch_17.STCW_BACKEND == 'bitmask'
+
+    def test_unknown_backend_raises(self):
+        with pytest.raises(ValueError):
+            set_stcw_backend('numpy-magic')
+
+    @pytest.mark.stcw_status
+    def test_random_days_match_python_backend(self):
+        rng = random.Random(17)
+        for _ in range(500):
+            prev = random_block_day(rng, rng.random())
+            curr = random_block_day(rng, rng.random())
+            min_rest = rng.choice([1, 5.5, 6, 8])
+            end_slot = rng.randint(0, 95)
+
+            for func, args in [
+                (check_stcw_sliding, (prev, curr, min_rest)),
+                (check_stcw_ok, (curr, prev, min_rest)),
+                (check_stcw_at_slot, (prev + curr, end_slot, min_rest)),
+            ]:
+                expected = self._with_backend('python', func, *args)
+                actual = self._with_backend('bitmask', func, *args)
+                assert actual == expected, f"{func.__name__}{args}"
+
+    @pytest.mark.stcw_split
+    def test_wraparound_rest_merge_matches(self):
+        """Ikkunan alun ja lopun lepojaksot yhdistetään kuten listatoteutuksessa."""
+        prev = [False] * 48
+        curr = [False] * 48
+        for slot in range(4, 44):
+            prev[slot] = True
+        for slot in range(10, 20):
+            curr[slot] = True
+
+        expected = self._with_backend('python', check_stcw_sliding, prev, curr, 6)
+        actual = self._with_backend('bitmask', check_stcw_sliding, prev, curr, 6)
+        assert actual == expected
+
+
+class TestStcwState:
+    """Inkrementaalinen STCW-tila vastaa täyttä tarkistusta jokaisen muutoksen jälkeen."""
+
+    @pytest.mark.stcw_status
+    def test_trial_matches_full_check(self):
+        rng = random.Random(2)
+        for _ in range(150):
+            prev = random_block_day(rng, rng.random())
+            curr = random_block_day(rng, rng.random())
+            min_rest = rng.choice([1, 6, 8])
+            state = StcwState(prev, curr, min_rest)
+
+            for _ in range(10):
+                slot = rng.randrange(48)
+                test_work = curr[:]
+                test_work[slot] = not test_work[slot]
+                expected = check_stcw_ok(test_work, prev, min_rest)
+                if curr[slot]:
+                    assert state.can_clear(slot) == expected
+                    state.clear(slot)
+                else:
+                    assert state.can_set(slot) == expected
+                    state.set(slot)
+                curr = test_work
+                assert state.ok == check_stcw_ok(curr, prev, min_rest)
+
+            assert state.work_slots() == curr
+            assert state.violations == StcwState(prev, curr, min_rest).violations
+
+
+class TestStcwVerdictCache:
+    """LRU-välimuisti palauttaa samat tulokset ja raportoi tilastot."""
+
+    def test_hits_misses_and_evictions(self):
+        cache = StcwVerdictCache(maxsize=2)
+        cache.ok(0, 0, 6)
+        cache.ok(0, 0, 6)
+        cache.ok(0, 1, 6)
+        cache.ok(0, 3, 6)
+        cache.ok(0, 0, 6)
+
+        info = cache.info()
+        assert (info['hits'], info['misses'], info['evictions']) == (1, 4, 2)
+        assert info['size'] == 2
+
+        cache.resize(1)
+        assert cache.info()['size'] == 1
+        with pytest.raises(ValueError):
+            cache.resize(-1)
+
+    @pytest.mark.stcw_status
+    def test_cached_results_match_and_are_copies(self):
+        rng = random.Random(3)
+        previous = sea_watch_17.set_stcw_cache_size(64)
+        try:
+            for _ in range(200):
+                prev = random_block_day(rng, rng.random())
+                curr = random_block_day(rng, rng.random())
+                for _ in range(2):
+                    assert check_stcw_ok(curr, prev, 6) == self._python(check_stcw_ok, curr, prev, 6)
+                    result = check_stcw_sliding(prev, curr, 6)
+                    assert result == self._python(check_stcw_sliding, prev, curr, 6)
+                    if result[2] is not None:
+                        result[2]['rest_periods'].append(99)
+            assert sea_watch_17.stcw_cache_info()['hits'] > 0
+        finally:
+            sea_watch_17.set_stcw_cache_size(previous)
+
+    def _python(self, func, *args):
+        previous = set_stcw_backend('python')
+        try:
+            return func(*args)
+        finally:
+            set_stcw_backend(previous)
+
+
+class TestStcwTimeline:
+    """Koko matkan aikajana vastaa slottikohtaista ja päiväparikohtaista tarkistusta."""
+
+    @pytest.mark.stcw_status
+    def test_timeline_matches_check_at_slot(self):
+        rng = random.Random(5)
+        previous = set_stcw_backend('python')
+        try:
+            for _ in range(40):
+                work = []
+                for _ in range(rng.randint(1, 4)):
+                    work += random_block_day(rng, rng.random())
+                min_rest = rng.choice([1, 6, 8])
+
+                timeline = self._bitmask_timeline(work, min_rest)
+                for slot in range(len(work)):
+                    expected = check_stcw_at_slot(work, slot, min_rest)
+                    for key in ('status', 'total_rest', 'longest_rest'):
+                        assert timeline[key][slot] == expected[key], (slot, key)
+        finally:
+            set_stcw_backend(previous)
+
+    @pytest.mark.stcw_status
+    def test_day_verdicts_match_sliding_check(self):
+        rng = random.Random(6)
+        for _ in range(40):
+            days = [random_block_day(rng, rng.random()) for _ in range(rng.randint(2, 5))]
+            timeline = check_stcw_timeline(sum(days, []), 6)
+            for d in range(1, len(days)):
+                ok, worst, analysis = check_stcw_sliding(days[d - 1], days[d], 6)
+                t_ok, t_worst, t_analysis = stcw_verdict_from_timeline(timeline, d)
+                assert (t_ok, t_worst) == (ok, worst)
+                if not ok:
+                    assert t_analysis['total_rest'] == analysis['total_rest']
+                    assert t_analysis['longest_rest'] == analysis['longest_rest']
+
+    def test_violation_periods_group_consecutive_slots(self):
+        # Kaksi päivää: toisen päivän 16h työ aiheuttaa yhtenäisen rikejakson
+        work = [False] * 48 + [False] * 8 + [True] * 32 + [False] * 8
+        periods = find_stcw_violation_periods(check_stcw_timeline(work, 6))
+        assert len(periods) == 1
+        assert periods[0]['status'] == "TOTAL_REST_VIOLATION"
+        assert periods[0]['start_slot'] <= periods[0]['end_slot']
+
+    def _bitmask_timeline(self, work, min_rest):
+        previous = set_stcw_backend('bitmask')
+        try:
+            return check_stcw_timeline(work, min_rest)
+        finally:
+            set_stcw_backend(previous)
+
+
+class TestEarliestStartTable:
+    """Muistitaulukko antaa saman aloitusslotin kuin suora simulointi."""
+
+    @pytest.mark.stcw_rest
+    def test_table_matches_simulation(self):
+        rng = random.Random(7)
+        sea_watch_17.clear_earliest_start_table()
+        for _ in range(300):
+            prev = random_block_day(rng, rng.random())
+            min_hours = rng.choice([7.5, 8, 10])
+            min_rest = rng.choice([6, 8])
+
+            previous = set_stcw_backend('python')
+            try:
+                expected = sea_watch_17.find_earliest_valid_start(prev, min_hours, min_rest)
+            finally:
+                set_stcw_backend(previous)
+            assert sea_watch_17.find_earliest_valid_start(prev, min_hours, min_rest) == expected
+            # Toinen haku tulee taulukosta
+            assert sea_watch_17.find_earliest_valid_start(prev, min_hours, min_rest) == expected
+
+    def test_warm_up_fills_single_block_days(self):
+        sea_watch_17.clear_earliest_start_table()
+        size = sea_watch_17.warm_earliest_start_table()
+        assert size == 48 * 49 // 2
+
+        # Iltavuoro 18-24 edellisenä päivänä: taulukosta tulee kelvollinen aloitus
+        prev = [slot >= 36 for slot in range(48)]
+        assert sea_watch_17.find_earliest_valid_start(prev) >= sea_watch_17.NORMAL_START
+
+
+class TestStcwFeasibilityMatrix:
+    """Eräkokeilu vastaa would_cause_stcw_violation-kutsuja jokaiselle parille."""
+
+    @pytest.mark.stcw_status
+    def test_matrix_matches_single_calls(self):
+        rng = random.Random(8)
+        workers = ['Dayman EU', 'Dayman PH1', 'Dayman PH2']
+        for _ in range(60):
+            dm_work = {w: random_block_day(rng, rng.random() * 0.6) for w in workers}
+            prev_work = {w: random_block_day(rng, rng.random() * 0.6) for w in workers}
+            groups = []
+            for _ in range(4):
+                start = rng.randint(0, 50)
+                groups.append(list(range(start, start + rng.randint(1, 6))))
+
+            matrix = sea_watch_17.stcw_feasibility_matrix(workers, groups, dm_work, prev_work, 6)
+
+            previous = set_stcw_backend('python')
+            try:
+                for w in workers:
+                    expected = [
+                        not sea_watch_17.would_cause_stcw_violation(w, g, dm_work, prev_work, 6)
+                        for g in groups
+                    ]
+                    assert matrix[w] == expected
+            finally:
+                set_stcw_backend(previous)
+
+
+class TestForwardModel:
+    """Koottu eteenpäin-tarkistus vastaa suoraa tarkistusta oletettua päivää vasten."""
+
+    @pytest.mark.stcw_status
+    def test_model_matches_direct_check(self):
+        rng = random.Random(10)
+        for _ in range(100):
+            next_bits = pack_slots(random_block_day(rng, rng.random() * 0.5))
+            min_rest = rng.choice([1, 6, 8])
+            model = ForwardModel(next_bits, min_rest)
+            for _ in range(20):
+                current = pack_slots(random_block_day(rng, rng.random()))
+                assert model.ok(current) == stcw_ok_bits(current, next_bits, min_rest)
+
+    def test_tables_are_lru_bounded(self):
+        rng = random.Random(12)
+        next_bits = pack_slots(sea_watch_17.assumed_next_day())
+        model = ForwardModel(next_bits, maxsize=8)
+        for _ in range(200):
+            current = pack_slots(random_block_day(rng, rng.random()))
+            assert model.ok(current) == stcw_ok_bits(current, next_bits)
+        info = model.info()
+        assert info['head'] <= 8 and info['tail'] <= 8 and info['maxsize'] == 8
+        with pytest.raises(ValueError):
+            ForwardModel(next_bits, maxsize=0)
+
+    def test_assumed_next_day_uses_known_events(self):
+        default = sea_watch_17.assumed_next_day()
+        assert sum(default) == 17
+        assert not default[sea_watch_17.LUNCH_START]
+
+        # Tulo klo 06:00 -> 05:00-06:00 on kaikille daymaneille työtä
+        with_arrival = sea_watch_17.assumed_next_day({'arrival_hour': 6, 'arrival_minute': 0})
+        assert with_arrival[time_to_slot(5, 0)] and with_arrival[time_to_slot(5, 30)]
+        assert not default[time_to_slot(5, 0)]
+
+    @pytest.mark.stcw_status
+    def test_would_cause_with_real_next_day_matches_python(self):
+        rng = random.Random(11)
+        next_day = sea_watch_17.assumed_next_day({'arrival_hour': 3, 'arrival_minute': 0})
+        for _ in range(100):
+            work = random_block_day(rng, rng.random() * 0.6)
+            prev = random_block_day(rng, rng.random() * 0.6)
+            start = rng.randint(30, 50)
+            slots = list(range(start, start + 5))
+
+            actual = sea_watch_17.would_cause_stcw_violation(None, slots, work, prev, 6, next_day)
+            previous = set_stcw_backend('python')
+            try:
+                expected = sea_watch_17.would_cause_stcw_violation(None, slots, work, prev, 6, next_day)
+            finally:
+                set_stcw_backend(previous)
+            assert actual == expected
+
+
+class TestRestProfile:
+    """Lepoprofiilien yhdistäminen vastaa slottitason tarkistuksia."""
+
+    @pytest.mark.stcw_status
+    def test_composed_profiles_match_sliding_check(self):
+        rng = random.Random(12)
+        previous = set_stcw_backend('python')
+        try:
+            for _ in range(300):
+                prev = random_block_day(rng, rng.random())
+                work = random_block_day(rng, rng.random())
+                min_rest = rng.choice([1, 6, 8])
+                prev_profile = RestProfile.from_slots(prev)
+                profile = RestProfile.from_bits(pack_slots(work))
+                assert profile == RestProfile.from_slots(work)
+                assert compose_profiles([prev_profile, profile]) == RestProfile.from_slots(prev + work)
+                assert (check_stcw_profiles(prev_profile, profile, min_rest)
+                        == check_stcw_sliding(prev, work, min_rest))
+        finally:
+            set_stcw_backend(previous)
+
+    def test_profile_summaries(self):
+        work = [False] * 48
+        for s in list(range(16, 23)) + list(range(24, 34)) + [40, 41]:
+            work[s] = True
+        profile = RestProfile.from_slots(work)
+        assert profile.leading_rest == 8
+        assert profile.trailing_rest == 3
+        assert profile.rest_periods == [3.0]
+        assert profile.first_work_slot == 16
+        assert profile.last_work_slot == 41
+        assert find_profile_gaps(profile) == find_work_gaps(work)
+
+    def test_continuous_night_workers_accept_profiles(self):
+        prev = {dm: [False] * 48 for dm in ['Dayman EU', 'Dayman PH1', 'Dayman PH2']}
+        prev['Dayman PH2'][46] = True
+        prev['Dayman EU'][40] = True
+        expected = sea_watch_17.choose_continuous_night_workers(prev)
+        profiles = sea_watch_17.build_rest_profiles(prev)
+        assert sea_watch_17.choose_continuous_night_workers(profiles) == expected
+        assert expected == ('Dayman PH2', 'Dayman PH1')
+
+
+class TestDaySchedule:
+    """Pakattu päivä toimii kuten vanha dict-of-lists."""
+
+    def test_dict_compatible_read_and_write(self):
+        work = [False] * 48
+        work[16:20] = [True] * 4
+        day = DaySchedule(work_slots=work)
+        assert day['work_slots'] == work
+        assert day.get('sluice_slots', None) == [False] * 48
+        assert sum(day['work_slots']) == 4
+        assert set(day.keys()) == set(day.to_dict().keys())
+
+        day['work_slots'][30] = True
+        assert day['work_slots'][30]
+        assert day.bits() == sea_watch_17.pack_slots(work) | (1 << 30)
+
+        day['arrival_slots'] = work
+        assert day == DaySchedule.from_dict(day.to_dict())
+
+    def test_copies_are_independent(self):
+        day = DaySchedule(work_slots=[True] * 48)
+        clone = copy.deepcopy({'Bosun': [day]})['Bosun'][0]
+        clone['work_slots'][0] = False
+        assert day['work_slots'][0] and not clone['work_slots'][0]
+        assert pickle.loads(pickle.dumps(day)) == day
+
+    def test_generator_output_roundtrips(self):
+        all_days = run_scenario(arrival_hour=8, departure_hour=19, op_start_hour=10, op_end_hour=18)
+        for worker, days in all_days.items():
+            for day in days:
+                assert isinstance(day, DaySchedule)
+                assert DaySchedule.from_dict(day.to_dict()) == day
+
+
+@pytest.mark.skipif(not NUMPY_AVAILABLE, reason="NumPy puuttuu")
+class TestVoyageSchedule:
+    """Matkataulukko vastaa all_days-rakennetta."""
+
+    def _voyage(self):
+        days_data = [
+            {'arrival_hour': 8, 'departure_hour': None, 'port_op_start_hour': 10, 'port_op_end_hour': 18},
+            {'arrival_hour': None, 'departure_hour': 19, 'port_op_start_hour': 8,
+             'port_op_end_hour': 17, 'sluice_departure_hour': 22},
+        ]
+        _, all_days, _ = generate_schedule(days_data)
+        return all_days, VoyageSchedule.from_all_days(all_days, sea_watch_17.WORKERS)
+
+    def test_views_match_and_write_through(self):
+        all_days, voyage = self._voyage()
+        for worker in sea_watch_17.WORKERS:
+            for d in range(2):
+                for field in ('work_slots', 'arrival_slots', 'sluice_slots'):
+                    assert voyage[worker][d][field].tolist() == list(all_days[worker][d][field])
+        assert voyage.to_all_days() == all_days
+
+        view = voyage['Bosun'][1]['work_slots']
+        view[0] = True
+        assert voyage.arrays['work_slots'][1, 0, 0]
+
+    def test_aggregates_match_loops(self):
+        all_days, voyage = self._voyage()
+        hours = voyage.hours()
+        coverage = voyage.coverage(workers=sea_watch_17.DAYMEN)
+        for d in range(2):
+            for w, worker in enumerate(sea_watch_17.WORKERS):
+                assert hours[d, w] == sum(all_days[worker][d]['work_slots']) / 2
+            for slot in range(48):
+                assert coverage[d, slot] == sum(
+                    all_days[dm][d]['work_slots'][slot] for dm in sea_watch_17.DAYMEN
+                )
+
+    def test_symbols_follow_priority(self):
+        all_days, voyage = self._voyage()
+        symbols = [('sluice_slots', 'SL'), ('arrival_slots', 'B'), ('work_slots', 'X')]
+        grid = voyage.symbols(1, symbols)
+        for w, worker in enumerate(sea_watch_17.WORKERS):
+            day = all_days[worker][1]
+            for slot in range(48):
+                expected = ''
+                for field, symbol in symbols:
+                    if day[field][slot]:
+                        expected = symbol
+                        break
+                assert grid[w, slot] == expected
+
+
+class TestWorkerDayState:
+    """Juoksevat laskurit vastaavat listasta laskettuja arvoja."""
+
+    def test_counters_follow_updates(self):
+        rng = random.Random(13)
+        for _ in range(200):
+            state = sea_watch_17.WorkerDayState()
+            ref = [False] * 48
+            for _ in range(40):
+                if rng.random() < 0.1:
+                    start = rng.randint(0, 47)
+                    end = rng.randint(start, 48)
+                    values = [rng.random() < 0.5 for _ in range(end - start)]
+                    state[start:end] = values
+                    ref[start:end] = values
+                else:
+                    slot = rng.randint(0, 47)
+                    state[slot] = ref[slot] = rng.random() < 0.6
+
+                assert state == ref
+                assert state.hours == sum(ref) / 2
+                assert state.block_count == len(sea_watch_17.get_work_blocks(ref))
+                assert state.night_hours == sum(
+                    1 for s, w in enumerate(ref)
+                    if w and (s < sea_watch_17.NORMAL_START or s >= sea_watch_17.NORMAL_END)
+                ) / 2
+                expected_last = max((s for s, w in enumerate(ref) if w), default=-1)
+                expected_first = min((s for s, w in enumerate(ref) if w), default=-1)
+                assert state.last_work_slot == expected_last
+                assert state.first_work_slot == expected_first
+
+    def test_day_schedule_keeps_masks(self):
+        arrival = [False] * 48
+        arrival[12] = True
+        state = sea_watch_17.WorkerDayState(masks={'arrival_slots': arrival})
+        sea_watch_17.add_block(state, 12, 14)
+        day = state.to_day_schedule()
+        assert day['arrival_slots'][12]
+        assert sum(day['work_slots']) == 2
+
+
+class TestConstraintIndex:
+    """Käännetty rajoitehakemisto vastaa listan läpikäyntiä."""
+
+    def _random_constraints(self, rng):
+        workers = sea_watch_17.DAYMEN + [None]
+        constraints = []
+        for _ in range(rng.randint(0, 8)):
+            c_type = rng.choice([
+                'no_night_shift', 'no_evening_shift', 'cannot_work_slot', 'must_work_slot',
+                'max_hours', 'min_hours', 'day_off', 'assign_night_shift',
+            ])
+            c = {'type': c_type, 'worker': rng.choice(workers)}
+            if rng.random() < 0.5:
+                c['day'] = rng.randint(1, 3)
+            if c_type in ('cannot_work_slot', 'must_work_slot'):
+                c['start_time'] = f"{rng.randint(0, 23):02d}:{rng.choice(['00', '30'])}"
+                c['end_time'] = f"{rng.randint(0, 24):02d}:00"
+            if c_type in ('max_hours', 'min_hours'):
+                c['value'] = rng.choice([6, 8, 9, 11])
+            constraints.append(c)
+        return constraints
+
+    def test_index_matches_list_scan(self):
+        rng = random.Random(14)
+        for _ in range(150):
+            constraints = self._random_constraints(rng)
+            index = sea_watch_17.compile_constraints(constraints)
+            for worker in sea_watch_17.DAYMEN:
+                assert sea_watch_17.get_min_hours(worker, index) == sea_watch_17.get_min_hours(worker, constraints)
+                assert sea_watch_17.get_max_hours(worker, index) == sea_watch_17.get_max_hours(worker, constraints)
+                for day_idx in range(3):
+                    assert (sea_watch_17.is_day_off(worker, day_idx, index)
+                            == sea_watch_17.is_day_off(worker, day_idx, constraints))
+                    for slot in range(48):
+                        hours = rng.choice([0, 7.5, 9, 10.5])
+                        assert (sea_watch_17.can_work_slot(worker, slot, day_idx, index, hours)
+                                == sea_watch_17.can_work_slot(worker, slot, day_idx, constraints, hours))
+                        assert (sea_watch_17.must_work_slot(worker, slot, day_idx, index)
+                                == sea_watch_17.must_work_slot(worker, slot, day_idx, constraints))
+            for day_idx in range(3):
+                assert (sea_watch_17.get_preferred_night_worker(day_idx, index, ['Dayman PH1', 'Dayman PH2'])
+                        == sea_watch_17.get_preferred_night_worker(day_idx, constraints, ['Dayman PH1', 'Dayman PH2']))
+
+
+class TestDayTimes:
+    """parse_day_times palauttaa muuttumattoman, dict-yhteensopivan DayTimesin."""
+
+    INFO = {
+        'arrivals': [{'hour': 6, 'minute': 0}, {'hour': 18, 'minute': 30}],
+        'departures': [{'hour': 21, 'minute': 0}],
+        'port_operations': [
+            {'start_hour': 5, 'start_minute': 0, 'end_hour': 9, 'end_minute': 0},
+            {'start_hour': 16, 'start_minute': 0, 'end_hour': 2, 'end_minute': 0},
+        ],
+        'sluice_arrivals': [{'hour': 1, 'minute': 0}],
+        'sluice_departures': [{'hour': 23, 'minute': 0}],
+        'shiftings': [{'hour': 13, 'minute': 0}],
+    }
+
+    def test_dict_compatible_and_immutable(self):
+        times = sea_watch_17.parse_day_times(self.INFO)
+        assert times['op_start'] == 10
+        assert times['op_end'] == 48
+        assert times.get('arrival_starts', []) == (10, 35)
+        assert times['departure_start'] == 42
+        assert 'shifting_starts' in times
+        assert times.get('unknown') is None
+        with pytest.raises(AttributeError):
+            times.op_start = 0
+        assert sea_watch_17.DayTimes.from_dict(dict(times.items())) == times
+
+    def test_bitmasks_match_slot_rules(self):
+        times = sea_watch_17.parse_day_times(self.INFO)
+        as_dict = dict(times.items())
+        for slot in range(-1, 50):
+            assert sea_watch_17.is_op_slot(times, slot) == sea_watch_17.is_op_slot(as_dict, slot)
+        for slot in range(48):
+            is_op = sea_watch_17.is_op_slot(as_dict, slot)
+            normal = sea_watch_17.NORMAL_START <= slot < sea_watch_17.NORMAL_END
+            lunch = sea_watch_17.LUNCH_START <= slot < sea_watch_17.LUNCH_END
+            assert bool(times.op_outside_bits >> slot & 1) == (is_op and not normal)
+            assert bool(times.op_inside_bits >> slot & 1) == (is_op and normal and not lunch)
+            assert bool(times.sluice_dep_bits >> slot & 1) == (46 <= slot < 48)
+            assert bool(times.arrival_bits >> slot & 1) == (slot in (10, 11, 35, 36))
+
+    def test_short_night_op_extends_night_shift(self):
+        """Lyhyt yöoperaatio (01-05) ei kaada yövuoron laajennusta."""
+        all_days = run_scenario(
+            arrival_hour=None, departure_hour=None,
+            op_start_hour=1, op_end_hour=5
+        )
+        for dm in sea_watch_17.DAYMEN:
+            assert len(all_days[dm][0]['work_slots']) == 48
+
+
+class TestExactDay:
+    """engine="exact": daymenien päivä branch-and-boundilla."""
+
+    WORKERS = ['Dayman EU', 'Dayman PH1', 'Dayman PH2']
+    NORMAL = sum(1 << s for s in range(16, 34) if s != 23)
+    PENALTY = ((1 << 48) - 1) & ~NORMAL
+
+    def _problem(self, **overrides):
+        problem = {
+            'workers': self.WORKERS,
+            'prev_bits': {w: 0 for w in self.WORKERS},
+            'next_bits': self.NORMAL,
+            'forced': {},
+            'forbidden': {},
+            'min_slots': {w: 16 for w in self.WORKERS},
+            'max_slots': {w: 20 for w in self.WORKERS},
+            'cover_bits': self.NORMAL,
+            'penalty_bits': self.PENALTY,
+        }
+        problem.update(overrides)
+        return problem
+
+    @pytest.mark.daily_hours
+    def test_normal_day_is_proven_optimal(self):
+        from exact_day import solve_day_exact
+        result = solve_day_exact(time_budget=5.0, **self._problem())
+        assert result['optimal']
+        # Jokainen tekee 8h yhtenä blokkina lounaan yli: 3 * (blokki 5 + lounas 3)
+        assert result['cost'] == 24
+        covered = 0
+        for w in self.WORKERS:
+            assert result['work'][w].bit_count() == 16
+            covered |= result['work'][w]
+        assert covered & self.NORMAL == self.NORMAL
+
+    @pytest.mark.stcw_rest
+    def test_respects_forced_forbidden_and_stcw(self):
+        from exact_day import evaluate_day, solve_day_exact
+        late = sum(1 << s for s in range(40, 48))   # edellinen päivä 20-24
+        departure = (1 << 38) | (1 << 39)
+        problem = self._problem(
+            prev_bits={'Dayman EU': late, 'Dayman PH1': 0, 'Dayman PH2': 0},
+            forced={w: 3 << 14 for w in self.WORKERS},
+            forbidden={'Dayman PH1': sum(1 << s for s in range(26, 28))},
+            demand_bits=departure,
+        )
+        greedy = {
+            'Dayman EU': sum(1 << s for s in range(14, 30)),
+            'Dayman PH1': sum(1 << s for s in list(range(14, 26)) + list(range(28, 32)) + [38, 39]),
+            'Dayman PH2': sum(1 << s for s in list(range(14, 28)) + list(range(32, 40))),
+        }
+        result = solve_day_exact(time_budget=0.5, incumbent=greedy, **problem)
+        work = result['work']
+        assert result['cost'] <= result['incumbent_cost']
+        assert result['cost'] == evaluate_day(
+            self.WORKERS, work, problem['cover_bits'], self.PENALTY, problem['min_slots'])
+        for w in self.WORKERS:
+            assert work[w] & problem['forced'][w] == problem['forced'][w]
+            assert not work[w] & problem['forbidden'].get(w, 0)
+            assert stcw_ok_bits(problem['prev_bits'][w], work[w])
+            assert stcw_ok_bits(work[w], self.NORMAL)
+        assert sum(work[w] & departure == departure for w in self.WORKERS) >= 2
+
+    def test_forced_blocks_count_against_block_cap(self):
+        from itertools import combinations
+        from exact_day import _blocks, evaluate_day, solve_day_exact
+        # Kolme pakollista blokkia ja raja 3: aikaisen op-slotin kattaminen
+        # olisi neljäs blokki, joten se jää kattamatta
+        worker = 'Dayman EU'
+        forced = sum(1 << s for s in (20, 24, 28))
+        free = [10, 11, 21, 25]
+        problem = self._problem(
+            workers=[worker], prev_bits={worker: 0}, next_bits=0,
+            forced={worker: forced},
+            forbidden={worker: ((1 << 48) - 1) & ~forced & ~sum(1 << s for s in free)},
+            min_slots={worker: 5}, max_slots={worker: 10},
+            cover_bits=(1 << 10) | (1 << 11),
+        )
+        result = solve_day_exact(max_blocks=3, time_budget=5.0, **problem)
+        assert result['optimal'] and _blocks(result['work'][worker]) <= 3
+
+        # Täydellinen läpikäynti samalla blokkirajalla
+        best = min(
+            evaluate_day([worker], {worker: bits}, problem['cover_bits'],
+                         self.PENALTY, problem['min_slots'])
+            for k in range(len(free) + 1)
+            for picked in combinations(free, k)
+            for bits in [forced | sum(1 << s for s in picked)]
+            if _blocks(bits) <= 3
+        )
+        assert result['cost'] == best
+
+    @pytest.mark.daily_hours
+    def test_generate_schedule_exact_engine(self):
+        days_data = [
+            {'arrival_hour': 8, 'arrival_minute': 0, 'departure_hour': 19, 'departure_minute': 0,
+             'port_op_start_hour': 10, 'port_op_start_minute': 0,
+             'port_op_end_hour': 18, 'port_op_end_minute': 0},
+            {'arrival_hour': None, 'arrival_minute': 0, 'departure_hour': None, 'departure_minute': 0,
+             'port_op_start_hour': 8, 'port_op_start_minute': 0,
+             'port_op_end_hour': 17, 'port_op_end_minute': 0},
+        ]
+        with pytest.raises(ValueError):
+            generate_schedule(days_data, engine='unknown')
+        _, all_days, _ = generate_schedule(days_data, engine='exact', exact_time_budget=0.3)
+        for dm in self.WORKERS:
+            prev = [False] * 48
+            for day in all_days[dm]:
+                work = list(day['work_slots'])
+                assert 8 <= sum(work) / 2 <= 10
+                assert check_stcw_sliding(prev, work)[0]
+                prev = work
+        # Lähdössä kaksi daymania merkittynä
+        marked = sum(all_days[dm][0]['departure_slots'][38] for dm in self.WORKERS)
+        assert marked == 2
+
+
+    @pytest.mark.special_ops
+    def test_greedy_evening_op_coverage_is_kept(self):
+        from sea_watch_17 import score_schedule
+        # Op 18-24: ahne päivä rikkoo STCW:n vain oletettuun 08-16 päivään
+        # nähden; tarkka tulos ei saa vaihtaa todellista kattavuutta siihen
+        days_data = [
+            {'arrival_hour': None, 'arrival_minute': 0, 'departure_hour': None, 'departure_minute': 0,
+             'port_op_start_hour': 18, 'port_op_start_minute': 0,
+             'port_op_end_hour': 0, 'port_op_end_minute': 0},
+        ]
+        _, greedy, _ = generate_schedule(days_data)
+        _, exact, _ = generate_schedule(days_data, engine='exact', exact_time_budget=0.3)
+        for slot in range(time_to_slot(18, 0), 48):
+            assert any(exact[dm][0]['work_slots'][slot] for dm in self.WORKERS)
+        assert score_schedule(exact, days_data) <= score_schedule(greedy, days_data)
+
+class TestLocalSearch:
+    """Aikarajattu paikallishaku (local_search.improve_day, improve_time_budget)."""
+
+    WORKERS = TestExactDay.WORKERS
+    NORMAL = TestExactDay.NORMAL
+    PENALTY = TestExactDay.PENALTY
+
+    @pytest.mark.daily_hours
+    def test_improves_and_respects_masks(self):
+        from local_search import improve_day
+        forced = {w: 3 << 16 for w in self.WORKERS}
+        forbidden = {'Dayman PH1': sum(1 << s for s in range(30, 34))}
+        # Lähtö: kaikki yössä pitkään, yksi liian vähän tunteja
+        work = {
+            'Dayman EU': sum(1 << s for s in range(16, 40)) & ~(1 << 23),
+            'Dayman PH1': sum(1 << s for s in range(16, 24)),
+            'Dayman PH2': sum(1 << s for s in range(16, 34)),
+        }
+        result = improve_day(
+            workers=self.WORKERS, work=work, prev_bits={w: 0 for w in self.WORKERS},
+            next_bits=self.NORMAL, forced=forced, forbidden=forbidden,
+            min_slots={w: 16 for w in self.WORKERS}, max_slots={w: 20 for w in self.WORKERS},
+            cover_bits=self.NORMAL, penalty_bits=self.PENALTY, time_budget=0.2, seed=1,
+        )
+        assert result['cost_after'] < result['cost_before']
+        assert result['moves'] > 0 and result['moves_per_second'] > 0
+        for w in self.WORKERS:
+            bits = result['work'][w]
+            assert bits & forced[w] == forced[w]
+            assert not bits & forbidden.get(w, 0)
+            assert bits.bit_count() <= 20
+            assert stcw_ok_bits(0, bits)
+
+    def test_move_budget_is_reproducible(self):
+        from local_search import improve_day
+        work = {
+            'Dayman EU': sum(1 << s for s in range(16, 40)) & ~(1 << 23),
+            'Dayman PH1': sum(1 << s for s in range(16, 24)),
+            'Dayman PH2': sum(1 << s for s in range(16, 34)),
+        }
+        results = [
+            improve_day(
+                workers=self.WORKERS, work=work, prev_bits={w: 0 for w in self.WORKERS},
+                next_bits=self.NORMAL, forced={}, forbidden={},
+                min_slots={w: 16 for w in self.WORKERS}, max_slots={w: 20 for w in self.WORKERS},
+                cover_bits=self.NORMAL, penalty_bits=self.PENALTY, seed=3, max_moves=2000,
+            )
+            for _ in range(2)
+        ]
+        first, second = results
+        assert first['work'] == second['work'] and first['cost_after'] == second['cost_after']
+        assert first['proposals'] == 2000
+        # Vain arvioidut siirrot lasketaan
+        assert 0 < first['moves'] < first['proposals']
+        assert first['moves'] == second['moves']
+
+    @pytest.mark.daily_hours
+    def test_generate_schedule_reports_improvement(self):
+        days_data = [
+            {'arrival_hour': 6, 'arrival_minute': 0, 'departure_hour': 21, 'departure_minute': 0,
+             'port_op_start_hour': 8, 'port_op_start_minute': 0,
+             'port_op_end_hour': 20, 'port_op_end_minute': 0},
+        ]
+        _, greedy_days, greedy_report = generate_schedule(days_data)
+        _, all_days, report = generate_schedule(days_data, improve_time_budget=0.1)
+        assert 'Paikallishaku' not in greedy_report
+        lines = [line for line in report.splitlines() if line.startswith('Paikallishaku')]
+        assert len(lines) == 1 and 'siirtoa' in lines[0]
+        before, after = lines[0].split('tavoite ')[1].split(',')[0].split(' -> ')
+        assert int(after) <= int(before)
+        for dm in self.WORKERS:
+            work = list(all_days[dm][0]['work_slots'])
+            assert all_days[dm][0]['arrival_slots'] == greedy_days[dm][0]['arrival_slots']
+            assert check_stcw_sliding([False] * 48, work)[0] or not check_stcw_sliding(
+                [False] * 48, list(greedy_days[dm][0]['work_slots']))[0]
+
+
+    @pytest.mark.parametrize('ops', [
+        [(14, 0, 20, None), (14, 16, None, None), (10, 20, None, 21)],
+        [(8, 20, None, None), (18, 0, None, 7), (6, 22, None, None), (14, 20, None, None),
+         (18, 22, 20, 7)],
+    ])
+    @pytest.mark.daily_hours
+    def test_voyage_score_never_worse_than_greedy(self, ops):
+        from sea_watch_17 import score_schedule
+        days_data = make_voyage(len(ops), {
+            day_idx: {'port_op_start_hour': start, 'port_op_end_hour': end,
+                      'arrival_hour': arrival, 'departure_hour': departure}
+            for day_idx, (start, end, arrival, departure) in enumerate(ops)
+        })
+        _, greedy, _ = generate_schedule(days_data)
+        for seed in range(3):
+            _, improved, _ = generate_schedule(days_data, improve_time_budget=0.05, improve_seed=seed)
+            assert score_schedule(improved, days_data) <= score_schedule(greedy, days_data)
+
+    def test_kept_greedy_result_drops_improve_lines(self, monkeypatch):
+        from functools import partial
+        import local_search
+        # Päivä 1 paranee omaa oletettua seuraavaa päivää vasten, mutta matka
+        # huononee: ahne tulos pidetään ilman hylätyn haun rivejä. Siirtobudjetti
+        # tekee hausta toistettavan.
+        monkeypatch.setattr(sea_watch_17, 'improve_day',
+                            partial(local_search.improve_day, max_moves=1000))
+        days_data = make_voyage(2, {0: {'port_op_start_hour': 8, 'port_op_end_hour': 22},
+                                    1: {'port_op_start_hour': 14, 'port_op_end_hour': 0}})
+        _, greedy, greedy_report = generate_schedule(days_data)
+        _, kept, report, state = generate_schedule(
+            days_data, improve_time_budget=10, return_state=True)
+        lines = report.splitlines()
+        assert lines[-1].endswith('käytetään ahnetta tulosta')
+        assert not any(line.startswith('Paikallishaku') for line in lines)
+        assert lines[:-1] == greedy_report.splitlines()
+        for worker in greedy:
+            assert ([list(day['work_slots']) for day in kept[worker]]
+                    == [list(day['work_slots']) for day in greedy[worker]])
+        assert state['day_index'] == 2
+
+class TestPortfolio:
+    """portfolio.generate_portfolio: paras usean heuristiikkamuunnelman tuloksista."""
+
+    DAYS = [
+        {'arrival_hour': 18, 'arrival_minute': 0, 'departure_hour': None, 'departure_minute': 0,
+         'port_op_start_hour': 19, 'port_op_start_minute': 0,
+         'port_op_end_hour': 0, 'port_op_end_minute': 0},
+        {'arrival_hour': None, 'arrival_minute': 0, 'departure_hour': 13, 'departure_minute': 0,
+         'port_op_start_hour': 0, 'port_op_start_minute': 0,
+         'port_op_end_hour': 12, 'port_op_end_minute': 0},
+    ]
+
+    def _work(self, all_days):
+        return {w: [list(d['work_slots']) for d in days] for w, days in all_days.items()}
+
+    @pytest.mark.daily_hours
+    def test_default_variant_matches_plain_generation(self):
+        _, plain, _ = generate_schedule(self.DAYS)
+        _, default, _ = generate_schedule(self.DAYS, variant={})
+        assert self._work(plain) == self._work(default)
+        with pytest.raises(ValueError):
+            generate_schedule(self.DAYS, variant={'unknown': 1})
+        with pytest.raises(ValueError):
+            generate_schedule(self.DAYS, variant={'dayman_order': ['Dayman EU']})
+
+    @pytest.mark.daily_hours
+    def test_best_variant_is_never_worse_than_default(self):
+        from portfolio import generate_portfolio
+        from sea_watch_17 import score_schedule
+        _, plain, _ = generate_schedule(self.DAYS)
+        _, all_days, report, summary = generate_portfolio(self.DAYS, variants=4, max_workers=1)
+        assert summary['completed'] == 4
+        assert summary['scores'][0] == score_schedule(plain, self.DAYS)
+        assert summary['score'] == min(summary['scores'].values())
+        assert summary['score'] == score_schedule(all_days, self.DAYS)
+        assert report.startswith('Päivä 1')
+
+        # Aikaraja 0: vain oletusmuunnelma ehtii
+        _, capped, _, capped_summary = generate_portfolio(
+            self.DAYS, variants=4, max_workers=1, time_limit=0)
+        assert capped_summary['completed'] == 1 and capped_summary['best'] == 0
+        assert self._work(capped) == self._work(plain)
+
+    @pytest.mark.daily_hours
+    def test_process_pool_gives_same_result_as_serial(self):
+        from portfolio import generate_portfolio
+        _, serial, _, serial_summary = generate_portfolio(self.DAYS, variants=3, max_workers=1)
+        _, pooled, _, pooled_summary = generate_portfolio(self.DAYS, variants=3, max_workers=2)
+        assert pooled_summary['scores'] == serial_summary['scores']
+        assert self._work(pooled) == self._work(serial)
+        assert not pooled_summary['greedy_fallback']
+
+    def test_time_limit_replaces_late_default_with_greedy(self):
+        from portfolio import generate_portfolio
+        _, greedy, _ = generate_schedule(self.DAYS)
+        _, capped, _, summary = generate_portfolio(
+            self.DAYS, variants=3, max_workers=2, time_limit=0,
+            engine='exact', exact_time_budget=5.0)
+        # Tarkka oletus ei ehdi aikarajaan: tilalle ahne oletus
+        assert summary['greedy_fallback'] and summary['best'] == 0
+        assert summary['completed'] == 0
+        assert summary['elapsed'] < 5.0
+        assert self._work(capped) == self._work(greedy)
+
+
+class TestDayMemo:
+    """generate_schedule laskee muokkauksen jälkeen vain muuttuneen päivän ja sen jälkeiset."""
+
+    CHANGES = {
+        0: {'arrival_hour': 6, 'port_op_start_hour': 7, 'port_op_end_hour': 0},
+        1: {'port_op_start_hour': 0, 'port_op_end_hour': 20, 'sluice_arrival_hour': 22},
+    }
+
+    def _work(self, all_days):
+        return {w: [d.to_dict() for d in days] for w, days in all_days.items()}
+
+    def test_edit_recomputes_only_changed_day_and_after(self):
+        sea_watch_17.DAY_MEMO.clear()
+        days = make_voyage(4, self.CHANGES)
+        generate_schedule(days)
+        assert sea_watch_17.day_memo_info()['misses'] == 4
+
+        days[2].update(departure_hour=15)
+        _, all_days, report = generate_schedule(days)
+        info = sea_watch_17.day_memo_info()
+        # Päivät 1-2 muistista, päivä 3 lasketaan; päivä 4 saadaan muistista
+        # koska muutos ei muuttanut sille kulkevaa tilaa
+        assert (info['hits'], info['misses']) == (3, 5)
+
+        previous = sea_watch_17.set_day_memo_size(0)
+        try:
+            _, fresh, fresh_report = generate_schedule(days)
+        finally:
+            sea_watch_17.set_day_memo_size(previous)
+        assert self._work(all_days) == self._work(fresh)
+        assert report == fresh_report
+
+    def test_returned_days_do_not_alias_memo(self):
+        sea_watch_17.DAY_MEMO.clear()
+        _, first, _ = generate_schedule(make_voyage(4, self.CHANGES))
+        expected = self._work(first)
+        first['Dayman EU'][0]['work_slots'] = [True] * 48
+
+        _, second, _ = generate_schedule(make_voyage(4, self.CHANGES))
+        assert sea_watch_17.day_memo_info()['hits'] == 4
+        assert self._work(second) == expected
+
+
+class TestEditRepair:
+    """repair_after_edit: muokatut solut lukitaan ja vain lähipäivät korjataan."""
+
+    @pytest.mark.special_ops
+    def test_lost_op_coverage_is_restored_around_pinned_rest(self):
+        days = make_voyage(4)
+        _, all_days, _ = generate_schedule(days)
+        slot = time_to_slot(16, 30)
+        workers = [w for w in sea_watch_17.DAYMEN if all_days[w][1]['work_slots'][slot]]
+        assert len(workers) == 1
+        edits = {(workers[0], 1, slot): False}
+
+        repaired, summary = sea_watch_17.repair_after_edit(all_days, days, edits)
+        assert summary['days'] == [1, 2]
+        assert not repaired[workers[0]][1]['work_slots'][slot]
+        assert any(repaired[w][1]['work_slots'][slot] for w in sea_watch_17.DAYMEN)
+        # Syöte ei muutu ja korjaamattomat päivät jaetaan
+        assert all_days[workers[0]][1]['work_slots'][slot]
+        assert repaired['Dayman EU'][0] is all_days['Dayman EU'][0]
+        assert repaired['Dayman EU'][3] is all_days['Dayman EU'][3]
+
+    @pytest.mark.stcw_rest
+    def test_pinned_late_shift_is_kept_and_next_day_is_repaired(self):
+        days = make_voyage(4)
+        _, all_days, _ = generate_schedule(days)
+        # PH1 tekee 8,5 h; työ klo 23 asti jättää yöksi liian vähän lepoa
+        edits = {('Dayman PH1', 0, slot): True for slot in range(34, 46)}
+
+        naive = {w: [d.copy() for d in all_days[w]] for w in all_days}
+        for (w, d, slot), value in edits.items():
+            naive[w][d]['work_slots'][slot] = value
+        repaired, summary = sea_watch_17.repair_after_edit(all_days, days, edits)
+
+        def violations(schedule):
+            prev = pack_slots(schedule['Dayman PH1'][0]['work_slots'])
+            return bin(stcw_violation_mask(prev, pack_slots(schedule['Dayman PH1'][1]['work_slots']))).count('1')
+
+        assert all(repaired['Dayman PH1'][0]['work_slots'][s] for s in range(34, 46))
+        assert violations(naive) > 0
+        assert violations(repaired) < violations(naive)
+        assert summary['moves'] > 0
+
+    @pytest.mark.stcw_rest
+    def test_sluice_move_keeps_real_next_day_in_forward_check(self):
+        # EU: työ 08-15 ja slussi 18-24; seuraavana päivänä työ 00-09 ja
+        # samoissa sloteissa 18-24
+        empty = lambda: {dm: [False] * 48 for dm in sea_watch_17.DAYMEN}
+        dm_work = empty()
+        dm_work['Dayman EU'] = [16 <= s < 30 and s != 23 or s >= 36 for s in range(48)]
+        dm_sluice = empty()
+        dm_sluice['Dayman EU'] = [s >= 36 for s in range(48)]
+        next_day = empty()
+        next_day['Dayman EU'] = [s < 18 or s >= 36 for s in range(48)]
+        times = sea_watch_17.parse_day_times({'arrivals': [], 'departures': [],
+                                              'port_operations': []})
+
+        stats = sea_watch_17.fix_stcw_violations(
+            dm_work, empty(), empty(), empty(), dm_sluice, empty(),
+            list(sea_watch_17.DAYMEN), 0, times, [], empty(), next_day=next_day)
+
+        # Slussisiirto ei saa pudottaa seuraavan päivän samaa slottia
+        # eteenpäin-tarkistuksesta: ratkaistuksi merkityllä ei ole rikettä
+        assert stats['moves'] > 0
+        remaining = stcw_violation_mask(pack_slots(dm_work['Dayman EU']),
+                                        pack_slots(next_day['Dayman EU']))
+        assert remaining == 0 or 'Dayman EU' in stats['unresolved']
+
+
+class TestScheduleStream:
+    """generate_schedule_iter luovuttaa päivät heti ja virtakirjoittimet tuottavat saman tuloksen."""
+
+    @pytest.mark.parametrize('use_next_day_events', [False, True])
+    def test_stream_matches_generate_schedule_and_reads_source_lazily(self, use_next_day_events):
+        days = night_and_sluice_voyage()
+        _, all_days, _ = generate_schedule(days, use_next_day_events=use_next_day_events)
+
+        read = []
+
+        def source():
+            for info in days:
+                read.append(info)
+                yield info
+
+        stream = sea_watch_17.generate_schedule_iter(source(), use_next_day_events=use_next_day_events)
+        day_idx, first = next(stream)
+        assert day_idx == 0
+        assert len(read) == (2 if use_next_day_events else 1)
+
+        streamed = [first] + [day for _, day in stream]
+        assert len(streamed) == len(days)
+        for d, day in enumerate(streamed):
+            for worker in sea_watch_17.WORKERS:
+                assert day[worker].to_bytes() == all_days[worker][d].to_bytes()
+
+    def test_sinks_round_trip_and_match_workbook(self):
+        days = night_and_sluice_voyage()
+        wb, all_days, _ = generate_schedule(days)
+        streamed = list(sea_watch_17.generate_schedule_iter(days))
+
+        text = io.StringIO()
+        assert sea_watch_17.write_schedule_jsonl(streamed, text) == len(days)
+        text.seek(0)
+        for (d, day), (d_back, back) in zip(streamed, sea_watch_17.read_schedule_jsonl(text)):
+            assert d == d_back
+            assert {w: s.to_bytes() for w, s in day.items()} == {w: s.to_bytes() for w, s in back.items()}
+
+        buffer = BytesIO()
+        assert sea_watch_17.write_schedule_xlsx(streamed, buffer) == len(days)
+        buffer.seek(0)
+        ws = load_workbook(buffer).active
+        expected = wb.active
+        assert ws.max_row == expected.max_row
+        for row in range(1, expected.max_row + 1):
+            for col in range(1, 51):
+                got, want = ws.cell(row, col), expected.cell(row, col)
+                assert got.value == want.value
+                assert got.fill.fgColor.rgb == want.fill.fgColor.rgb
+
+    def test_invalid_settings_fail_before_iteration(self):
+        with pytest.raises(ValueError):
+            sea_watch_17.generate_schedule_iter(night_and_sluice_voyage(), engine='unknown')
+
+
+class TestScheduleState:
+    """initial_state / return_state: matkan voi generoida osissa samalla tuloksella."""
+
+    def test_chained_segments_match_full_voyage(self):
+        days = night_and_sluice_voyage(sluice_arrival_hour=23)
+        constraints = [{'worker': 'Dayman PH1', 'type': 'day_off', 'day': 5}]
+        _, full, _ = generate_schedule(days, constraints=constraints)
+
+        previous = sea_watch_17.set_day_memo_size(0)
+        try:
+            state = None
+            chained = {w: [] for w in sea_watch_17.WORKERS}
+            # Leikkaukset jatkuvan yön ja slussipäivän jälkeen
+            for start, end in ((0, 2), (2, 4), (4, 6)):
+                _, segment, _, state = generate_schedule(
+                    days[start:end], constraints=constraints,
+                    initial_state=state, return_state=True
+                )
+                state = json.loads(json.dumps(state))
+                assert state['day_index'] == end
+                for worker in sea_watch_17.WORKERS:
+                    chained[worker].extend(segment[worker])
+        finally:
+            sea_watch_17.set_day_memo_size(previous)
+
+        for worker in sea_watch_17.WORKERS:
+            assert [d.to_bytes() for d in chained[worker]] == [d.to_bytes() for d in full[worker]]
+
+    @pytest.mark.stcw_rest
+    def test_manual_day1_reaches_day2_stcw_checks(self):
+        days = make_voyage(3)
+        # PH1 tekee päivänä 1 töitä klo 15-24
+        manual = {'Dayman PH1': [slot >= 30 for slot in range(48)]}
+        _, all_days, _ = sea_watch_17.generate_schedule_with_manual_day1(days, manual)
+
+        assert all_days['Dayman PH1'][0]['work_slots'] == manual['Dayman PH1']
+        for dm in sea_watch_17.DAYMEN:
+            prev = pack_slots(all_days[dm][0]['work_slots'])
+            assert stcw_violation_mask(prev, pack_slots(all_days[dm][1]['work_slots'])) == 0
+
+    @pytest.mark.special_ops
+    def test_injected_carry_over_starts_the_segment(self):
+        state = {
+            'day_index': 3,
+            'pending_next_day': {'Dayman EU': {'work': [0, 1], 'sluice': [0, 1]}},
+        }
+        _, all_days, _, final = generate_schedule(
+            make_voyage(1), initial_state=state, return_state=True
+        )
+
+        eu = all_days['Dayman EU'][0]
+        assert eu['work_slots'][0] and eu['work_slots'][1]
+        assert eu['sluice_slots'][0] and eu['sluice_slots'][1]
+        assert final['day_index'] == 4
+        assert final['prev_day_work']['Dayman EU'] == list(eu['work_slots'])
+
+    def test_unknown_state_key_is_rejected(self):
+        with pytest.raises(ValueError):
+            generate_schedule(make_voyage(1), initial_state={'prev_work': {}})
+
+
+class TestParallelSegments:
+    """parallel_segments: nollakohdissa jaetut segmentit rinnakkain, tulos sama kuin peräkkäin."""
+
+    def _assert_same(self, days, **kwargs):
+        from parallel_segments import generate_schedule_parallel
+        _, sequential, report = generate_schedule(days, **kwargs)
+        _, parallel, parallel_report, summary = generate_schedule_parallel(
+            days, max_workers=2, min_segment_days=2, **kwargs
+        )
+        assert summary['parallel']
+        assert parallel_report == report
+        for worker in sea_watch_17.WORKERS:
+            assert [d.to_bytes() for d in parallel[worker]] == [d.to_bytes() for d in sequential[worker]]
+        return summary
+
+    def test_reset_points_exclude_night_work_sluices_and_continuous_nights(self):
+        days = make_voyage(7)
+        days[1].update(port_op_start_hour=10, port_op_end_hour=0)
+        days[2].update(port_op_start_hour=0, port_op_end_hour=17)
+        days[4].update(sluice_arrival_hour=22)
+        assert sea_watch_17.find_reset_points(days) == [1, 4, 6]
+
+    @pytest.mark.parametrize('use_next_day_events', [False, True])
+    def test_parallel_matches_sequential_byte_for_byte(self, use_next_day_events):
+        days = make_voyage(6)
+        days[2].update(departure_hour=20)
+        days[4].update(arrival_hour=6)
+        summary = self._assert_same(days, use_next_day_events=use_next_day_events)
+        assert len(summary['segments']) == 3
+
+    def test_wrong_speculated_state_is_recomputed(self):
+        days = make_voyage(6)
+        # Päivän 1 op jatkuu keskiyöhön, joten lämmittely tyhjästä tilasta
+        # antaa päivälle 2 eri työn kuin todellinen ajo
+        days[0].update(port_op_end_hour=0)
+        summary = self._assert_same(days)
+        assert summary['segments'] == [(0, 2), (2, 4), (4, 6)]
+        assert summary['recomputed'] == [1]
+
+    def test_initial_state_and_return_state_match_sequential(self):
+        from parallel_segments import generate_schedule_parallel
+        days = make_voyage(8)
+        days[1].update(port_op_end_hour=0)
+        days[4].update(arrival_hour=6)
+        _, _, _, state = generate_schedule(days[:2], return_state=True)
+        _, sequential, report, final = generate_schedule(
+            days[2:], initial_state=state, return_state=True)
+        _, parallel, parallel_report, summary, parallel_final = generate_schedule_parallel(
+            days[2:], max_workers=2, min_segment_days=2, initial_state=state, return_state=True)
+        assert summary['parallel']
+        assert parallel_report == report and parallel_final == final
+        for worker in sea_watch_17.WORKERS:
+            assert [d.to_bytes() for d in parallel[worker]] == [d.to_bytes() for d in sequential[worker]]
+
+        # Yksi segmentti ajetaan peräkkäin, palautusmuoto on sama
+        result = generate_schedule_parallel(days[2:4], initial_state=state, return_state=True)
+        assert len(result) == 5 and not result[3]['parallel']
+        assert len(generate_schedule_parallel(days[2:4])) == 4
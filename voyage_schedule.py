@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+VoyageSchedule - Koko matkan vuorot NumPy-taulukkoina
+
+Jokaiselle kategorialle (DAY_FIELDS: work_slots, arrival_slots, ...) on yksi
+bool-taulukko muotoa (päivät, työntekijät, 48). Miehistön ja matkan yli
+lasketut asiat (tunnit per päivä, kattavuus per slotti, näyttötaulukot)
+ovat yksittäisiä taulukko-operaatioita sisäkkäisten silmukoiden sijaan.
+
+    voyage = VoyageSchedule.from_all_days(all_days, WORKERS)
+    voyage['Dayman EU'][0]['work_slots'][16]   # näkymä, ei kopiota
+    voyage.hours()                              # (päivät, työntekijät)
+    voyage.to_dataframe(0, DISPLAY_TIME_COLS, symbols=...)
+
+Päivän kentät ovat NumPy-näkymiä taulukkoon: indeksointi, len, iterointi,
+sum ja any toimivat kuten listoilla ja kirjoitus päivittää taulukon.
+Huom: näkymien '+' laskee alkioittain, ei yhdistä listoja; käytä
+list(...) + list(...) tai to_all_days() jos tarvitset listasemantiikan.
+
+NumPy on valinnainen riippuvuus; ilman sitä NUMPY_AVAILABLE on False.
+"""
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+from day_schedule import DAY_FIELDS, DaySchedule
+
+
+SLOTS_PER_DAY = 48
+
+
+class VoyageDay:
+    """Yhden työntekijän päivä: kentät ovat näkymiä VoyageSchedule-taulukkoihin."""
+
+    __slots__ = ('_voyage', '_day', '_worker')
+
+    def __init__(self, voyage, day_idx, worker_idx):
+        self._voyage = voyage
+        self._day = day_idx
+        self._worker = worker_idx
+
+    def __getitem__(self, field):
+        return self._voyage.arrays[field][self._day, self._worker]
+
+    def __setitem__(self, field, slots):
+        self._voyage.arrays[field][self._day, self._worker] = slots
+
+    def __contains__(self, field):
+        return field in self._voyage.arrays
+
+    def __iter__(self):
+        return iter(DAY_FIELDS)
+
+    def get(self, field, default=None):
+        if field in self._voyage.arrays:
+            return self[field]
+        return default
+
+    def keys(self):
+        return list(DAY_FIELDS)
+
+    def items(self):
+        return [(field, self[field]) for field in DAY_FIELDS]
+
+    def to_day_schedule(self):
+        return DaySchedule(**{field: self[field].tolist() for field in DAY_FIELDS})
+
+
+class VoyageWorker:
+    """Yhden työntekijän päivät (all_days[worker] -yhteensopiva)."""
+
+    __slots__ = ('_voyage', '_worker')
+
+    def __init__(self, voyage, worker_idx):
+        self._voyage = voyage
+        self._worker = worker_idx
+
+    def __len__(self):
+        return self._voyage.num_days
+
+    def __getitem__(self, day_idx):
+        if day_idx < 0:
+            day_idx += self._voyage.num_days
+        if not 0 <= day_idx < self._voyage.num_days:
+            raise IndexError("päivä indeksin ulkopuolella")
+        return VoyageDay(self._voyage, day_idx, self._worker)
+
+    def __iter__(self):
+        for d in range(self._voyage.num_days):
+            yield VoyageDay(self._voyage, d, self._worker)
+
+
+class VoyageSchedule:
+    """
+    Matkan vuorot taulukkoina: arrays[field] on (päivät, työntekijät, 48) bool.
+
+    voyage[worker][day][field] toimii kuten all_days, mutta palauttaa näkymän.
+    """
+
+    __slots__ = ('workers', 'arrays', '_worker_index')
+
+    def __init__(self, workers, num_days):
+        if not NUMPY_AVAILABLE:
+            raise RuntimeError("VoyageSchedule vaatii NumPy-kirjaston")
+        self.workers = list(workers)
+        self._worker_index = {w: i for i, w in enumerate(self.workers)}
+        shape = (num_days, len(self.workers), SLOTS_PER_DAY)
+        self.arrays = {field: np.zeros(shape, dtype=bool) for field in DAY_FIELDS}
+
+    @classmethod
+    def from_all_days(cls, all_days, workers=None):
+        """Rakentaa taulukot all_days-rakenteesta (DaySchedule tai dict)."""
+        if isinstance(all_days, VoyageSchedule):
+            return all_days
+        workers = list(workers) if workers is not None else list(all_days.keys())
+        num_days = max((len(all_days[w]) for w in workers), default=0)
+        voyage = cls(workers, num_days)
+        for w_idx, worker in enumerate(workers):
+            for d, day in enumerate(all_days[worker]):
+                if isinstance(day, DaySchedule):
+                    fields = np.unpackbits(
+                        np.frombuffer(day.to_bytes(), dtype=np.uint8), bitorder='little'
+                    ).reshape(len(DAY_FIELDS), SLOTS_PER_DAY).astype(bool)
+                    for i, field in enumerate(DAY_FIELDS):
+                        voyage.arrays[field][d, w_idx] = fields[i]
+                else:
+                    for field in DAY_FIELDS:
+                        slots = day.get(field)
+                        if slots is not None:
+                            voyage.arrays[field][d, w_idx] = slots
+        return voyage
+
+    def to_all_days(self):
+        """Takaisin all_days-muotoon ({worker: [DaySchedule, ...]})."""
+        return {
+            worker: [VoyageDay(self, d, w).to_day_schedule() for d in range(self.num_days)]
+            for w, worker in enumerate(self.workers)
+        }
+
+    @property
+    def num_days(self):
+        return self.arrays['work_slots'].shape[0]
+
+    def __getitem__(self, worker):
+        return VoyageWorker(self, self._worker_index[worker])
+
+    def __contains__(self, worker):
+        return worker in self._worker_index
+
+    def __iter__(self):
+        return iter(self.workers)
+
+    def keys(self):
+        return list(self.workers)
+
+    def copy(self):
+        voyage = VoyageSchedule.__new__(VoyageSchedule)
+        voyage.workers = list(self.workers)
+        voyage._worker_index = dict(self._worker_index)
+        voyage.arrays = {field: array.copy() for field, array in self.arrays.items()}
+        return voyage
+
+    # --- Koosteet ----------------------------------------------------------
+
+    def hours(self, field='work_slots'):
+        """Tunnit (päivät, työntekijät)."""
+        return self.arrays[field].sum(axis=2) / 2
+
+    def coverage(self, workers=None, field='work_slots'):
+        """Töissä olevien määrä per slotti (päivät, 48), valinnaisesti työntekijäjoukolle."""
+        array = self.arrays[field]
+        if workers is not None:
+            array = array[:, [self._worker_index[w] for w in workers]]
+        return array.sum(axis=1)
+
+    def symbols(self, day_idx, symbols):
+        """
+        Päivän näyttösymbolit (työntekijät, 48).
+
+        Args:
+            symbols: [(field, symbol), ...] prioriteettijärjestyksessä
+        """
+        conditions = [self.arrays[field][day_idx] for field, _ in symbols]
+        choices = [symbol for _, symbol in symbols]
+        return np.select(conditions, choices, default='')
+
+    def to_dataframe(self, day_idx, columns, symbols=None, field='work_slots',
+                     worker_column="Työntekijä"):
+        """
+        Päivä pandas DataFrameksi ilman rivikohtaisia dictejä.
+
+        Args:
+            columns: Sarakkeiden nimet (48 kpl tai osajoukko slottijärjestyksessä
+                     muodossa {nimi: slotti})
+            symbols: Jos annettu, solut ovat symboleja (ks. symbols()),
+                     muuten field-kentän bool-arvot
+        """
+        import pandas as pd
+
+        if symbols is not None:
+            values = self.symbols(day_idx, symbols)
+        else:
+            values = self.arrays[field][day_idx]
+
+        if isinstance(columns, dict):
+            names = list(columns.keys())
+            values = values[:, list(columns.values())]
+        else:
+            names = list(columns)
+            values = values[:, :len(names)]
+
+        df = pd.DataFrame(values, columns=names)
+        df.insert(0, worker_column, self.workers)
+        return df